@@ -0,0 +1,235 @@
+"""
+Batch mode: run many searches from a JSONL or CSV file in one warm HandelsRegister session.
+Results are written as they come in, a checkpoint file allows to resume a killed run.
+"""
+
+import argparse
+import copy
+import csv
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import tempfile
+from typing import Iterator, TextIO
+
+from courts import CourtIndex, CourtTable
+from handelsregister import HandelsRegister
+from planner import PlannedSearch, estimate_requests, format_plan, plan_queries
+from resilience import is_retryable
+
+# fields of a query and their defaults, the names are the same as the destinations of the command line arguments
+QUERY_DEFAULTS = {
+    'schlagwoerter' : None,
+    'schlagwortOptionen' : "all",
+    'registerNummer' : None,
+    'registerGericht' : None,
+    'currentHardCopy' : False,
+    'chronologicalHardCopy' : False,
+    'historicalHardCopy' : False,
+    'structuredContent' : False,
+    'downloadAllDocuments' : False,
+}
+LIST_FIELDS = ('schlagwoerter', 'registerNummer', 'registerGericht')
+FLAG_FIELDS = ('currentHardCopy', 'chronologicalHardCopy', 'historicalHardCopy',
+               'structuredContent', 'downloadAllDocuments')
+
+
+def normalize_query(raw : dict) -> dict:
+    "bring a query from the batch file into the form of the parsed command line arguments"
+    unknown = set(raw) - set(QUERY_DEFAULTS)
+    if unknown:
+        raise ValueError(f"unknown fields in query: {sorted(unknown)}")
+    query = dict(QUERY_DEFAULTS)
+    for field, value in raw.items():
+        if value is None or value == "":
+            continue
+        if field in LIST_FIELDS and isinstance(value, str):
+            value = value.split()
+        elif field in FLAG_FIELDS and isinstance(value, str):
+            value = value.strip().lower() in ("1", "true", "yes", "x")
+        query[field] = value
+    if not query['schlagwoerter']:
+        raise ValueError(f"query without keywords: {raw}")
+    if query['schlagwortOptionen'] not in ("all", "min", "exact"):
+        raise ValueError(f"invalid keyword option {query['schlagwortOptionen']}")
+    return query
+
+
+def read_queries(path : str | pathlib.Path) -> Iterator[dict]:
+    "read the raw queries from a JSONL file or, if the file ends with .csv, from a CSV file with a header line"
+    path = pathlib.Path(path)
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.suffix.lower() == ".csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def query_id(query : dict) -> str:
+    "stable id of a normalized query, used in the checkpoint"
+    return hashlib.sha256(json.dumps(query, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class Checkpoint:
+    "set of finished query ids, written atomically after every query"
+    def __init__(self, path : str | pathlib.Path) -> None:
+        self.path = pathlib.Path(path)
+        self.done : set[str] = set()
+        if self.path.exists():
+            self.done = set(json.loads(self.path.read_text(encoding="utf-8")).get('done', []))
+
+    def __contains__(self, id : str) -> bool:
+        return id in self.done
+
+    def mark(self, id : str) -> None:
+        self.done.add(id)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({'done' : sorted(self.done)}, f)
+        os.replace(tmp_name, self.path)
+
+
+def write_record(out : TextIO, id : str, query : dict, companies : Iterator) -> None:
+    """Write the line {"id": ..., "query": ..., "results": [...]} of a query, each company as soon as it is found,
+    so that a query with many results does not hold them all in memory."""
+    head = json.dumps({'id' : id, 'query' : query}, ensure_ascii=False)[:-1]
+    started = False
+    start = out.tell()
+    try:
+        for company in companies:
+            out.write((', ' if started else head + ', "results": [') + json.dumps(company.toDict(), ensure_ascii=False))
+            started = True
+    except ValueError as e:
+        # invalid input, e.g. an unknown court: running it again would not help
+        logging.error(f"query {id} failed: {e}")
+        error = ', "error": ' + json.dumps(str(e), ensure_ascii=False)
+        out.write((']' + error + '}\n') if started else (head + error + '}\n'))
+        return
+    except BaseException:
+        # the query is run again after a restart, its partial line is dropped
+        out.truncate(start)
+        raise
+    out.write((']}\n') if started else (head + ', "results": []}\n'))
+
+
+def write_error(out : TextIO, id : str, query : dict, error : str) -> None:
+    "write the line {\"id\": ..., \"query\": ..., \"error\": ...} of a query that could not be run"
+    out.write(json.dumps({'id' : id, 'query' : query, 'error' : error}, ensure_ascii=False) + "\n")
+
+
+def planned_results(planned : PlannedSearch, companies : Iterator) -> Iterator[tuple[str, dict, Iterator]]:
+    """(id, query, companies) for every query answered by a planned search
+    The first query gets the companies as they are found, the others get the same companies (or error) again."""
+    if len(planned.members) == 1:
+        [(id, query)] = planned.members
+        yield id, query, companies
+        return
+    found = []
+    error = None
+    def first():
+        nonlocal error
+        try:
+            for company in companies:
+                found.append(company)
+                yield company
+        except ValueError as e:
+            error = e
+            raise
+    def again():
+        if error is not None:
+            raise error
+        yield from found
+    for n, (id, query) in enumerate(planned.members):
+        yield id, query, first() if n == 0 else again()
+
+
+def check_courts(queries : list[dict], courts : CourtIndex | None) -> list[dict]:
+    """drop the queries with a register court that is not in the court table 'courts', before any request is sent
+    Without a current court table all queries are kept, the portal checks them."""
+    if courts is None:
+        return queries
+    valid = []
+    for query in queries:
+        if query['registerGericht']:
+            try:
+                courts.match(query['registerGericht'])
+            except ValueError as e:
+                logging.error(f"query {query_id(query)}: {e}")
+                continue
+        valid.append(query)
+    return valid
+
+
+def run_batch(args : argparse.Namespace) -> int:
+    """Run all queries of the file 'args.batch' in one session.
+    Every query writes one JSON line with its results to 'args.batchOutput'.
+    returns: number of queries run"""
+    batch_path = pathlib.Path(args.batch)
+    output_path = pathlib.Path(args.batchOutput or batch_path.with_name(batch_path.stem + ".results.jsonl"))
+    checkpoint = Checkpoint(args.checkpoint or batch_path.with_name(batch_path.stem + ".checkpoint.json"))
+
+    queries = []
+    for line_nr, raw in enumerate(read_queries(batch_path), start=1):
+        try:
+            queries.append(normalize_query(raw))
+        except ValueError as e:
+            logging.error(f"{batch_path}:{line_nr}: {e}")
+    court_table = CourtTable(args.courtFile, max_age=args.courtRefresh * 24 * 3600)
+    courts = None if court_table.is_stale() else court_table.load()
+    queries = check_courts(queries, courts)
+    todo = [q for q in queries if query_id(q) not in checkpoint]
+    logging.info(f"{len(queries)} queries in {batch_path}, {len(queries) - len(todo)} already done")
+
+    h = HandelsRegister(args)
+    plan = plan_queries([(query_id(q), q) for q in todo], h.company_index, courts)
+    logging.info(f"{len(todo)} queries planned as {len(plan)} searches")
+    if args.plan:
+        total = estimate_requests(plan, h)
+        print(format_plan(plan, total, args.rateLimit, h.limiter.status()['tokens_left']))
+        return 0
+
+    h.start_workers()
+    count = 0
+    outage = None
+    with open(output_path, "a", encoding="utf-8") as out:
+        for planned in plan:
+            # one session for all queries, only the query arguments change
+            h.args = copy.copy(args)
+            vars(h.args).update(planned.query)
+            while outage is None:
+                try:
+                    for id, query, companies in planned_results(planned, h.iter_companies()):
+                        write_record(out, id, query, companies)
+                        out.flush()
+                        checkpoint.mark(id)
+                        count += 1
+                    break
+                except Exception as e:
+                    if not is_retryable(e):
+                        raise
+                    if h.breaker.exhausted:
+                        logging.error(f"search {planned} failed ({e}), the portal is down for too long, "
+                                      f"the remaining queries fail")
+                        outage = f"portal unavailable: {e}"
+                        break
+                    # the portal is down: the circuit breaker holds the next request until it is back,
+                    # then the search is run again (an error ends the first query, before its line is written)
+                    logging.warning(f"search {planned} failed ({e}), it is run again when the portal is back")
+            if outage is not None:
+                # not marked as done, the next run of the batch runs them again
+                for id, query in planned.members:
+                    if id not in checkpoint:
+                        write_error(out, id, query, outage)
+                out.flush()
+                continue
+            status = h.limiter.status()
+            logging.info(f"query {count}/{len(todo)} done, {status['tokens_left']:.1f} tokens left, "
+                         f"next slot in {status['next_slot_in']:.0f} s")
+    h.close()
+    h.write_metrics()
+    return count
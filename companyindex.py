@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Local index of every company found by a search, with full text search.
+Each parsed search result is stored in an SQLite file with an FTS5 index, so that searches can be answered
+offline in milliseconds, without spending a request of the hourly budget.
+"""
+
+import argparse
+import json
+import pathlib
+import re
+import sqlite3
+import time
+
+
+class CompanyIndex:
+    """Companies in an SQLite file, one row per register entry (court cell), updated on every sighting.
+    The FTS5 table 'companies_fts' indexes name, former names (history), court, city and status."""
+    def __init__(self, path : str | pathlib.Path) -> None:
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        with self.con:
+            self.con.executescript("""
+                CREATE TABLE IF NOT EXISTS companies (
+                    id INTEGER PRIMARY KEY,
+                    key TEXT NOT NULL UNIQUE,
+                    name TEXT NOT NULL, court TEXT NOT NULL, register_nr TEXT NOT NULL,
+                    register_digits TEXT NOT NULL, city TEXT NOT NULL, status TEXT NOT NULL,
+                    history TEXT NOT NULL, first_seen REAL NOT NULL, last_seen REAL NOT NULL);
+                CREATE INDEX IF NOT EXISTS companies_register ON companies (register_digits);
+                CREATE VIRTUAL TABLE IF NOT EXISTS companies_fts USING fts5(
+                    name, history, court, city, status, content='companies', content_rowid='id');
+                CREATE TRIGGER IF NOT EXISTS companies_ai AFTER INSERT ON companies BEGIN
+                    INSERT INTO companies_fts (rowid, name, history, court, city, status)
+                    VALUES (new.id, new.name, new.history, new.court, new.city, new.status);
+                END;
+                CREATE TRIGGER IF NOT EXISTS companies_ad AFTER DELETE ON companies BEGIN
+                    INSERT INTO companies_fts (companies_fts, rowid, name, history, court, city, status)
+                    VALUES ('delete', old.id, old.name, old.history, old.court, old.city, old.status);
+                END;
+                CREATE TRIGGER IF NOT EXISTS companies_au AFTER UPDATE ON companies BEGIN
+                    INSERT INTO companies_fts (companies_fts, rowid, name, history, court, city, status)
+                    VALUES ('delete', old.id, old.name, old.history, old.court, old.city, old.status);
+                    INSERT INTO companies_fts (rowid, name, history, court, city, status)
+                    VALUES (new.id, new.name, new.history, new.court, new.city, new.status);
+                END;""")
+
+    @staticmethod
+    def company_key(court : str, register_nr : str, name : str) -> str:
+        "the court cell names the register entry, without register number the name is needed as well"
+        return court if register_nr else f"{court}\n{name}"
+
+    def upsert(self, companies) -> int:
+        """Insert or update SearchResults (anything with name, court, register_number, city, status and history).
+        returns: number of companies written"""
+        now = time.time()
+        rows = []
+        for c in companies:
+            register_nr = c.register_number
+            history = json.dumps([{'name' : n, 'location' : l} for n, l in c.history], ensure_ascii=False)
+            rows.append((self.company_key(c.court, register_nr, c.name), c.name, c.court, register_nr,
+                         ''.join(ch for ch in register_nr if ch.isnumeric()), c.city, c.status,
+                         history, now, now))
+        with self.con:
+            self.con.executemany("""INSERT INTO companies (key, name, court, register_nr, register_digits, city, status,
+                                                           history, first_seen, last_seen)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                    ON CONFLICT (key) DO UPDATE SET
+                                        name = excluded.name, register_nr = excluded.register_nr,
+                                        register_digits = excluded.register_digits, city = excluded.city,
+                                        status = excluded.status, history = excluded.history,
+                                        last_seen = excluded.last_seen""", rows)
+        return len(rows)
+
+    @staticmethod
+    def match_expression(schlagwoerter : list[str] | str, schlagwortOptionen : str = "all") -> str:
+        """FTS5 query for the keywords, with the meaning of the options of the portal:
+        all: every word in the name, min: at least one word, exact: the words as a phrase"""
+        if isinstance(schlagwoerter, str):
+            schlagwoerter = schlagwoerter.split()
+        words = [w for w in ' '.join(schlagwoerter).split() if w]
+        if not words:
+            raise ValueError("no keywords")
+        quoted = ['"' + w.replace('"', '""') + '"' for w in words]
+        if schlagwortOptionen == "exact":
+            expression = '"' + ' '.join(words).replace('"', '""') + '"'
+        elif schlagwortOptionen == "min":
+            expression = "(" + " OR ".join(quoted) + ")"
+        else:
+            expression = "(" + " AND ".join(quoted) + ")"
+        # former names count as well, the portal finds companies by them too
+        return "{name history} : " + expression
+
+    def search(self, schlagwoerter : list[str] | str, schlagwortOptionen : str = "all",
+               registerNummer : list[str] | str | None = None, registerGericht : list[str] | str | None = None,
+               limit : int | None = None) -> list[dict]:
+        """Find companies like a search on the portal, the arguments are the ones of SearchCache.key
+        returns: [{'name', 'court', 'city', 'status', 'history', 'last_seen'}, ...] best matches first"""
+        sql = ["""SELECT c.name, c.court, c.city, c.status, c.history, c.last_seen
+                  FROM companies_fts JOIN companies c ON c.id = companies_fts.rowid
+                  WHERE companies_fts MATCH ?"""]
+        params : list = [self.match_expression(schlagwoerter, schlagwortOptionen)]
+        if registerNummer:
+            if not isinstance(registerNummer, str):
+                registerNummer = ' '.join(registerNummer)
+            # only the digits of the register number are sent to the portal
+            sql.append("AND c.register_digits = ?")
+            params.append(''.join(ch for ch in registerNummer if ch.isnumeric()))
+        if registerGericht:
+            if not isinstance(registerGericht, str):
+                registerGericht = ' '.join(registerGericht)
+            # % and _ in the name of the court are no wildcards
+            sql.append("AND c.court LIKE ? ESCAPE '\\'")
+            court = re.sub(r'([\\%_])', r'\\\1', registerGericht.strip())
+            params.append(f"%{court}%")
+        sql.append("ORDER BY rank")
+        if limit is not None:
+            sql.append("LIMIT ?")
+            params.append(limit)
+        return [{'name' : name, 'court' : court, 'city' : city, 'status' : status,
+                 'history' : json.loads(history), 'last_seen' : last_seen}
+                for name, court, city, status, history, last_seen in self.con.execute(' '.join(sql), params)]
+
+    def __len__(self) -> int:
+        return self.con.execute("SELECT count(*) FROM companies").fetchone()[0]
+
+    def close(self) -> None:
+        self.con.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Search the local index of companies found on handelsregister.de')
+    parser.add_argument("schlagwoerter", nargs='*', help="keywords, without: show the size of the index")
+    parser.add_argument("-so", "--schlagwortOptionen", choices=["all", "min", "exact"], default="all")
+    parser.add_argument("--path", default="cache/companies.sqlite", help="index file")
+    args = parser.parse_args()
+    index = CompanyIndex(args.path)
+    if not args.schlagwoerter:
+        print(f"{len(index)} companies in {args.path}")
+    for d in index.search(args.schlagwoerter, args.schlagwortOptionen) if args.schlagwoerter else []:
+        print(f"{d['name']} | {d['court']} | {d['city']} | {d['status']}")
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Table of the register courts of the portal (name, aliases, id of the select option), kept on disk.
+A court given with -gericht is looked up in a normalized index (exact, alias, prefix and fuzzy match), so the search
+form does not have to be parsed for it, and batch inputs can be checked before the first request.
+"""
+
+import argparse
+import difflib
+import json
+import logging
+import os
+import pathlib
+import re
+import tempfile
+import time
+import unicodedata
+from typing import NamedTuple
+
+
+class Court(NamedTuple):
+    name : str              # as shown by the portal, e.g. 'Berlin (Charlottenburg)'
+    id : str                # value of the option in 'form:registergericht_input'
+    aliases : tuple[str, ...] = ()
+
+
+def normalize(name : str) -> str:
+    "key for matching: lower case, umlauts folded, punctuation removed, e.g. 'Köln (Rhein)' -> 'koeln rhein'"
+    name = name.lower()
+    for umlaut, folded in (("ä", "ae"), ("ö", "oe"), ("ü", "ue"), ("ß", "ss")):
+        name = name.replace(umlaut, folded)
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', name).split())
+
+
+def court_aliases(name : str) -> tuple[str, ...]:
+    "other names of a court: 'Berlin (Charlottenburg)' -> ('Amtsgericht Berlin (Charlottenburg)', 'Charlottenburg')"
+    aliases = [f"Amtsgericht {name}"]
+    inner = re.search(r'\((.*?)\)', name)
+    if inner:
+        aliases.append(inner.group(1))
+    return tuple(aliases)
+
+
+class CourtIndex:
+    "normalized index of the courts, built once"
+    def __init__(self, courts : list[Court]) -> None:
+        self.courts = courts
+        self.by_key : dict[str, Court] = {}
+        ambiguous = set()
+        for court in courts:
+            self.by_key[normalize(court.name)] = court
+        for court in courts:
+            for alias in court.aliases:
+                key = normalize(alias)
+                if key in self.by_key and self.by_key[key] != court:
+                    ambiguous.add(key)
+                self.by_key.setdefault(key, court)
+        for key in ambiguous - {normalize(c.name) for c in courts}:
+            # an alias of several courts identifies none of them
+            del self.by_key[key]
+        self.keys = sorted(self.by_key)
+
+    def match(self, query : str | list[str]) -> Court:
+        """find the court for a -gericht argument: exact or alias match, unique prefix, then closest spelling
+        raises ValueError if there is no or no unique match"""
+        if not isinstance(query, str):
+            query = ' '.join(query)
+        key = normalize(query)
+        if key in self.by_key:
+            return self.by_key[key]
+        prefixed = {self.by_key[k] for k in self.keys if k.startswith(key)} if key else set()
+        if len(prefixed) == 1:
+            court = prefixed.pop()
+            logging.info(f"register court {query!r} matched by prefix: {court.name}")
+            return court
+        if len(prefixed) > 1:
+            raise ValueError(f"register court {query!r} is ambiguous: {sorted(c.name for c in prefixed)[:10]}")
+        close = difflib.get_close_matches(key, self.keys, n=3, cutoff=0.8)
+        if close and (len(close) == 1 or self.by_key[close[0]] == self.by_key[close[1]] or
+                      difflib.SequenceMatcher(None, key, close[0]).ratio() >
+                      difflib.SequenceMatcher(None, key, close[1]).ratio()):
+            court = self.by_key[close[0]]
+            logging.info(f"register court {query!r} matched by spelling: {court.name}")
+            return court
+        suggestions = [self.by_key[k].name for k in difflib.get_close_matches(key, self.keys, n=3, cutoff=0.5)]
+        raise ValueError(f"specified register court {query!r} is invalid" +
+                         (f", did you mean {suggestions}?" if suggestions else ""))
+
+    def in_text(self, text : str) -> Court | None:
+        """the court a court cell of a search result ends with, e.g. 'Berlin District court Berlin (Charlottenburg)'
+        returns: the court with the longest matching name or None"""
+        key = normalize(text)
+        found = [c for c in self.courts if key == normalize(c.name) or key.endswith(" " + normalize(c.name))]
+        return max(found, key=lambda c: len(normalize(c.name)), default=None)
+
+    def __len__(self) -> int:
+        return len(self.courts)
+
+
+class CourtTable:
+    "the court table in a JSON file, refreshed from the search form when it is older than 'max_age' seconds"
+    def __init__(self, path : str | pathlib.Path, max_age : float = 30*24*3600) -> None:
+        self.path = pathlib.Path(path)
+        self.max_age = max_age
+        self._index : CourtIndex | None = None
+        self._fetched = 0.0
+
+    def load(self) -> CourtIndex | None:
+        "the index of the stored table, None if there is none"
+        if self._index is None:
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+            except (FileNotFoundError, ValueError):
+                return None
+            self._fetched = data.get('fetched', 0.0)
+            self._index = CourtIndex([Court(c['name'], c['id'], tuple(c.get('aliases', ()))) for c in data['courts']])
+        return self._index
+
+    def is_stale(self) -> bool:
+        return self.load() is None or time.time() - self._fetched > self.max_age
+
+    def update(self, names : dict[str, str]) -> CourtIndex:
+        "store the courts of the search form ({name : id}) and return the new index"
+        courts = [Court(name, id, court_aliases(name)) for name, id in names.items()]
+        data = {
+            'fetched' : time.time(),
+            'courts' : [{'name' : c.name, 'id' : c.id, 'aliases' : list(c.aliases)} for c in courts],
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_name, self.path)
+        self._index = CourtIndex(courts)
+        self._fetched = data['fetched']
+        return self._index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Look up register courts in the stored court table')
+    parser.add_argument("court", nargs='*', help="court names to look up, without: list all courts")
+    parser.add_argument("--path", default="cache/courts.json", help="court table file (default: %(default)s)")
+    args = parser.parse_args()
+    index = CourtTable(args.path).load()
+    if index is None:
+        parser.exit(1, f"no court table in {args.path}, it is written by the first search with -gericht\n")
+    if not args.court:
+        for court in index.courts:
+            print(f"{court.id:8} {court.name}")
+    for query in args.court:
+        try:
+            court = index.match(query)
+            print(f"{query}: {court.id} {court.name}")
+        except ValueError as e:
+            print(e)
@@ -0,0 +1,79 @@
+"""
+Content addressed store for downloaded documents.
+Documents are indexed by court, register number, document type and node of the document tree, so a document that is
+already held is served locally instead of spending a request. Identical files are stored only once.
+"""
+
+import logging
+import os
+import pathlib
+import shutil
+import sqlite3
+import time
+
+
+class DocumentStore:
+    """Store for documents, the files live in 'objects/<sha256[:2]>/<sha256>', an SQLite file maps the keys to them.
+    For the single documents of the search result (AD, CD, HD, SI) 'node' and 'label' are empty,
+    for files of the document tree (DK) they are the tree node id and the name shown in the tree."""
+    def __init__(self, directory : str | pathlib.Path) -> None:
+        self.directory = pathlib.Path(directory)
+        self.objects = self.directory / "objects"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(self.directory / "index.sqlite", timeout=60, check_same_thread=False)
+        with self.con:
+            self.con.execute("""CREATE TABLE IF NOT EXISTS documents (
+                court TEXT NOT NULL, register_nr TEXT NOT NULL, doc_type TEXT NOT NULL,
+                node TEXT NOT NULL, label TEXT NOT NULL,
+                filename TEXT NOT NULL, sha256 TEXT NOT NULL, size INTEGER NOT NULL, stored REAL NOT NULL,
+                PRIMARY KEY (court, register_nr, doc_type, node, label))""")
+
+    def object_path(self, sha256 : str) -> pathlib.Path:
+        return self.objects / sha256[:2] / sha256
+
+    def lookup(self, court : str, register_nr : str, doc_type : str, node : str = "", label : str = "",
+               max_age : float | None = None) -> tuple[str, str, int, pathlib.Path] | None:
+        """find a stored document, entries older than 'max_age' seconds are ignored
+        returns: (filename, sha256, size, object path) or None"""
+        row = self.con.execute("""SELECT filename, sha256, size, stored FROM documents
+                                  WHERE court = ? AND register_nr = ? AND doc_type = ? AND node = ? AND label = ?""",
+                               (court, register_nr, doc_type, node, label)).fetchone()
+        if row is None:
+            return None
+        filename, sha256, size, stored = row
+        if max_age is not None and time.time() - stored > max_age:
+            return None
+        path = self.object_path(sha256)
+        if not path.exists():
+            logging.info(f"document store: object {sha256} is missing")
+            return None
+        return filename, sha256, size, path
+
+    def add(self, court : str, register_nr : str, doc_type : str, node : str, label : str,
+            filename : str, path : pathlib.Path, sha256 : str, size : int) -> pathlib.Path:
+        """Move the downloaded file at 'path' into the store and link it back to 'path'.
+        If the same content is already stored, the new copy is dropped.
+        returns: the path of the stored object"""
+        object_path = self.object_path(sha256)
+        if object_path.exists():
+            path.unlink()
+        else:
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(path, object_path)
+        self.link(object_path, path)
+        with self.con:
+            self.con.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (court, register_nr, doc_type, node, label, filename, sha256, size, time.time()))
+        return object_path
+
+    @staticmethod
+    def link(object_path : pathlib.Path, path : pathlib.Path) -> None:
+        "make a stored object available at 'path', as hard link if possible so that the bytes exist only once"
+        if path.exists():
+            if path.samefile(object_path):
+                return
+            path.unlink()
+        try:
+            os.link(object_path, path)
+        except OSError:
+            shutil.copyfile(object_path, path)
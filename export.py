@@ -0,0 +1,71 @@
+"""
+Streaming export of search results as JSON lines or CSV.
+Every company is written as soon as it is produced, nothing is collected, so the memory stays constant
+for any number of results.
+"""
+
+import csv
+import json
+from typing import Iterable, TextIO
+
+output_formats = ("text", "jsonl", "csv")
+# columns of the CSV export, history and documents are JSON encoded lists
+csv_columns = ("name", "court", "register_number", "city", "status", "history", "requests", "documents")
+
+
+class JsonlWriter:
+    "one JSON object per line, the format of SearchResult.toDict"
+    def __init__(self, stream : TextIO) -> None:
+        self.stream = stream
+        self.count = 0
+
+    def write(self, company) -> None:
+        self.stream.write(json.dumps(company.toDict(), ensure_ascii=False) + "\n")
+        self.stream.flush()
+        self.count += 1
+
+
+class CsvWriter:
+    "one row per company with a header line, nested lists are JSON encoded in their cell"
+    def __init__(self, stream : TextIO) -> None:
+        self.stream = stream
+        self.writer = csv.DictWriter(stream, fieldnames=csv_columns)
+        self.writer.writeheader()
+        self.count = 0
+
+    def write(self, company) -> None:
+        d = company.toDict()
+        d['register_number'] = company.register_number
+        d['history'] = json.dumps(d['history'], ensure_ascii=False)
+        d['documents'] = json.dumps(d['documents'], ensure_ascii=False)
+        self.writer.writerow(d)
+        self.stream.flush()
+        self.count += 1
+
+
+class TextWriter:
+    "the blocks of SearchResult.__str__, for reading in a terminal"
+    def __init__(self, stream : TextIO) -> None:
+        self.stream = stream
+        self.count = 0
+
+    def write(self, company) -> None:
+        print(company, end='\n\n', file=self.stream, flush=True)
+        self.count += 1
+
+
+def make_writer(output_format : str, stream : TextIO):
+    "writer for one of 'output_formats'"
+    writers = {'text' : TextWriter, 'jsonl' : JsonlWriter, 'csv' : CsvWriter}
+    if output_format not in writers:
+        raise ValueError(f"unknown output format {output_format}")
+    return writers[output_format](stream)
+
+
+def write_all(companies : Iterable, output_format : str, stream : TextIO) -> int:
+    """write the companies one by one while they are produced
+    returns: number of companies written"""
+    writer = make_writer(output_format, stream)
+    for company in companies:
+        writer.write(company)
+    return writer.count
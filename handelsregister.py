@@ -4,38 +4,119 @@ bundesAPI/handelsregister is the command-line interface for for the shared regis
 You can query, download, automate and much more, without using a web browser.
 """
 
+from __future__ import annotations
+
 import argparse
-import mechanize
 import re
 import pathlib
 import sys
 import urllib.parse
-from bs4 import BeautifulSoup
 import logging
 import copy
+import functools
+import hashlib
+import os
+import tempfile
+import threading
+import json
+import time
+import itertools
+from typing import Iterator, NamedTuple, TYPE_CHECKING
+from ratelimit import RateLimiter
+from searchcache import SearchCache
+from docstore import DocumentStore
+from companyindex import CompanyIndex
+from courts import Court, CourtTable
+from export import output_formats, make_writer
+from metrics import Metrics
+from resilience import CircuitBreaker, RetryPolicy, is_retryable, not_sent
+
+# mechanize and BeautifulSoup are imported where they are needed: a search that is answered from the cache or the
+# company index needs neither of them, and importing them takes most of the startup time
+if TYPE_CHECKING:
+    import mechanize
 
 class DownloadedFile:
-    def __init__(self, filename : str = "", content : bytes = None) -> None:
+    "handle of a document that was written to disk, the content is not kept in memory"
+    __slots__ = ('filename', 'path', 'size', 'sha256')
+
+    def __init__(self, filename : str = "", path : pathlib.Path | None = None, size : int = 0, 
+                 sha256 : str = "") -> None:
         self.filename = filename
-        self.content = content 
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
     def __str__(self) -> str:
-        return f"{len(self.content) : 10} Byte -> {self.filename}"
-    def save_file(self, company_name : str):
-        pass
+        return f"{self.size : 10} Byte -> {self.filename}"
+
+    @property
+    def content(self) -> bytes:
+        "read the whole file, only for small files"
+        return self.path.read_bytes()
+
+    @classmethod
+    def from_response(cls, response, filename : str, path : pathlib.Path, 
+                      chunk_size : int = 64*1024) -> "DownloadedFile":
+        """Write the body of 'response' to 'path' chunk by chunk and hash it on the fly.
+        The file appears under its final name only when it is complete.
+        The seek wrapper of mechanize keeps every byte read through it in memory, so an unread response (as returned
+        by HandelsRegister.fetch with stream=True) is read from the wrapped response."""
+        source = response
+        if getattr(response, "wrapped", None) is not None and response.tell() == 0:
+            source = response.wrapped
+        sha256 = hashlib.sha256()
+        size = 0
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while chunk := source.read(chunk_size):
+                    sha256.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            os.replace(tmp_name, path)
+        except BaseException:
+            pathlib.Path(tmp_name).unlink(missing_ok=True)
+            raise
+        finally:
+            response.close()
+        return cls(filename=filename, path=path, size=size, sha256=sha256.hexdigest())
+
+# register types: Handels-, Genossenschafts-, Partnerschafts-, Vereins- and Gesellschaftsregister
+register_number_re = re.compile(r'\b(HRA|HRB|GnR|PR|VR|GsR)\s*(\d+)(\s*[A-Z]{1,2})?\s*$')
+
+def split_register_number(court : str) -> tuple[str, str]:
+    """split the court cell of a search result into court and register number
+    e.g. 'Berlin District court Berlin (Charlottenburg) HRB 44343 B' -> 
+         ('Berlin District court Berlin (Charlottenburg)', 'HRB 44343 B')"""
+    court = ' '.join(court.split())
+    re_finding = register_number_re.search(court)
+    if not re_finding:
+        return court, ""
+    register_nr = ' '.join(g.strip() for g in re_finding.groups() if g)
+    return court[:re_finding.start()].strip(), register_nr
 
 class SearchResult:
+    # slots keep the per-company footprint small in large result sets
+    __slots__ = ('name', 'court', 'city', 'status', 'history', 'documents', 'requests')
+
     def __init__(self, name:str="", court:str="", city:str="", status:str="") -> None:
         self.name = name 
         self.court = court
         self.city = city
         self.status = status
-        self.history : list[dict] = [] # {'name' : ... , 'location' : ...}
+        self.history : tuple[tuple[str, str], ...] = () # ((name, location), ...)
         self.documents : list[DownloadedFile] = []
+        self.requests = 0 # requests spent on the documents of this company
+
+    @property
+    def register_number(self) -> str:
+        "register number from the court cell, e.g. 'HRB 44343 B'"
+        return split_register_number(self.court)[1]
     
     def __str__(self) -> str:
         history_strings = []
-        for d in self.history:
-            history_strings.append(f"{d['name']} @ {d['location']}")
+        for name, location in self.history:
+            history_strings.append(f"{name} @ {location}")
         return f"""
         name: {self.name}
         court: {self.court}
@@ -52,17 +133,31 @@ class SearchResult:
             'court' : self.court,
             'city' : self.city,
             'status' : self.status,
-            'history' : self.history,
+            'history' : [{'name' : name, 'location' : location} for name, location in self.history],
+            'requests' : self.requests,
             'documents' : [
                 {
                     'filename' : d.filename,
-                    'length' : len(d.content)
+                    'length' : d.size,
+                    'path' : str(d.path),
+                    'sha256' : d.sha256
                 }
                 for d in self.documents
             ]
         }
         return d
 
+    @classmethod
+    def fromDict(cls, d : dict) -> "SearchResult":
+        "create from an exported dict, the inverse of toDict"
+        result = cls(name=d['name'], court=d['court'], city=d['city'], status=d['status'])
+        result.history = tuple((h['name'], h['location']) for h in d.get('history', []))
+        result.requests = d.get('requests', 0)
+        result.documents = [DownloadedFile(filename=doc['filename'], path=pathlib.Path(doc['path']), 
+                                           size=doc['length'], sha256=doc['sha256'])
+                            for doc in d.get('documents', [])]
+        return result
+
 
 # Dictionaries to map arguments to values
 schlagwortOptionen = {
@@ -70,24 +165,27 @@ schlagwortOptionen = {
     "min": 2,
     "exact": 3
 }
+# arguments that request documents, in the order they are downloaded, and their document types
+document_flags = {
+    "currentHardCopy": "AD",
+    "chronologicalHardCopy": "CD",
+    "historicalHardCopy": "HD",
+    "structuredContent": "SI",
+    "downloadAllDocuments": "DK",
+}
+
+class ResultPage(NamedTuple):
+    "the result page the browser is on, documents of its rows can be downloaded without searching again"
+    key : str           # search cache key of the search
+    id_nr : str         # id of the result table
+    first : int         # index of the first row of the loaded page
+    size : int          # rows per page
 
 class HandelsRegister:
     "class for handling the web traffic"
     def __init__(self, args):
         self.args = args
-        self.browser = mechanize.Browser()
-
-        self.browser.set_debug_http(args.debug)
-        self.browser.set_debug_responses(args.debug)
-        # self.browser.set_debug_redirects(True)
-
-        self.browser.set_handle_robots(False)
-        self.browser.set_handle_equiv(True)
-        self.browser.set_handle_gzip(True)
-        self.browser.set_handle_refresh(False)
-        self.browser.set_handle_redirect(True)
-        self.browser.set_handle_referer(True)
-
+        self.base_url = args.baseUrl.rstrip("/")
         self.addheaders = [
             (
                 "User-Agent",
@@ -107,34 +205,247 @@ class HandelsRegister:
             ),
             (   "Connection", "keep-alive"    ),
         ]
-        self.browser.addheaders = self.addheaders
         
+        # the directories are created by the first write
         self.downloaddir = pathlib.Path("downloads")
-        self.downloaddir.mkdir(parents=True, exist_ok=True)
         self.cachedir = pathlib.Path("cache")
-        self.cachedir.mkdir(parents=True, exist_ok=True)
-
-    def open_startpage(self):
-        # 3 retries
-        for _ in range(3):
-            try: 
-                self.browser.open("https://www.handelsregister.de", timeout=30)
-            except: 
-                logging.info(f"could not open start page, retry")
-                continue
+        self.search_cache = SearchCache(self.cachedir / "search", ttl=args.cacheTTL, max_entries=args.cacheSize)
+        # names and ids of the register courts, so -gericht does not need the court select of the search form
+        self.court_table = CourtTable(args.courtFile, max_age=args.courtRefresh * 24 * 3600)
+        self.request_count = 0
+        # (court, register number, document type, node, label) of the documents downloaded by this run
+        # shared with the sessions of the pool, which download the documents with --sessions
+        self.downloaded : set[tuple[str, str, str, str, str]] = set()
+        # the document (type or node of the document tree) each file of the downloads directory was written for
+        # by this run, shared with the pool as well
+        self.download_names : dict[pathlib.Path, str] = {}
+        self.downloaded_lock = threading.Lock()
+        # timing of all requests and of the parsing, shared with the sessions of the pool
+        self.metrics = Metrics()
+        self.retry_policy = RetryPolicy(attempts=args.retries + 1)
+        # pauses all requests of this session (and of the pool sessions) while the portal is down
+        self.breaker = CircuitBreaker()
+        # SessionPool that downloads the documents, None: downloads run in this session
+        self.pool = None
+        # StructuredLoader that parses the downloaded SI files into --siStore, None: they are only saved
+        self.si_loader = None
+        # HTML of the search form if the browser is on it already (restored session)
+        self.search_form_html : str | None = None
+        # ResultPage of the last live search, None if the browser is not on a result page
+        self.result_page : ResultPage | None = None
+        self.recorder = None
+        if args.record:
+            from replay import Recorder
+            self.recorder = Recorder(args.record, self.base_url)
+
+    # the browser and the SQLite files are opened on first use, a search answered from the cache needs no browser
+
+    @functools.cached_property
+    def browser(self) -> mechanize.Browser:
+        import mechanize
+        browser = mechanize.Browser()
+
+        browser.set_debug_http(self.args.debug)
+        browser.set_debug_responses(self.args.debug)
+        # browser.set_debug_redirects(True)
+
+        browser.set_handle_robots(False)
+        browser.set_handle_equiv(True)
+        browser.set_handle_gzip(True)
+        browser.set_handle_refresh(False)
+        browser.set_handle_redirect(True)
+        browser.set_handle_referer(True)
+        browser.addheaders = self.addheaders
+        return browser
+
+    @functools.cached_property
+    def limiter(self) -> RateLimiter:
+        "every HTTP request takes a token from this limiter, the state is shared between processes"
+        return RateLimiter(self.args.rateLimitFile, capacity=self.args.rateLimit)
+
+    @functools.cached_property
+    def docstore(self) -> DocumentStore:
+        return DocumentStore(self.downloaddir / "store")
+
+    @functools.cached_property
+    def company_index(self) -> CompanyIndex:
+        "every company seen in a search result, for answering searches offline"
+        return CompanyIndex(self.args.indexFile)
+
+    def fetch(self, browser : mechanize.Browser, request, timeout : float | None = None, visit : bool = True,
+              op : str = "request", stream : bool = False):
+        """Open 'request' (url or mechanize.Request) with 'browser' after taking a token from the rate limiter.
+        Every HTTP request of this class has to go through this method.
+        visit=False leaves the browser on the current page, e.g. for downloads.
+        Transient errors are retried according to self.retry_policy. If all attempts fail, the circuit breaker
+        is opened, so that the next requests of all sessions wait for the portal, and the last error is raised.
+        Every attempt is recorded in self.metrics as operation 'op'.
+        The body is read here to time the complete transfer, except with stream=True (downloads)."""
+        timeout = self.args.timeout if timeout is None else timeout
+        for attempt in range(self.retry_policy.attempts):
+            self.breaker.before_request()
+            try:
+                return self._fetch_once(browser, request, timeout, visit, op, attempt, stream)
+            except Exception as e:
+                if not is_retryable(e):
+                    # the portal answered, it is not down
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if attempt + 1 == self.retry_policy.attempts:
+                    logging.error(f"{op} failed after {attempt + 1} attempts: {e}")
+                    self.breaker.trip()
+                    raise
+                delay = self.retry_policy.delay(attempt + 1, self.limiter.next_slot())
+                logging.info(f"{op} failed ({e}), retry in {delay:.1f} s")
+                time.sleep(delay)
+
+    def _fetch_once(self, browser : mechanize.Browser, request, timeout : float, visit : bool,
+                    op : str, retry : int, stream : bool):
+        "one attempt of fetch()"
+        import mechanize
+        waited = self.limiter.acquire()
+        self.request_count += 1
+        if waited:
+            logging.info(f"waited {waited:.1f} s for the rate limit")
+        start = time.perf_counter()
+        if stream:
+            # the http-equiv handling would read the head of an HTML or XML body into the seek wrapper, a download
+            # has to stay unread for DownloadedFile.from_response
+            browser.set_handle_equiv(False)
+        try:
+            if visit:
+                response = browser.open(request, timeout=timeout)
             else:
-                return
-        logging.error(f"could not open start page, abort.")
-        
+                response = browser.open_novisit(request, timeout=timeout)
+            if self.recorder:
+                response = self.recorder.record(request, response)
+            if stream:
+                size = int(response.info().get("Content-Length") or 0)
+            else:
+                size = len(response.get_data())
+        except mechanize.HTTPError as e:
+            self.metrics.record_request(op, time.perf_counter() - start, e.code, 0, retry, waited)
+            raise
+        except BaseException as e:
+            self.metrics.record_request(op, time.perf_counter() - start, None, 0, retry, waited)
+            if not_sent(e):
+                # the portal did not see the request, it does not count against the limit
+                self.limiter.release()
+            raise
+        finally:
+            if stream:
+                browser.set_handle_equiv(True)
+        self.metrics.record_request(op, time.perf_counter() - start, response.code, size, retry, waited)
+        self.breaker.record_success()
+        logging.debug(f"rate limit: {self.limiter.tokens_left():.2f} tokens left")
+        return response
+
+    def save_session(self) -> None:
+        "save the cookies of the session, so that the next run can skip the start page"
+        if not self.args.sessionFile or self.args.sessionMaxIdle <= 0:
+            return
+        path = pathlib.Path(self.args.sessionFile)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            'last_used' : time.time(),
+            'cookies' : [cookie_to_dict(c) for c in self.browser.cookiejar],
+        }
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_name, path)
+
+    def restore_session(self) -> bool:
+        """Reuse the session of an earlier run if it was used less than --sessionMaxIdle seconds ago:
+        load its cookies and open the search form directly instead of the start page.
+        returns: True if the browser is on the search form"""
+        if not self.args.sessionFile or self.args.sessionMaxIdle <= 0:
+            return False
+        path = pathlib.Path(self.args.sessionFile)
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return False
+        # cheap check first: the server drops idle sessions
+        if time.time() - data.get('last_used', 0) > self.args.sessionMaxIdle:
+            logging.info("saved session is expired")
+            return False
+        import mechanize
+        for c in data.get('cookies', []):
+            self.browser.cookiejar.set_cookie(cookie_from_dict(c))
+        try:
+            response = self.fetch(self.browser, f"{self.base_url}/rp_web/erweitertesuche.xhtml", op="session_restore")
+            html = response.read().decode("utf-8")
+            valid = any(form.name == "form" for form in self.browser.forms())
+        except (mechanize.URLError, mechanize.BrowserStateError, OSError) as e:
+            logging.info(f"could not reuse the saved session: {e}")
+            valid = False
+        if not valid:
+            logging.info("saved session is not valid anymore, start a new one")
+            self.browser.cookiejar.clear()
+            return False
+        logging.info("reuse the saved session")
+        self.search_form_html = html
+        return True
+
+    def open_startpage(self) -> None:
+        "open the start page, fetch() retries transient errors and raises if the portal cannot be reached"
+        self.fetch(self.browser, self.base_url, op="startpage")
 
-    def companyname2cachename(self, companyname):
-        # map a companyname to a filename, that caches the downloaded HTML, so re-running this script touches the
-        # webserver less often.
-        return self.cachedir / companyname 
-    def companyname2downloadname(self, companyname, filename):
-        (self.cachedir / companyname).mkdir(parents=True, exist_ok=True)
-        return self.cachedir / companyname / filename
+    def companyname2downloadname(self, companyname, filename, tag : str = ""):
+        # map a company and a file name to a path in the downloads directory; if another document of the company
+        # ('tag': document type or node of the document tree) took the file name in this run, the tag is added to
+        # the name, a file of an earlier run is replaced
+        dirname = re.sub(r'[\\/:*?"<>|]+', '_', companyname).strip(" .") or "_"
+        (self.downloaddir / dirname).mkdir(parents=True, exist_ok=True)
+        path = self.downloaddir / dirname / pathlib.Path(filename).name
+        with self.downloaded_lock:
+            if self.download_names.setdefault(path, tag) != tag:
+                tag = re.sub(r'[\\/:*?"<>|]+', '_', tag)
+                path = path.with_name(f"{path.stem} [{tag}]{path.suffix}")
+        return path
     
+    def stored_document(self, company : SearchResult, doc_type : str, node : str = "", 
+                        label : str = "") -> tuple[str, str, int, pathlib.Path] | None:
+        """Look up a document in the document store.
+        Single documents (AD, CD, HD, SI) are served only if they are younger than --storeMaxAge, 
+        files of the document tree do not change. With -f only the documents downloaded by this run are served,
+        so a document that several queries of a batch ask for is downloaded once.
+        returns: (filename, sha256, size, object path) or None"""
+        if not company.register_number:
+            return None
+        court, register_nr = split_register_number(company.court)
+        if self.args.force:
+            with self.downloaded_lock:
+                if (court, register_nr, doc_type, node, label) not in self.downloaded:
+                    return None
+        max_age = None if doc_type == "DK" else self.args.storeMaxAge
+        return self.docstore.lookup(court, register_nr, doc_type, node, label, max_age=max_age)
+
+    def document_from_store(self, company : SearchResult, doc_type : str, node : str = "", 
+                            label : str = "") -> DownloadedFile | None:
+        "the document from the document store (see stored_document), linked into the downloads directory"
+        found = self.stored_document(company, doc_type, node, label)
+        if not found:
+            return None
+        filename, sha256, size, object_path = found
+        path = self.companyname2downloadname(' '.join((company.court, company.name)), filename, node or doc_type)
+        self.docstore.link(object_path, path)
+        logging.info(f"{doc_type} {filename} served from the document store")
+        return DownloadedFile(filename=filename, path=path, size=size, sha256=sha256)
+
+    def store_document(self, company : SearchResult, doc_type : str, document : DownloadedFile, 
+                       node : str = "", label : str = "") -> None:
+        "add a downloaded document to the document store"
+        if not company.register_number:
+            return
+        court, register_nr = split_register_number(company.court)
+        self.docstore.add(court, register_nr, doc_type, node, label, document.filename, 
+                          document.path, document.sha256, document.size)
+        with self.downloaded_lock:
+            self.downloaded.add((court, register_nr, doc_type, node, label))
+
     def getDocumentFromSearchResult(self, type:str, id_nr : str, browser: mechanize.Browser, 
                                         row_index : int, company : SearchResult) -> None:
             "Append the given 'company' object with a document from the search result page"
@@ -147,6 +458,10 @@ class HandelsRegister:
             if type not in type2col: 
                 logging.error(f"getDocumentFromSearchResult: Wrong Document given. Got {type}, expected one of {type2col.keys()}")
                 return None
+            document = self.document_from_store(company, type)
+            if document:
+                company.documents.append(document)
+                return None
             logging.info(f'# trying to download {type}')
             logging.info(f"{browser.geturl() = }")
 
@@ -154,51 +469,47 @@ class HandelsRegister:
             select_str = f"ergebnissForm:selectedSuchErgebnisFormTable:{row_index}:j_idt{id_nr}:{type2col[type]}:fade"
             req_data = browser.form.click_request_data()
             # retrieve the data that would be sent if "click()"
+            import mechanize
             req = mechanize.Request(url=req_data[0],
                                     data=req_data[1] + "&" + urllib.parse.quote(select_str))
-            response = browser.open(req)
+            # the download does not visit the page, so the browser stays on the result page
+            response = self.fetch(browser, req, visit=False, op=f"document_{type}", stream=True)
             if response.code != 200: 
                 return None
             re_finding = re.search(r'filename="(.*?)"', response.get('Content-Disposition', default="file"))
             if not re_finding: 
                 return None
             filename = re_finding.group(1)
-            # filepath = self.companyname2downloadname(' '.join((company.court, company.name)), filename)
-            content = response.read()
-            # with open(filepath, "wb") as f:
-            #     f.write(content)
-            company.documents.append(DownloadedFile(filename=filename, content=content))
-            
             logging.info(f"{response.geturl() = }")
-            browser.back()
+            filepath = self.companyname2downloadname(' '.join((company.court, company.name)), filename, type)
+            document = DownloadedFile.from_response(response, filename, filepath)
+            self.store_document(company, type, document)
+            company.documents.append(document)
 
-    def getDocsFromDocsPage(self, browser: mechanize.Browser, id_nr : str, row_index : int, 
-                                    company : SearchResult) -> int:
-        """Download all the Documents from documents page
-        Append the given searchResult object
-        returns: number of documents downloaded"""
-        logging.info('# trying to download all files')
-        resp = browser.open("https://www.handelsregister.de/rp_web/ergebnisse.xhtml", timeout=30)
+    def open_docs_page(self, browser: mechanize.Browser, id_nr : str, row_index : int) -> tuple[str | None, str]:
+        """Open the documents view (DK) of a row of the search result
+        returns: (JSF view state or None on error, HTML of the documents view)"""
+        resp = self.fetch(browser, f"{self.base_url}/rp_web/ergebnisse.xhtml", op="result_reload")
         if resp.code != 200: 
             logging.error(f"could not open {resp=}")
-            return 0
+            return None, ""
         browser.select_form(name="ergebnissForm")
         select_str = f"ergebnissForm:selectedSuchErgebnisFormTable:{row_index}:j_idt{id_nr}:3:fade"
         # retrieve the data that would be sent if "click()"
         req_data = browser.form.click_request_data()
         # modify the request data: add the selection data
+        import mechanize
         req = mechanize.Request(url=req_data[0],
                                 data=req_data[1] + "&" + urllib.parse.quote(select_str))
-        docs_response = browser.open(req)
+        docs_response = self.fetch(browser, req, op="docs_page")
         if docs_response.code != 200: 
             logging.error(f"could not open {req=}")
-            return 0
-        html_docs = docs_response.read()
+            return None, ""
+        html_docs = docs_response.read().decode()
         
-        logging.debug(f"{self.browser.geturl() = }")
+        logging.debug(f"{browser.geturl() = }")
         browser.select_form(name="dk_form")
         select = browser.form.click()
-        # self.browser.back()
         # # url
         # ('https://www.handelsregister.de/rp_web/documents-dk.xhtml',
         # # data
@@ -208,139 +519,237 @@ class HandelsRegister:
         # dk_form%3Adktree_scrollState=0%2C0',
         # # header
         # [('Content-Type', 'application/x-www-form-urlencoded')])
-        
-        re_finding = re.search(r'javax.faces.ViewState=(.*?)&', 
+        re_finding = re.search(r'javax.faces.ViewState=(.*?)(?:&|$)', 
                                urllib.parse.unquote(str(select.get_data())))
         if not re_finding: 
             logging.error(f"could not find view state id in {select.get_data()=}")
-            return 0
-        view_state = re_finding.group(1)
-        tree_ids = re.findall(r'<li id="dk_form:dktree:(.*?)"', html_docs.decode())
-        names = re.findall(r'role="treeitem">(.*?)</span>', html_docs.decode())
-        if len(tree_ids) != len(names):
-            logging.error(f"{len(tree_ids)=} != {len(names)=}")
-            return 0
-        downloadable = { id : False for id in tree_ids}
-        index = 1
-        if len(tree_ids) <= index: 
-            logging.error(f"getDocsFromDocsPage @ {self.browser.geturl() = }: len(tree_ids) <= index")
-            return 0
+            return None, html_docs
+        return re_finding.group(1), html_docs
 
-        def create_request(view_state, instant_selection, tree_selection):
-            return mechanize.Request(url="https://www.handelsregister.de/rp_web/documents-dk.xhtml", 
-                                    data = {
-                                        'javax.faces.partial.ajax': 'true',
-                                        'javax.faces.source': 'dk_form:dktree',
-                                        'javax.faces.partial.execute': 'dk_form:dktree',
-                                        'javax.faces.partial.render': 'dk_form:detailsNodePanelGrid dk_form:dktree',
-                                        'javax.faces.behavior.event': 'select',
-                                        'javax.faces.partial.event': 'select',
-                                        'dk_form:dktree_instantSelection': instant_selection,
-                                        'dk_form': 'dk_form',
-                                        'javax.faces.ViewState': view_state,
-                                        'dk_form:dktree_selection': tree_selection,
-                                        'dk_form:dktree_scrollState': '0,0'
-                                    }
-                                    # , headers=
-                                    )
-        
-        while len(tree_ids) > index:
-            # send a new response 
-            instant_selection = tree_ids[index] # "0_0_0_0"
-            tree_selection = tree_ids[index] # "0_0_0_0"
-            req = create_request(view_state, instant_selection, tree_selection)
-            resp = browser.open(req)
-            if resp.code != 200: 
-                return 0
-            resp_data = resp.read()
-
-            # get file name
-            names = re.findall(r'role="treeitem">(.*?)</span>', resp_data.decode())
-            if not names: 
-                logging.error(f"could not find file name")
-                return 0
-
-            # check if folder
-            download_disabled = resp_data.decode().find(
-                'onclick="" type="submit" disabled="disabled">') != -1
-            # downloadable.append(not download_disabled)
-            downloadable.update({tree_ids[index] : not download_disabled})
-
-            # update loop values
-            tree_ids = re.findall(r'<li id="dk_form:dktree:(.*?)"', resp_data.decode())
-            index += 1
-
-        # result:
-            # tree_ids = ['0', '0_0', ... ]
-            # downloadable = ['Documents on legal entity', 'Documents on register number', ... ]
-            # downloadable = {'0': False, '0_0': False, ... }
-
-        to_download = [id for id in tree_ids if downloadable[id]]
-        for id in to_download:
-            req = create_request(view_state, id, id)
-            resp = browser.open(req)
-            if resp.code != 200: 
-                continue
-            resp_str = resp.read().decode()
-            re_findings = re.findall(r'<button id="dk_form:j_idt(\d*?)" name="dk_form:j_idt(\d*?)" class="ui-button ui-widget ui-state-default ui-corner-all ui-button-text-only" onclick="" type="submit">',
-                        resp_str)
-            if re_findings == []: 
-                logging.error(f"could not find j_id (e.g. 0_0_1) in {resp}")
-                continue
-            if re_findings[0] == []: 
-                logging.error(f"could not find j_id (e.g. 0_0_1) in {resp}")
+    def select_dk_node(self, browser: mechanize.Browser, view_state : str, node : str) -> str | None:
+        "select a node of the document tree (AJAX), returns the decoded response or None on error"
+        resp = self.fetch(browser, dk_select_request(self.base_url, view_state, node), op="dk_select")
+        if resp.code != 200: 
+            return None
+        return resp.read().decode()
+
+    def walk_dk_tree(self, browser: mechanize.Browser, view_state : str, 
+                     html_docs : str) -> tuple[list[tuple[str, str]], str | None]:
+        """Find all files of the document tree.
+        Nodes rendered as leaf are files and folders whose children are rendered already are not selected, 
+        only nodes of unknown type are selected to find out if they can be downloaded.
+        returns: ([(node id, label), ...] of the files, id of the download button if seen)"""
+        with self.metrics.timer("parse_dk_tree"):
+            nodes = parse_dk_tree(html_docs)
+        if len(nodes) <= 1: 
+            logging.error(f"walk_dk_tree @ {browser.geturl() = }: no documents in tree")
+            return [], None
+        order = [id for id, _, _ in nodes]
+        labels = {id : label for id, label, _ in nodes}
+        leaf = {id : is_leaf for id, _, is_leaf in nodes}
+        # the root node is a folder
+        is_file = {order[0] : False}
+        selected = {order[0]}
+        j_id = None
+
+        def has_children(id):
+            return any(other.startswith(id + "_") for other in order)
+
+        while True:
+            pending = [id for id in order if id not in selected and 
+                       (leaf.get(id) is None or (leaf[id] is False and not has_children(id)))]
+            for id in order:
+                if id not in is_file and leaf.get(id) is not None:
+                    is_file[id] = leaf[id]
+            if not pending:
+                break
+            id = pending[0]
+            selected.add(id)
+            resp_str = self.select_dk_node(browser, view_state, id)
+            if resp_str is None: 
                 continue
-            j_id = re_findings[0][0]
-            download_req = mechanize.Request(
-                url = 'https://www.handelsregister.de/rp_web/documents-dk.xhtml',
-                data= {
-                    'dk_form': 'dk_form',
-                    'javax.faces.ViewState': view_state,
-                    'dk_form:dktree_selection': id,
-                    'dk_form:dktree_scrollState': '0,0',
-                    'dk_form:radio_dkbuttons': 'false', # true if download as zip
-                    f'dk_form:j_idt{j_id}': ''
-                }
-            )
-            download_resp = browser.open(download_req)
+            if leaf.get(id) is None:
+                is_file[id] = dk_download_disabled not in resp_str
+                if is_file[id] and j_id is None:
+                    j_id = find_dk_download_button(resp_str)
+            # the response contains the tree with the children of the selected node
+            with self.metrics.timer("parse_dk_tree"):
+                nodes = parse_dk_tree(resp_str)
+            for node, label, is_leaf in nodes:
+                if node not in labels:
+                    order.append(node)
+                labels[node] = label
+                if leaf.get(node) is None:
+                    leaf[node] = is_leaf
+
+        files = [(id, labels[id]) for id in order if is_file.get(id)]
+        return files, j_id
+
+    def download_dk_file(self, browser: mechanize.Browser, view_state : str, j_id : str | None, 
+                         selection : str, company : SearchResult) -> tuple[DownloadedFile | None, str | None]:
+        """Download the selected node(s) of the document tree, several nodes (comma separated) are downloaded as zip.
+        The id of the download button is the same for all nodes, so a known 'j_id' saves the select request.
+        returns: (downloaded file or None, id of the download button)"""
+        for attempt in range(2):
+            if j_id is None or attempt == 1:
+                resp_str = self.select_dk_node(browser, view_state, selection.split(",")[0])
+                j_id = find_dk_download_button(resp_str) if resp_str else None
+                if j_id is None:
+                    logging.error(f"could not find j_id (e.g. 0_0_1) for {selection}")
+                    return None, None
+            download_resp = self.fetch(browser, dk_download_request(self.base_url, view_state, selection, j_id), 
+                                       visit=False, op="dk_download", stream=True)
             if download_resp.code != 200: 
-                continue
-            if not "attachment;" in download_resp.get('Content-Disposition', default=""):
-                logging.error(f"{j_id=}: could not find 'attachment;' in {download_resp}")
-                continue
-            re_findings = re.search(r'filename="(.*?)"', download_resp.get('Content-Disposition', default="file"))
-            if not re_findings: 
-                logging.error(f"{j_id=}:could not find filename in {download_resp}")
-                continue
-            filename = re_findings.group(1)
-            download_data = download_resp.read()
-            # filepath = self.companyname2cachename(' '.join(self.args.schlagwoerter), filename)
-            company.documents.append(DownloadedFile(filename=filename, 
-                                                    content=download_data))
-        return len(to_download)
+                return None, j_id
+            content_disposition = download_resp.get('Content-Disposition', default="")
+            if "attachment;" in content_disposition:
+                break
+            logging.info(f"{j_id=}: could not find 'attachment;' in {download_resp}, select {selection} first")
+        else:
+            logging.error(f"{j_id=}: could not download {selection}")
+            return None, None
+        re_findings = re.search(r'filename="(.*?)"', content_disposition)
+        if not re_findings: 
+            logging.error(f"{j_id=}:could not find filename in {download_resp}")
+            return None, j_id
+        filename = re_findings.group(1)
+        filepath = self.companyname2downloadname(' '.join((company.court, company.name)), filename, selection)
+        return DownloadedFile.from_response(download_resp, filename, filepath), j_id
 
+    def dk_tree_cachename(self, company : SearchResult) -> pathlib.Path | None:
+        if not company.register_number:
+            return None
+        court, register_nr = split_register_number(company.court)
+        key = hashlib.sha256(f"{court}|{register_nr}".encode("utf-8")).hexdigest()
+        return self.cachedir / "dktree" / f"{key}.json"
 
-    def search_companies(self) -> list[SearchResult]:
-        companies : list[SearchResult] = []
+    def load_dk_tree(self, company : SearchResult) -> tuple[list[tuple[str, str]], str | None] | None:
+        "the files of the document tree of 'company' from an earlier run, if not older than --treeCacheTTL"
+        path = self.dk_tree_cachename(company)
+        if path is None or not path.exists():
+            return None
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if time.time() - data['time'] > self.args.treeCacheTTL:
+            return None
+        return [tuple(f) for f in data['files']], data['j_id']
+
+    def save_dk_tree(self, company : SearchResult, files : list[tuple[str, str]], j_id : str | None) -> None:
+        path = self.dk_tree_cachename(company)
+        if path is None:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({'time' : time.time(), 'files' : files, 'j_id' : j_id}, f)
+        os.replace(tmp_name, path)
+
+    def list_dk_files(self, browser: mechanize.Browser, id_nr : str, row_index : int,
+                      company : SearchResult) -> list[tuple[str, str]] | None:
+        """The files of the document tree of a row, without downloading them.
+        The tree is saved, so a later download (-docs) does not walk it again.
+        returns: [(node id, label), ...] or None on error"""
+        view_state, html_docs = self.open_docs_page(browser, id_nr, row_index)
+        if view_state is None:
+            return None
+        files, j_id = self.walk_dk_tree(browser, view_state, html_docs)
+        self.save_dk_tree(company, files, j_id)
+        return files
+
+    def getDocsFromDocsPage(self, browser: mechanize.Browser, id_nr : str, row_index : int,
+                                    company : SearchResult) -> int:
+        """Download all the Documents from documents page
+        Append the given searchResult object
+        returns: number of documents downloaded or served from the document store"""
+        logging.info('# trying to download all files')
+        requests_before = self.request_count
+        files, j_id = None, None
+        if not self.args.force:
+            files, j_id = self.load_dk_tree(company) or (None, None)
+
+        def take_from_store(files):
+            "serve the files held in the document store, returns the missing ones"
+            missing = []
+            for node, label in files:
+                document = self.document_from_store(company, "DK", node=node, label=label)
+                if document:
+                    company.documents.append(document)
+                else:
+                    missing.append((node, label))
+            return missing
+
+        to_download = take_from_store(files) if files is not None else None
+        if to_download == []:
+            logging.info(f"all {len(files)} documents of {company.name} served locally, 0 requests")
+            return len(files)
+
+        view_state, html_docs = self.open_docs_page(browser, id_nr, row_index)
+        if view_state is None:
+            return 0
+        if files is None:
+            files, j_id = self.walk_dk_tree(browser, view_state, html_docs)
+            self.save_dk_tree(company, files, j_id)
+            to_download = take_from_store(files)
+
+        downloaded = len(files) - len(to_download)
+        if to_download and self.args.docsZip:
+            selection = ",".join(node for node, _ in to_download)
+            document, j_id = self.download_dk_file(browser, view_state, j_id, selection, company)
+            if document:
+                company.documents.append(document)
+                downloaded += len(to_download)
+        else:
+            for node, label in to_download:
+                document, j_id = self.download_dk_file(browser, view_state, j_id, node, company)
+                if document is None:
+                    continue
+                self.store_document(company, "DK", document, node=node, label=label)
+                company.documents.append(document)
+                downloaded += 1
+        logging.info(f"{downloaded} of {len(files)} documents of {company.name}: "
+                     f"{self.request_count - requests_before} requests")
+        return downloaded
+
+
+    def open_search_form(self) -> str:
+        """Navigate to 'Erweiterte Suche' and return the HTML of the search form.
+        The link is on every page of the portal, so a session can run several searches in a row."""
+        if self.search_form_html is not None:
+            # the restored session opened the search form already
+            html, self.search_form_html = self.search_form_html, None
+            return html
+        import mechanize
+        try:
+            request = self.browser.click_link(text="Erweiterte Suche")
+        except (mechanize.LinkNotFoundError, mechanize.BrowserStateError):
+            logging.info("no link to the search form on the current page, reopen the start page")
+            self.open_startpage()
+            request = self.browser.click_link(text="Erweiterte Suche")
+        response_search = self.fetch(self.browser, request, op="search_form")
+        return response_search.read().decode("utf-8")
+
+    def documents_requested(self) -> bool:
+        "True if any document download is requested, these cannot be answered from the search cache"
+        return any(getattr(self.args, flag) for flag in document_flags)
+
+    def search_cache_key(self) -> str:
+        return self.search_cache.key(self.args.schlagwoerter, self.args.schlagwortOptionen,
+                                     self.args.registerNummer, self.args.registerGericht)
+
+    def submit_search(self) -> str | None:
+        """Fill in and submit the search form with the query in self.args
+        returns: the HTML of the first result page or None if there is no session"""
+        self.result_page = None
+        if not self.browser.cookiejar and not self.restore_session():
+            self.open_startpage()
         if not self.browser.cookiejar:
-            return []
+            return None
         logging.debug(f"{self.browser.cookiejar[0].value = }")
-        self.addheaders.append(
-            (   self.browser.cookiejar[0].name, self.browser.cookiejar[0].value)
-        )
+        session_header = (self.browser.cookiejar[0].name, self.browser.cookiejar[0].value)
+        if session_header not in self.addheaders:
+            self.addheaders.append(session_header)
         self.browser.addheaders = self.addheaders
 
-        cachename = self.companyname2cachename(' '.join(self.args.schlagwoerter))
-        # if self.args.force==False and cachename.exists():
-        #     with open(cachename, "r") as f:
-        #         html = f.read()
-        #         print("return cached content for %s" % ' '.join(self.args.schlagwoerter))
-        #         return get_companies_in_searchresults(html)
-            
-        # TODO implement token bucket to abide by rate limit
-        # Use an atomic counter: https://gist.github.com/benhoyt/8c8a8d62debe8e5aa5340373f9c509c7
-        response_search = self.browser.follow_link(text="Erweiterte Suche")
-        search_page_html = response_search.read().decode("utf-8")
+        search_page_html = self.open_search_form()
 
         if self.args.debug == True:
             logging.debug(self.browser.title())
@@ -359,76 +768,366 @@ class HandelsRegister:
             logging.info(f"{nr_str=}")
             self.browser["form:registerNummer"] = nr_str
         if self.args.registerGericht:
-            # optionen finden
-            soup = BeautifulSoup(search_page_html, 'html.parser')
-            gerichte_inputs = soup.find(id='form:registergericht_input')
-            gericht2ID = {
-                str(o.text).lower().strip() : o['value'] 
-                for o in gerichte_inputs.select('option') if o.get('value')
-            }
-            gericht_str = (" ".join(self.args.registerGericht)).lower().strip()
-            if gericht_str not in gericht2ID:
-                raise ValueError(f"specified register court {self.args.registerGericht} is invalid")
-            self.browser["form:registergericht_input"] = [gericht2ID[gericht_str]]
+            court = self.find_court(search_page_html)
+            logging.info(f"register court {court.name} ({court.id})")
+            self.browser["form:registergericht_input"] = [court.id]
 
-        response_result = self.browser.submit()
+        response_result = self.fetch(self.browser, self.browser.click(), op="search_submit")
         logging.debug(f"{self.browser.cookiejar[0].value = }")
+        self.save_session()
 
         if self.args.debug == True:
             logging.debug(self.browser.title())
 
-        html = response_result.read().decode("utf-8")
-        with open(cachename, "w") as f:
-            f.write(html)
+        return response_result.read().decode("utf-8")
 
-        # from get_companies_in_searchresults:
-        soup = BeautifulSoup(html, 'html.parser')
-        grid = soup.find('table', role='grid')
-        #print('grid: %s', grid)
+    def find_court(self, search_page_html : str) -> Court:
+        """the court of -gericht from the stored court table
+        The search form is parsed only if the table is missing or older than --courtRefresh days,
+        or if the court is not in it (the portal may have added courts).
+        raises ValueError if the court is unknown or not unique"""
+        index = None if self.court_table.is_stale() else self.court_table.load()
+        if index is not None:
+            try:
+                return index.match(self.args.registerGericht)
+            except ValueError as e:
+                logging.info(f"{e}, reading the courts of the search form")
+        with self.metrics.timer("parse_courts"):
+            names = parse_court_names(search_page_html, self.args.parser)
+        if not names:
+            raise ValueError("found no register courts in the search form")
+        return self.court_table.update(names).match(self.args.registerGericht)
+
+    def fetch_result_page(self, first : int, rows : int) -> str | None:
+        """Load the rows 'first' ... 'first'+'rows'-1 of the result table (AJAX paging of the table).
+        The browser stays on the result page, so documents of all pages can be downloaded from it.
+        returns: the rows wrapped in a result table or None on error"""
+        self.browser.select_form(name="ergebnissForm")
+        view_state = self.browser.form.find_control("javax.faces.ViewState").value
+        table = "ergebnissForm:selectedSuchErgebnisFormTable"
+        import mechanize
+        req = mechanize.Request(url=self.browser.geturl(), 
+                                data = {
+                                    'javax.faces.partial.ajax': 'true',
+                                    'javax.faces.source': table,
+                                    'javax.faces.partial.execute': table,
+                                    'javax.faces.partial.render': table,
+                                    f'{table}_pagination': 'true',
+                                    f'{table}_first': str(first),
+                                    f'{table}_rows': str(rows),
+                                    f'{table}_skipChildren': 'true',
+                                    f'{table}_encodeFeature': 'true',
+                                    'ergebnissForm': 'ergebnissForm',
+                                    'javax.faces.ViewState': view_state,
+                                })
+        resp = self.fetch(self.browser, req, visit=False, op="result_page")
+        if resp.code != 200:
+            logging.error(f"could not load result rows from {first}: {resp.code}")
+            return None
+        re_finding = result_page_update_re.search(resp.read().decode("utf-8"))
+        if not re_finding:
+            logging.error(f"no result rows in the response for rows from {first}")
+            return None
+        return f'<table role="grid"><tbody>{re_finding.group(1)}</tbody></table>'
+
+    def download_documents(self, company : SearchResult, id_nr : str, row_index : int) -> None:
+        "download the requested documents of a row of the current result page"
+        requests_before = self.request_count
+        for flag, doc_type in document_flags.items():
+            if getattr(self.args, flag):
+                self.download_document(company, id_nr, row_index, doc_type)
+        company.requests = self.request_count - requests_before
+        if company.requests:
+            logging.info(f"documents of {company.name}: {company.requests} requests")
+
+    def download_document(self, company : SearchResult, id_nr : str, row_index : int, doc_type : str) -> None:
+        "download a document (AD, CD, HD, SI) or the document tree (DK) of a row of the current result page"
+        if doc_type == "DK":
+            # copy the browser object so that self.browser remains in the same state
+            self.getDocsFromDocsPage(browser=copy.copy(self.browser), id_nr=id_nr, row_index=row_index, company=company)
+            return
+        first_new = len(company.documents)
+        self.getDocumentFromSearchResult(type=doc_type, id_nr=id_nr, browser=self.browser, row_index=row_index, company=company)
+        if doc_type == "SI" and self.si_loader is not None:
+            court, register_nr = split_register_number(company.court)
+            for document in company.documents[first_new:]:
+                self.si_loader.submit(document.path, document.sha256, court, register_nr)
+
+    def pool_rows(self, rows : list[tuple[int, SearchResult]]) -> set[int]:
+        """The rows of a result page whose documents are downloaded by the sessions of the pool (--sessions):
+        the rows with documents that are not in the store, if there are at least two of them. A session of the pool
+        runs the search itself before its first download (about three requests), this session is on the result page
+        already, so a single row and the rows served by the store are downloaded here."""
+        if self.pool is None or not self.documents_requested():
+            return set()
+        from planner import document_requests
+        requested = [doc_type for flag, doc_type in document_flags.items() if getattr(self.args, flag)]
+        missing = {row_index for row_index, company in rows if document_requests(company, requested, self)}
+        return missing if len(missing) > 1 else set()
 
-        id_nrs_found = re.findall(r'selectedSuchErgebnisFormTable:0:j_idt(\d+):0:fade', html)
-        if not id_nrs_found: 
+    def iter_companies(self) -> Iterator[SearchResult]:
+        """Search and yield the companies of all result pages, each one as soon as its row is parsed 
+        (and its documents are downloaded). The next result page is requested only when the caller gets there, 
+        so stopping early saves the requests for the remaining pages."""
+        cache_key = self.search_cache_key()
+        if self.args.local and not self.args.force and not self.documents_requested():
+            local = self.search_local()
+            if local:
+                logging.info(f"{len(local)} companies found in the local index")
+                yield from local
+                return
+        if not self.args.force and not self.documents_requested():
+            cached = self.search_cache.get(cache_key)
+            if cached is not None:
+                logging.info(f"return cached content for {' '.join(self.args.schlagwoerter)}")
+                for page in cached.split(result_page_separator):
+                    with self.metrics.timer("parse_results"):
+                        companies = [company for _, company in parse_search_results(page, self.args.parser)]
+                    self.company_index.upsert(companies)
+                    yield from companies
+                return
+
+        html = self.submit_search()
+        if html is None:
+            return
+        id_nr = find_result_id_nr(html)
+        if id_nr is None:
             logging.info(f"no id_nr found in {html}")
-            return []
-        id_nr = id_nrs_found[0]
+            return
+        paginated = result_paginator_re.search(html) is not None
 
-        for table_row in grid.find_all('tr'):
-            index_str = table_row.get('data-ri')
-            if index_str is None: 
-                continue
-            #print('r[%s] %s' % (index_str, result))
-            company = parse_result(table_row)
-            if not company: 
-                logging.info(f"could not create a search result object @ {index_str=}")
-                continue
-            
-            companies.append(company)
+        pages = [html]
+        page_size = None
+        while True:
+            with self.metrics.timer("parse_results"):
+                rows = parse_search_results(pages[-1], self.args.parser)
+            self.company_index.upsert(company for _, company in rows)
+            if page_size is None:
+                page_size = len(rows)
+            if rows:
+                self.result_page = ResultPage(cache_key, id_nr, rows[0][0], page_size)
+            # the sessions of the pool download the documents of these rows at the same time
+            pooled = self.pool_rows(rows)
+            futures = {row_index : self.pool.submit(self.args, company, row_index, rows[0][0], page_size)
+                       for row_index, company in rows if row_index in pooled}
+            for row_index, company in rows:
+                if row_index in futures:
+                    yield futures[row_index].result()
+                else:
+                    self.download_documents(company, id_nr, row_index)
+                    yield company
+            if not paginated or not rows or len(rows) < page_size:
+                break
+            page = self.fetch_result_page(first=rows[-1][0] + 1, rows=page_size)
+            if page is None:
+                # incomplete result, do not cache it
+                return
+            pages.append(page)
+        # only complete results are cached
+        self.search_cache.put(cache_key, result_page_separator.join(pages))
 
-        
-            if self.args.currentHardCopy:
-                self.getDocumentFromSearchResult(type="AD", id_nr=id_nr, browser=self.browser, row_index=len(companies)-1, company=company)
-            if self.args.chronologicalHardCopy:
-                self.getDocumentFromSearchResult(type="CD", id_nr=id_nr, browser=self.browser, row_index=len(companies)-1, company=company)
-            if self.args.historicalHardCopy:
-                self.getDocumentFromSearchResult(type="CD", id_nr=id_nr, browser=self.browser, row_index=len(companies)-1, company=company)
-            if self.args.structuredContent:
-                self.getDocumentFromSearchResult(type="SI", id_nr=id_nr, browser=self.browser, row_index=len(companies)-1, company=company)
-            
-            if self.args.downloadAllDocuments:
-                # copy the browser object so that self.browser remains in the same state
-                self.getDocsFromDocsPage(browser=copy.copy(self.browser), id_nr=id_nr, row_index=len(companies)-1, company=company)         
+    def start_workers(self) -> None:
+        "start the background workers requested by the arguments: session pool (--sessions) and SI loader (--siStore)"
+        if self.args.siStore:
+            from structured import StructuredLoader, StructuredStore
+            self.si_loader = StructuredLoader(StructuredStore(self.args.siStore), workers=self.args.siWorkers)
+        if self.pool_size() > 1:
+            from pool import SessionPool
+            self.pool = SessionPool(self.args, self.pool_size(), parent=self)
+
+    def pool_size(self) -> int:
+        "sessions of the pool: --sessions, but not more than --maxResults, as every session runs the search itself"
+        return min(self.args.sessions, self.args.maxResults or self.args.sessions)
+
+    def close(self) -> None:
+        "wait for the background workers"
+        if self.pool is not None:
+            self.pool.close()
+        if self.si_loader is not None:
+            self.si_loader.close()
+            logging.info(f"{self.si_loader.loaded} SI files loaded into {self.args.siStore}")
+
+    def write_metrics(self) -> None:
+        "print the profile (--profile) and write the metrics file (--metricsFile) of the run"
+        if self.args.profile:
+            print(self.metrics.report(), file=sys.stderr)
+        if self.args.metricsFile:
+            self.metrics.write(self.args.metricsFile)
+
+    def search_local(self) -> list[SearchResult]:
+        "answer the search from the local company index, without any request"
+        return [SearchResult.fromDict(d) for d in self.company_index.search(
+            self.args.schlagwoerter, self.args.schlagwortOptionen, self.args.registerNummer, self.args.registerGericht)]
+
+    def search_companies(self) -> list[SearchResult]:
+        "search and return the companies of all result pages"
+        return list(self.iter_companies())
+
+
+def find_result_id_nr(html : str) -> str | None:
+    "the number in the ids of the result table, needed to address the document links of a row"
+    id_nrs_found = re.findall(r'selectedSuchErgebnisFormTable:0:j_idt(\d+):0:fade', html)
+    return id_nrs_found[0] if id_nrs_found else None
+
+
+# document tree (DK) of the documents view
+dk_path = "/rp_web/documents-dk.xhtml"
+dk_node_re = re.compile(r'<li id="dk_form:dktree:(.*?)"')
+dk_node_class_re = re.compile(r'<li id="dk_form:dktree:([^"]*)"[^>]*?class="([^"]*)"')
+dk_label_re = re.compile(r'role="treeitem">(.*?)</span>')
+dk_download_button_re = re.compile(r'<button id="dk_form:j_idt(\d*?)" name="dk_form:j_idt(\d*?)" class="ui-button ui-widget ui-state-default ui-corner-all ui-button-text-only" onclick="" type="submit">')
+dk_download_disabled = 'onclick="" type="submit" disabled="disabled">'
+
+def parse_dk_tree(html : str) -> list[tuple[str, str, bool | None]]:
+    """find the nodes of the document tree
+    returns: [(node id, label, True for a leaf / False for a folder / None if unknown), ...]"""
+    tree_ids = dk_node_re.findall(html)
+    names = dk_label_re.findall(html)
+    if len(tree_ids) != len(names):
+        logging.error(f"{len(tree_ids)=} != {len(names)=}")
+        return []
+    classes = dict(dk_node_class_re.findall(html))
+    nodes = []
+    for id, name in zip(tree_ids, names):
+        css = classes.get(id, "").split()
+        is_leaf = True if "ui-treenode-leaf" in css else False if "ui-treenode-parent" in css else None
+        nodes.append((id, name, is_leaf))
+    return nodes
 
-        return companies
+def find_dk_download_button(html : str) -> str | None:
+    "the number of the enabled download button ('j_idt<nr>') of the documents view"
+    re_finding = dk_download_button_re.search(html)
+    return re_finding.group(1) if re_finding else None
 
+def dk_select_request(base_url : str, view_state : str, node : str) -> mechanize.Request:
+    "AJAX request that selects 'node' of the document tree"
+    import mechanize
+    return mechanize.Request(url=base_url + dk_path, 
+                            data = {
+                                'javax.faces.partial.ajax': 'true',
+                                'javax.faces.source': 'dk_form:dktree',
+                                'javax.faces.partial.execute': 'dk_form:dktree',
+                                'javax.faces.partial.render': 'dk_form:detailsNodePanelGrid dk_form:dktree',
+                                'javax.faces.behavior.event': 'select',
+                                'javax.faces.partial.event': 'select',
+                                'dk_form:dktree_instantSelection': node,
+                                'dk_form': 'dk_form',
+                                'javax.faces.ViewState': view_state,
+                                'dk_form:dktree_selection': node,
+                                'dk_form:dktree_scrollState': '0,0'
+                            })
 
+def dk_download_request(base_url : str, view_state : str, selection : str, j_id : str) -> mechanize.Request:
+    "request that downloads the selected node(s), a comma separated selection is downloaded as zip"
+    import mechanize
+    return mechanize.Request(
+        url = base_url + dk_path,
+        data= {
+            'dk_form': 'dk_form',
+            'javax.faces.ViewState': view_state,
+            'dk_form:dktree_selection': selection,
+            'dk_form:dktree_scrollState': '0,0',
+            'dk_form:radio_dkbuttons': 'true' if "," in selection else 'false', # true if download as zip
+            f'dk_form:j_idt{j_id}': ''
+        }
+    )
+
+def cookie_to_dict(cookie : mechanize.Cookie) -> dict:
+    "convert a cookie for saving it as JSON"
+    d = dict(vars(cookie))
+    d['rest'] = d.pop('_rest', {})
+    return d
+
+def cookie_from_dict(d : dict) -> mechanize.Cookie:
+    import mechanize
+    return mechanize.Cookie(**d)
+
+# paging of the result table
+result_paginator_re = re.compile(r'selectedSuchErgebnisFormTable_paginator')
+result_page_update_re = re.compile(
+    r'<update id="ergebnissForm:selectedSuchErgebnisFormTable"><!\[CDATA\[(.*?)\]\]></update>', re.DOTALL)
+# separates the result pages of one search in the search cache
+result_page_separator = "\n<!-- next result page -->\n"
+
+# backends for parsing the HTML of the portal
+parser_backends = ("auto", "bs4", "lxml")
+
+def resolve_parser_backend(backend : str = "auto") -> str:
+    "'auto' selects lxml if it is installed, otherwise BeautifulSoup"
+    if backend not in parser_backends:
+        raise ValueError(f"unknown parser backend {backend}, expected one of {parser_backends}")
+    if backend == "bs4":
+        return backend
+    try:
+        import lxml.html
+    except ImportError:
+        if backend == "lxml":
+            logging.warning("lxml is not installed, parse with BeautifulSoup")
+        return "bs4"
+    return "lxml"
+
+def lxml_document(html : str):
+    import lxml.html
+    # encode, lxml refuses strings with an XML encoding declaration
+    parser = lxml.html.HTMLParser(encoding="utf-8")
+    return lxml.html.document_fromstring(html.encode("utf-8"), parser=parser)
+
+def parse_search_results(html : str, backend : str = "auto") -> list[tuple[int, SearchResult]]:
+    "parse the result table of a search page, returns (row index, company) for each row"
+    results = []
+    if resolve_parser_backend(backend) == "lxml":
+        rows = lxml_document(html).xpath('(//table[@role="grid"])[1]//tr[@data-ri]')
+        parse_row = parse_result_lxml
+    else:
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html, 'html.parser')
+        grid = soup.find('table', role='grid')
+        if grid is None:
+            return results
+        rows = grid.find_all('tr', attrs={'data-ri' : True})
+        parse_row = parse_result
+    for table_row in rows:
+        index_str = table_row.get('data-ri')
+        company = parse_row(table_row)
+        if not company: 
+            logging.info(f"could not create a search result object @ {index_str=}")
+            continue
+        results.append((int(index_str), company))
+    return results
+
+def parse_court_names(html : str, backend : str = "auto") -> dict[str, str]:
+    "map the names of the register courts in the search form to their ids"
+    if resolve_parser_backend(backend) == "lxml":
+        options = lxml_document(html).xpath('//*[@id="form:registergericht_input"]//option[@value]')
+        return {
+            str(o.text_content()).strip() : o.get('value')
+            for o in options if o.get('value')
+        }
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    gerichte_inputs = soup.find(id='form:registergericht_input')
+    if gerichte_inputs is None:
+        return {}
+    return {
+        str(o.text).strip() : o['value'] 
+        for o in gerichte_inputs.select('option') if o.get('value')
+    }
 
 def parse_result(html) -> SearchResult | None:
-    cells = []
-    for cellnum, cell in enumerate(html.find_all('td')):
-        cells.append(cell.text.strip())
+    "create a SearchResult from a row (BeautifulSoup tag) of the result table"
+    cells = [cell.text.strip() for cell in html.find_all('td')]
+    return result_from_cells(cells)
+
+def parse_result_lxml(html) -> SearchResult | None:
+    "create a SearchResult from a row (lxml element) of the result table"
+    cells = [str(cell.text_content()).strip() for cell in html.iter('td')]
+    return result_from_cells(cells)
+
+def result_from_cells(cells : list[str]) -> SearchResult | None:
+    "the texts of all (nested) cells of a result row -> SearchResult"
     #assert cells[7] == 'History'
-    if len(cells) < 4:
-        logging.error(f"found only {len(cells)} cells in search result html: {html[:200]} ...")
+    if len(cells) < 5:
+        logging.error(f"found only {len(cells)} cells in search result: {cells} ...")
         return None
     search_result = SearchResult(
         court = cells[1],
@@ -438,16 +1137,13 @@ def parse_result(html) -> SearchResult | None:
     )
     # d['documents'] = cells[5] # todo: get the document links    
     hist_start = 8
-    hist_cnt = (len(cells)-hist_start)/3
-    for i in range(hist_start, len(cells)-1, 3):
-        search_result.history.append({'name' : cells[i], 
-                                      'location' : cells[i+1]}) # (name, location)
-    #print('d:',d)
+    search_result.history = tuple((cells[i], cells[i+1]) # (name, location)
+                                  for i in range(hist_start, len(cells)-1, 3))
     return search_result
 
-def parse_args(args_string = None):
-    # Parse arguments
-    parser = argparse.ArgumentParser(description='A handelsregister CLI')
+def build_parser(description : str = 'A handelsregister CLI') -> argparse.ArgumentParser:
+    "the parser of all command line arguments, also used by the service mode"
+    parser = argparse.ArgumentParser(description=description)
     parser.add_argument(
                           "-d",
                           "--debug",
@@ -470,9 +1166,7 @@ def parse_args(args_string = None):
                           "-s",
                           "--schlagwoerter",
                           help="Search for the provided keywords",
-                          required=True,
-                          nargs='+',
-                          default="Gasag AG" # TODO replace default with a generic search term
+                          nargs='+'
                         )
     parser.add_argument(
                           "-so",
@@ -523,12 +1217,223 @@ def parse_args(args_string = None):
                           help="Download all documents in the documents view.",
                           action="store_true"
                         )
+    parser.add_argument(
+                          "--rateLimit",
+                          help="Maximum number of requests per hour (default: 60, see the terms of use of the portal)",
+                          type=int,
+                          default=60
+                        )
+    parser.add_argument(
+                          "--rateLimitFile",
+                          help="File that keeps the state of the rate limit, shared by all processes using it",
+                          default="cache/ratelimit.sqlite"
+                        )
+    parser.add_argument(
+                          "--cacheTTL",
+                          help="Seconds a cached search result stays valid (default: one day)",
+                          type=float,
+                          default=24*3600
+                        )
+    parser.add_argument(
+                          "--cacheSize",
+                          help="Maximum number of cached search results",
+                          type=int,
+                          default=1000
+                        )
+    parser.add_argument(
+                          "-b",
+                          "--batch",
+                          help="Run all queries of a JSONL or CSV file in one session (see README)"
+                        )
+    parser.add_argument(
+                          "--batchOutput",
+                          help="JSONL file the batch results are appended to (default: <batch file>.results.jsonl)"
+                        )
+    parser.add_argument(
+                          "--plan",
+                          help="Only print the searches of a batch run after removing duplicate queries, "
+                               "with an estimate of their requests; nothing is sent",
+                          action="store_true"
+                        )
+    parser.add_argument(
+                          "--checkpoint",
+                          help="Checkpoint file of the batch run (default: <batch file>.checkpoint.json)"
+                        )
+    parser.add_argument(
+                          "--watch",
+                          help="Check the companies of a watchlist (JSONL or CSV, like --batch) for changes, "
+                               "only the changes are written (see README)"
+                        )
+    parser.add_argument(
+                          "--watchState",
+                          help="State and schedule of the watchlist entries (default: %(default)s)",
+                          default="cache/watchlist.sqlite"
+                        )
+    parser.add_argument(
+                          "--watchBudget",
+                          help="Requests a watchlist run may use (default: --rateLimit)",
+                          type=int
+                        )
+    parser.add_argument(
+                          "--watchOutput",
+                          help="JSONL file the changes are appended to (default: standard output)"
+                        )
+    parser.add_argument(
+                          "--budget",
+                          help="Requests the search with its documents may use, the documents are downloaded "
+                               "most valuable first and the rest is skipped (see README)",
+                          type=int
+                        )
+    parser.add_argument(
+                          "--deadline",
+                          help="Seconds after which no further documents of the search are downloaded",
+                          type=float
+                        )
+    parser.add_argument(
+                          "--priority",
+                          help="Priority of the search in a service started with --schedule (default: %(default)s)",
+                          choices=["interactive", "normal", "bulk"],
+                          default="interactive"
+                        )
+    parser.add_argument(
+                          "--storeMaxAge",
+                          help="Seconds a stored AD/CD/HD/SI document is served instead of downloading it again (default: one week)",
+                          type=float,
+                          default=7*24*3600
+                        )
+    parser.add_argument(
+                          "--docsZip",
+                          help="With -docs: download all missing documents of a company as one zip file",
+                          action="store_true"
+                        )
+    parser.add_argument(
+                          "--treeCacheTTL",
+                          help="Seconds the document tree of a company is reused instead of walking it again (default: one day)",
+                          type=float,
+                          default=24*3600
+                        )
+    parser.add_argument(
+                          "--baseUrl",
+                          help="URL of the portal, e.g. of a local stand-in started with replay.py",
+                          default="https://www.handelsregister.de"
+                        )
+    parser.add_argument(
+                          "--record",
+                          help="Record all requests and responses to this directory (for replay.py)"
+                        )
+    parser.add_argument(
+                          "--sessionFile",
+                          help="File the session cookies are saved to, so that the next run can skip the start page",
+                          default="cache/session.json"
+                        )
+    parser.add_argument(
+                          "--sessionMaxIdle",
+                          help="Seconds after which a saved session is considered expired, 0 disables the reuse (default: 900)",
+                          type=float,
+                          default=900
+                        )
+    parser.add_argument(
+                          "--maxResults",
+                          help="Stop after this many companies, further result pages are not requested",
+                          type=int
+                        )
+    parser.add_argument(
+                          "--local",
+                          help="Answer the search from the local index of companies seen before, "
+                               "the portal is asked only with -f or if the index has no match",
+                          action="store_true"
+                        )
+    parser.add_argument(
+                          "--indexFile",
+                          help="SQLite file with the local index of companies (default: cache/companies.sqlite)",
+                          default="cache/companies.sqlite"
+                        )
+    parser.add_argument(
+                          "--sessions",
+                          help="Number of parallel browser sessions for downloading documents (default: 1)",
+                          type=int,
+                          default=1
+                        )
+    parser.add_argument(
+                          "--output",
+                          help="Output format: text blocks (default), jsonl (one JSON object per company) or csv",
+                          choices=output_formats,
+                          default="text"
+                        )
+    parser.add_argument(
+                          "--siStore",
+                          help="Parse the downloaded structured content (-si) and load officers, capital, legal form, "
+                               "seat and events into this SQLite file",
+                        )
+    parser.add_argument(
+                          "--siWorkers",
+                          help="Processes for parsing the structured content (default: number of CPUs)",
+                          type=int
+                        )
+    parser.add_argument(
+                          "--timeout",
+                          help="Timeout of every request in seconds (default: 30)",
+                          type=float,
+                          default=30
+                        )
+    parser.add_argument(
+                          "--retries",
+                          help="Retries of a request after a timeout, connection error, 429 or 5xx, "
+                               "with exponential backoff (default: 3)",
+                          type=int,
+                          default=3
+                        )
+    parser.add_argument(
+                          "--profile",
+                          help="Print the time, bytes and rate limit wait of every kind of request and of the parsing",
+                          action="store_true"
+                        )
+    parser.add_argument(
+                          "--metricsFile",
+                          help="Write the metrics of the run to this file: Prometheus textfile if it ends with .prom, "
+                               "otherwise JSON",
+                        )
+    parser.add_argument(
+                          "--courtFile",
+                          help="Table of the register courts, read from the search form (default: %(default)s)",
+                          default="cache/courts.json"
+                        )
+    parser.add_argument(
+                          "--courtRefresh",
+                          help="Read the register courts from the search form again after this many days "
+                               "(default: %(default)s)",
+                          type=float,
+                          default=30
+                        )
+    parser.add_argument(
+                          "--parser",
+                          help="HTML parser for search results: lxml (fast, if installed), bs4 or auto (default)",
+                          choices=parser_backends,
+                          default="auto"
+                        )
+    parser.add_argument(
+                          "--server",
+                          help="Send the search to a running service (python service.py) at this URL, "
+                               "e.g. http://127.0.0.1:5000, instead of running it in this process",
+                        )
+    return parser
+
+def parse_args(args_string = None):
+    # Parse arguments
+    parser = build_parser()
     if args_string:
         args = parser.parse_args(re.split(r'\s+', args_string))
     else:
         args = parser.parse_args()
+    if not args.schlagwoerter and not args.batch and not args.watch:
+        parser.error("one of the arguments -s/--schlagwoerter, -b/--batch or --watch is required")
+    if args.sessions < 1:
+        parser.error("--sessions must be at least 1")
     # manually set args for enabling interactive mode
+    setup_logging(args)
+    return args
 
+def setup_logging(args : argparse.Namespace) -> None:
     # Enable debugging if wanted
     if args.debug == True:
         logger = logging.getLogger("mechanize")
@@ -540,18 +1445,48 @@ def parse_args(args_string = None):
         logger.addHandler(logging.StreamHandler(sys.stdout))
         logger.setLevel(logging.INFO)
         logging.basicConfig(level=logging.INFO)
-    return args
 
 if __name__ == "__main__":
     args = parse_args()
     #args = parse_args('-s fieldfisher -gericht Berlin (Charlottenburg) -nr HRB 248027 -d')
     logging.debug(f"{args = }")
-    h = HandelsRegister(args)
-    h.open_startpage()
-    self = h # for Python Interactive Mode 
-    companies = h.search_companies()
-    if not companies: 
+    if args.batch:
+        from batch import run_batch
+        run_batch(args)
+        sys.exit(0)
+    if args.watch:
+        from watchlist import run_watch
+        run_watch(args)
+        sys.exit(0)
+    # every company is written as soon as it is found
+    writer = make_writer(args.output, sys.stdout)
+    if args.server:
+        from service import query_server
+        for company in query_server(args.server, args):
+            writer.write(company)
+    elif args.budget is not None or args.deadline is not None:
+        from scheduler import Scheduler
+        h = HandelsRegister(args)
+        h.start_workers()
+        scheduler = Scheduler(h)
+        job = scheduler.submit(args, deadline=time.time() + args.deadline if args.deadline is not None else None,
+                               budget=args.budget)
+        scheduler.run_pending()
+        for company in job.result():
+            writer.write(company)
+        for name, doc_type, reason in job.skipped:
+            logging.warning(f"skipped {doc_type} of {name}: {reason}")
+        logging.info(f"{job.spent} requests")
+        h.close()
+        h.write_metrics()
+    else:
+        h = HandelsRegister(args)
+        h.start_workers()
+        # the start page is opened by search_companies only if the result is not cached
+        self = h # for Python Interactive Mode 
+        for company in itertools.islice(h.iter_companies(), args.maxResults):
+            writer.write(company)
+        h.close()
+        h.write_metrics()
+    if not writer.count and args.output == "text": 
         print("No companies matching your search")
-    else: 
-        for company in companies:
-            print(company, end='\n\n')
@@ -0,0 +1,200 @@
+"""
+Timing and budget metrics of the portal requests and of the parsing.
+Every HTTP request of HandelsRegister is recorded with its operation name, latency, response code, bytes, retry
+number and the time it waited for the rate limit. The summary is printed with --profile and can be written as JSON
+or as Prometheus textfile with --metricsFile.
+"""
+
+import contextlib
+import json
+import math
+import os
+import pathlib
+import random
+import tempfile
+import threading
+import time
+from typing import Iterator
+
+# quantiles of the summary
+percentiles = (50, 90, 99)
+# latencies kept per operation for the quantiles; beyond that a uniform sample (reservoir) of all calls is kept,
+# so a long running service needs the same memory and time for its summary
+RESERVOIR_SIZE = 1024
+
+
+def percentile(values : list[float], p : float) -> float:
+    "nearest rank percentile of sorted 'values'"
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+
+class OperationStats:
+    "the recorded calls of one operation"
+    __slots__ = ('kind', 'seconds', 'count', 'total', 'max', 'bytes', 'errors', 'retries', 'wait', 'codes')
+
+    def __init__(self, kind : str) -> None:
+        self.kind = kind            # "http" or "parse"
+        self.seconds : list[float] = []     # all latencies, or a sample of RESERVOIR_SIZE of them
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bytes = 0
+        self.errors = 0
+        self.retries = 0
+        self.wait = 0.0             # seconds waited for the rate limit
+        self.codes : dict[int, int] = {}
+
+    def add(self, seconds : float) -> None:
+        "record the latency of a call"
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.seconds) < RESERVOIR_SIZE:
+            self.seconds.append(seconds)
+        else:
+            # every call is in the sample with the same probability
+            i = random.randrange(self.count)
+            if i < RESERVOIR_SIZE:
+                self.seconds[i] = seconds
+
+    def summary(self) -> dict:
+        seconds = sorted(self.seconds)
+        d = {
+            'kind' : self.kind,
+            'count' : self.count,
+            'total_seconds' : self.total,
+            'max_seconds' : self.max,
+        }
+        d.update({f'p{p}_seconds' : percentile(seconds, p) for p in percentiles})
+        if self.kind == "http":
+            d.update({
+                'bytes' : self.bytes,
+                'errors' : self.errors,
+                'retries' : self.retries,
+                'rate_limit_wait_seconds' : self.wait,
+                'codes' : {str(code) : n for code, n in sorted(self.codes.items())},
+            })
+        return d
+
+
+class Metrics:
+    "collects the calls of all operations, can be shared by several sessions (threads)"
+    def __init__(self) -> None:
+        self.operations : dict[str, OperationStats] = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def _stats(self, op : str, kind : str) -> OperationStats:
+        stats = self.operations.get(op)
+        if stats is None:
+            stats = self.operations[op] = OperationStats(kind)
+        return stats
+
+    def record_request(self, op : str, seconds : float, code : int | None, bytes : int = 0,
+                       retry : int = 0, wait : float = 0.0) -> None:
+        "one HTTP request, 'code' None if it failed without a response"
+        with self.lock:
+            stats = self._stats(op, "http")
+            stats.add(seconds)
+            stats.bytes += bytes
+            stats.wait += wait
+            stats.retries += 1 if retry else 0
+            if code is not None:
+                stats.codes[code] = stats.codes.get(code, 0) + 1
+            if code is None or code >= 400:
+                stats.errors += 1
+
+    def record_parse(self, op : str, seconds : float) -> None:
+        with self.lock:
+            self._stats(op, "parse").add(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, op : str) -> Iterator[None]:
+        "record the time of the block as parse operation 'op'"
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_parse(op, time.perf_counter() - start)
+
+    def summary(self) -> dict:
+        with self.lock:
+            operations = {op : stats.summary() for op, stats in sorted(self.operations.items())}
+        http = [d for d in operations.values() if d['kind'] == "http"]
+        return {
+            'started' : self.started,
+            'duration_seconds' : time.time() - self.started,
+            'requests' : sum(d['count'] for d in http),
+            'bytes' : sum(d['bytes'] for d in http),
+            'rate_limit_wait_seconds' : sum(d['rate_limit_wait_seconds'] for d in http),
+            'operations' : operations,
+        }
+
+    def report(self) -> str:
+        "table of all operations for the terminal"
+        summary = self.summary()
+        header = f"{'operation':<22}{'count':>6}{'total s':>9}" + "".join(f"{f'p{p} ms':>9}" for p in percentiles) + \
+                 f"{'max ms':>9}{'KiB':>9}{'wait s':>8}{'retries':>8}{'errors':>7}"
+        lines = [header, "-" * len(header)]
+        for op, d in summary['operations'].items():
+            line = f"{op:<22}{d['count']:>6}{d['total_seconds']:>9.2f}" + \
+                   "".join(f"{d[f'p{p}_seconds'] * 1000:>9.1f}" for p in percentiles) + f"{d['max_seconds'] * 1000:>9.1f}"
+            if d['kind'] == "http":
+                line += f"{d['bytes'] / 1024:>9.1f}{d['rate_limit_wait_seconds']:>8.1f}{d['retries']:>8}{d['errors']:>7}"
+            lines.append(line)
+        lines.append(f"{summary['requests']} requests, {summary['bytes'] / 1024:.1f} KiB, "
+                     f"{summary['rate_limit_wait_seconds']:.1f} s rate limit wait, {summary['duration_seconds']:.1f} s total")
+        return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        "the summary in the Prometheus text format, e.g. for the textfile collector of node_exporter"
+        summary = self.summary()
+        lines = []
+        def metric(name, kind, help, samples):
+            lines.append(f"# HELP handelsregister_{name} {help}")
+            lines.append(f"# TYPE handelsregister_{name} {kind}")
+            for labels, value in samples:
+                label_str = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"handelsregister_{name}{{{label_str}}} {value}" if labels else
+                             f"handelsregister_{name} {value}")
+        operations = summary['operations']
+        http = {op : d for op, d in operations.items() if d['kind'] == "http"}
+        metric("operation_seconds", "summary", "duration of requests and parsing per operation",
+               [({'operation' : op, 'quantile' : p / 100}, d[f'p{p}_seconds']) for op, d in operations.items()
+                for p in percentiles])
+        lines.extend(f'handelsregister_operation_seconds_sum{{operation="{op}"}} {d["total_seconds"]}'
+                     for op, d in operations.items())
+        lines.extend(f'handelsregister_operation_seconds_count{{operation="{op}"}} {d["count"]}'
+                     for op, d in operations.items())
+        metric("requests_total", "counter", "HTTP requests per operation and response code",
+               [({'operation' : op, 'code' : code}, n) for op, d in http.items() for code, n in d['codes'].items()])
+        metric("request_errors_total", "counter", "failed HTTP requests per operation",
+               [({'operation' : op}, d['errors']) for op, d in http.items()])
+        metric("request_retries_total", "counter", "retried HTTP requests per operation",
+               [({'operation' : op}, d['retries']) for op, d in http.items()])
+        metric("response_bytes_total", "counter", "bytes received per operation",
+               [({'operation' : op}, d['bytes']) for op, d in http.items()])
+        metric("rate_limit_wait_seconds_total", "counter", "time waited for the rate limit per operation",
+               [({'operation' : op}, d['rate_limit_wait_seconds']) for op, d in http.items()])
+        metric("last_run_timestamp_seconds", "gauge", "end of the last run", [({}, time.time())])
+        return "\n".join(lines) + "\n"
+
+    def write(self, path : str | pathlib.Path) -> None:
+        "write the metrics atomically, as Prometheus textfile if the name ends with .prom, otherwise as JSON"
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix == ".prom":
+            text = self.prometheus()
+        else:
+            text = json.dumps(self.summary(), indent=2)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_name, path)
+        except BaseException:
+            pathlib.Path(tmp_name).unlink(missing_ok=True)
+            raise
@@ -0,0 +1,199 @@
+"""
+Planning stage of batch mode: before the first request the queries of a batch are normalized and collapsed, so that
+every company is searched once per run, with the documents all its queries ask for.
+
+Queries that differ only in spelling (case, blanks, the letters of the register number) become one search.
+A query that names one company, an exact name or a register number with court, is turned into a lookup of that
+court and register number if the company index knows exactly one such company; then a keyword query and a
+register number query of the same company are one search as well. The estimate of the requests of a plan is printed
+by --plan without sending any.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from companyindex import CompanyIndex
+from courts import CourtIndex, normalize
+from handelsregister import SearchResult, document_flags, split_register_number
+from searchcache import SearchCache
+
+if TYPE_CHECKING:
+    from handelsregister import HandelsRegister
+
+# requests for the documents view of a company whose document tree was never walked: result page, documents view,
+# a few folders and files
+DK_UNKNOWN_REQUESTS = 6
+
+
+class PlannedSearch:
+    "a search of the plan and the batch queries it answers"
+    def __init__(self, query : dict, company : dict | None = None) -> None:
+        self.query = dict(query)        # the query that is sent, with the document flags of all members
+        self.company = company          # the company from the index for a register lookup, else None
+        self.members : list[tuple[str, dict]] = []  # (id, query) of the batch queries
+        self.requests = 0               # estimate, set by estimate_requests
+
+    def add(self, id : str, query : dict) -> None:
+        self.members.append((id, query))
+        # the documents of all members are downloaded
+        for flag in document_flags:
+            self.query[flag] = bool(self.query[flag] or query[flag])
+
+    @property
+    def documents(self) -> list[str]:
+        return [doc_type for flag, doc_type in document_flags.items() if self.query[flag]]
+
+    def __str__(self) -> str:
+        q = self.query
+        text = f"{q['schlagwortOptionen']} {' '.join(q['schlagwoerter'])!r}"
+        if q['registerNummer']:
+            text += f" {' '.join(q['registerNummer'])}"
+        if q['registerGericht']:
+            text += f" @ {' '.join(q['registerGericht'])}"
+        if self.documents:
+            text += f" [{' '.join(self.documents)}]"
+        return text
+
+
+def words(value : list[str] | str | None) -> str:
+    "a list field of a query as one string with single blanks"
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        value = ' '.join(value)
+    return ' '.join(value.split())
+
+
+def resolve(query : dict, index : CompanyIndex, courts : CourtIndex | None = None) -> dict | None:
+    """the company of the index a query names, if the query names one company and the index knows exactly one:
+    an exact name (the whole name, not a part of it) or a register number with court
+    returns: the company as dict of CompanyIndex.search or None"""
+    exact = query['schlagwortOptionen'] == "exact"
+    if not exact and not (query['registerNummer'] and query['registerGericht']):
+        return None
+    court = words(query['registerGericht']) or None
+    if court and courts is not None:
+        try:
+            court = courts.match(court).name
+        except ValueError:
+            return None
+    companies = index.search(query['schlagwoerter'], query['schlagwortOptionen'], query['registerNummer'], court,
+                             limit=10)
+    if exact:
+        name = normalize(words(query['schlagwoerter']))
+        companies = [c for c in companies if normalize(c['name']) == name]
+    return companies[0] if len(companies) == 1 else None
+
+
+def lookup_query(company : dict, query : dict, courts : CourtIndex | None = None) -> dict:
+    "the query that finds just 'company': its exact name, register number and, if known, court"
+    court_cell, register_nr = split_register_number(company['court'])
+    court = courts.in_text(court_cell) if courts is not None else None
+    lookup = dict(query)
+    lookup['schlagwoerter'] = company['name'].split()
+    lookup['schlagwortOptionen'] = "exact"
+    lookup['registerNummer'] = register_nr.split() or query['registerNummer']
+    lookup['registerGericht'] = [court.name] if court is not None else query['registerGericht']
+    return lookup
+
+
+def plan_key(query : dict, courts : CourtIndex | None = None) -> tuple:
+    "queries with the same key find the same companies"
+    court = words(query['registerGericht'])
+    if court and courts is not None:
+        try:
+            court = courts.match(court).name
+        except ValueError:
+            pass
+    return ('query', words(query['schlagwoerter']).lower(), query['schlagwortOptionen'],
+            ''.join(ch for ch in words(query['registerNummer']) if ch.isnumeric()), normalize(court))
+
+
+def plan_queries(queries : list[tuple[str, dict]], index : CompanyIndex | None = None,
+                 courts : CourtIndex | None = None) -> list[PlannedSearch]:
+    """collapse the (id, normalized query) pairs of a batch into searches, in the order of their first query
+    With the company index, queries naming a company the index knows become a lookup of its register number."""
+    plan : dict[tuple, PlannedSearch] = {}
+    for id, query in queries:
+        company = resolve(query, index, courts) if index is not None else None
+        if company is not None:
+            _, register_nr = split_register_number(company['court'])
+            key = ('company', CompanyIndex.company_key(company['court'], register_nr, company['name']))
+            if key not in plan:
+                plan[key] = PlannedSearch(lookup_query(company, query, courts), company)
+        else:
+            key = plan_key(query, courts)
+            if key not in plan:
+                plan[key] = PlannedSearch(query)
+        plan[key].add(id, query)
+    return list(plan.values())
+
+
+def estimate_requests(plan : list[PlannedSearch], h : HandelsRegister) -> int:
+    """Estimate the requests of every search of the plan from the local data, without sending any:
+    the search itself (none if it is cached), and every document that is not in the document store.
+    With --sessions every session of the pool that downloads documents of a search runs the search as well
+    (see HandelsRegister.pool_rows), and opens the start page once.
+    For a search of unknown companies one company is assumed, so the total is a lower bound.
+    returns: the estimated requests of the plan, including the start page"""
+    force = h.args.force
+    total = 0
+    pool_sessions = 0
+    for planned in plan:
+        q = planned.query
+        key = SearchCache.key(q['schlagwoerter'], q['schlagwortOptionen'], q['registerNummer'], q['registerGericht'])
+        cached = not force and not planned.documents and h.search_cache.get(key) is not None
+        # search form and search
+        requests = 0 if cached else 2
+        if planned.documents:
+            if planned.company is not None:
+                companies = [planned.company]
+            else:
+                companies = h.company_index.search(q['schlagwoerter'], q['schlagwortOptionen'], q['registerNummer'],
+                                                   words(q['registerGericht']) or None, limit=100) or [None]
+            missing = [document_requests(SearchResult.fromDict(company) if company else None, planned.documents, h)
+                       for company in companies]
+            requests += sum(missing)
+            downloading = sum(1 for n in missing if n)
+            if h.pool_size() > 1 and downloading > 1:
+                sessions = min(h.pool_size(), downloading)
+                requests += 2 * sessions
+                pool_sessions = max(pool_sessions, sessions)
+        planned.requests = requests
+        total += requests
+    return total + 1 + pool_sessions if total else 0
+
+
+def document_requests(company : SearchResult | None, documents : list[str], h : HandelsRegister) -> int:
+    "requests for the documents of a company that are not served by the document store"
+    requests = 0
+    for doc_type in documents:
+        if doc_type != "DK":
+            requests += 0 if company is not None and h.stored_document(company, doc_type) else 1
+            continue
+        tree = h.load_dk_tree(company) if company is not None and not h.args.force else None
+        if tree is None:
+            requests += DK_UNKNOWN_REQUESTS
+            continue
+        files, _ = tree
+        missing = [label for node, label in files if not h.stored_document(company, "DK", node=node, label=label)]
+        if missing:
+            # result page and documents view, then one download per file or one zip
+            requests += 2 + (1 if h.args.docsZip else len(missing))
+    return requests
+
+
+def format_plan(plan : list[PlannedSearch], total : int, rate_limit : int, tokens_left : float) -> str:
+    "the plan as text, one line per search with its estimated requests"
+    queries = sum(len(p.members) for p in plan)
+    lookups = sum(1 for p in plan if p.company is not None)
+    lines = [f"{queries} queries -> {len(plan)} searches ({queries - len(plan)} duplicates, "
+             f"{lookups} register number lookups)",
+             f"{'requests':>8} {'queries':>7}  search"]
+    for planned in plan:
+        lines.append(f"{planned.requests:>8} {len(planned.members):>7}  {planned}")
+    hours = max(0.0, total - tokens_left) / rate_limit
+    lines.append(f"estimated requests: at least {total}, {tokens_left:.0f} available now, "
+                 f"about {hours:.1f} h of waiting at {rate_limit} requests per hour")
+    return '\n'.join(lines)
@@ -0,0 +1,122 @@
+"""
+Pool of independent portal sessions for downloading documents in parallel.
+Every session has its own browser, cookie jar and JSF view state, so the documents of different result rows can be
+fetched at the same time. All sessions take their tokens from the same rate limit.
+"""
+
+import argparse
+import concurrent.futures
+import copy
+import logging
+import queue
+import threading
+
+from handelsregister import HandelsRegister, SearchResult, find_result_id_nr
+from metrics import Metrics
+from resilience import CircuitBreaker
+
+
+class SessionPool:
+    """Up to 'size' HandelsRegister sessions, served by a thread pool.
+    A session runs the search of a job itself before it downloads documents of the result, and pages to the
+    result page of the row. It keeps its result page for the next job with the same query."""
+    def __init__(self, args : argparse.Namespace, size : int, parent : HandelsRegister | None = None) -> None:
+        self.args = args
+        self.size = size
+        # the requests of all sessions are recorded together and paused together, with the metrics and the
+        # circuit breaker of the main session 'parent', SI files go to its loader, and a document downloaded by one
+        # session is not downloaded again by another one in the same run (-f) nor written under the same name
+        self.metrics = parent.metrics if parent else Metrics()
+        self.breaker = parent.breaker if parent else CircuitBreaker()
+        self.si_loader = parent.si_loader if parent else None
+        self.downloaded = parent.downloaded if parent else set()
+        self.download_names = parent.download_names if parent else {}
+        self.downloaded_lock = parent.downloaded_lock if parent else threading.Lock()
+        self.idle : queue.Queue[HandelsRegister] = queue.Queue()
+        self.sessions : list[HandelsRegister] = []
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=size, thread_name_prefix="session")
+
+    def session_args(self, args : argparse.Namespace) -> argparse.Namespace:
+        args = copy.copy(args)
+        # the sessions of the pool must not share the saved session of the main process
+        args.sessionFile = None
+        # the recorder is not shared, the traffic of the sessions would be mixed up
+        args.record = None
+        return args
+
+    def acquire(self) -> HandelsRegister:
+        "an idle session, a new one as long as there are less than 'size'"
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if len(self.sessions) < self.size:
+                session = HandelsRegister(self.session_args(self.args))
+                # (query, id_nr, first row of the current result page) of the search the session is on
+                session.pool_state = None
+                session.metrics = self.metrics
+                session.breaker = self.breaker
+                session.si_loader = self.si_loader
+                session.downloaded = self.downloaded
+                session.download_names = self.download_names
+                session.downloaded_lock = self.downloaded_lock
+                self.sessions.append(session)
+                return session
+        return self.idle.get()
+
+    def release(self, session : HandelsRegister) -> None:
+        self.idle.put(session)
+
+    @property
+    def request_count(self) -> int:
+        "requests of all sessions of the pool"
+        return sum(s.request_count for s in self.sessions)
+
+    def prepare(self, session : HandelsRegister, page_first : int, page_size : int) -> str | None:
+        """Bring 'session' to the result page that contains row 'page_first' of its query
+        returns: the id_nr of the result table or None on error"""
+        key = session.search_cache_key()
+        if session.pool_state is None or session.pool_state[0] != key:
+            session.pool_state = None
+            html = session.submit_search()
+            id_nr = find_result_id_nr(html) if html else None
+            if id_nr is None:
+                logging.error("session of the pool could not run the search")
+                return None
+            session.pool_state = (key, id_nr, 0)
+        key, id_nr, first = session.pool_state
+        if first != page_first:
+            if session.fetch_result_page(page_first, page_size) is None:
+                return None
+            session.pool_state = (key, id_nr, page_first)
+        return id_nr
+
+    def download_documents(self, query_args : argparse.Namespace, company : SearchResult, row_index : int,
+                           page_first : int = 0, page_size : int = 0) -> SearchResult:
+        "download the requested documents of a result row on one of the sessions"
+        session = self.acquire()
+        try:
+            session.args = self.session_args(query_args)
+            id_nr = self.prepare(session, page_first, page_size)
+            if id_nr is not None:
+                session.download_documents(company, id_nr, row_index)
+            return company
+        finally:
+            self.release(session)
+
+    def submit(self, query_args : argparse.Namespace, company : SearchResult, row_index : int,
+               page_first : int = 0, page_size : int = 0) -> concurrent.futures.Future:
+        "download the documents of a result row in the background, the future returns the company"
+        return self.executor.submit(self.download_documents, query_args, company, row_index, page_first, page_size)
+
+    def close(self) -> None:
+        "wait for running downloads, pending ones are cancelled (e.g. after --maxResults)"
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self) -> "SessionPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
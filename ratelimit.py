@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Rate limit that keeps the request budget for handelsregister.de.
+The portal allows 60 retrievals per hour. The limiter keeps a log of the times of the requests of the last hour
+(a sliding window), so that at most 60 requests fall into any hour, also right after a cold start. A token is a free
+slot of the window. The log is kept in a SQLite file, so that several processes on one host share a single budget.
+"""
+
+import argparse
+import contextlib
+import logging
+import pathlib
+import sqlite3
+import time
+
+
+class RateLimiter:
+    "sliding window log of the last 'capacity' requests in a SQLite file, shared between processes"
+    def __init__(self, path : str | pathlib.Path, capacity : int = 60, period : float = 3600.0,
+                 name : str = "handelsregister") -> None:
+        self.path = pathlib.Path(path)
+        self.capacity = capacity
+        self.period = period
+        self.name = name
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with contextlib.closing(self._connect()) as con:
+            con.execute("CREATE TABLE IF NOT EXISTS requests (name TEXT NOT NULL, at REAL NOT NULL)")
+            con.execute("CREATE INDEX IF NOT EXISTS requests_name_at ON requests (name, at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # a fresh connection per call keeps the limiter usable from several threads
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    def _take(self, tokens : int, consume : bool) -> tuple[float, float]:
+        """drop the requests that left the window and log 'tokens' requests if they fit (and 'consume' is set)
+        returns: (free slots, seconds until the requested number of slots is free)"""
+        con = self._connect()
+        try:
+            # BEGIN IMMEDIATE locks the database for writing, so the read-modify-write is atomic across processes
+            con.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            con.execute("DELETE FROM requests WHERE name = ? AND at <= ?", (self.name, now - self.period))
+            times = [at for at, in con.execute("SELECT at FROM requests WHERE name = ? ORDER BY at", (self.name,))]
+            available = self.capacity - len(times)
+            wait = 0.0
+            if available >= tokens:
+                if consume:
+                    con.executemany("INSERT INTO requests (name, at) VALUES (?, ?)", [(self.name, now)] * tokens)
+                    available -= tokens
+            else:
+                # the oldest requests have to leave the window first
+                wait = max(0.0, times[tokens - available - 1] + self.period - now)
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+        return float(available), wait
+
+    def try_acquire(self, tokens : int = 1) -> float:
+        """take tokens without blocking
+        returns: 0.0 if the tokens were taken, otherwise the seconds to wait until they are available"""
+        if tokens > self.capacity:
+            raise ValueError(f"cannot acquire {tokens} tokens with a capacity of {self.capacity}")
+        _, wait = self._take(tokens, consume=True)
+        return wait
+
+    def acquire(self, tokens : int = 1, block : bool = True) -> float:
+        """take tokens, sleeping until they are available if 'block' is set
+        returns: the number of seconds spent waiting; raises TimeoutError if not blocking and the window is full"""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0.0:
+                return waited
+            if not block:
+                raise TimeoutError(f"rate limit reached, next slot in {wait:.0f} s")
+            logging.info(f"rate limit reached, waiting {wait:.1f} s for the next slot")
+            time.sleep(wait)
+            waited += wait
+
+    def release(self) -> None:
+        "give back the slot of the last request, for a request that never reached the portal"
+        with contextlib.closing(self._connect()) as con:
+            con.execute("DELETE FROM requests WHERE rowid = (SELECT rowid FROM requests WHERE name = ? "
+                        "ORDER BY at DESC LIMIT 1)", (self.name,))
+
+    def tokens_left(self) -> float:
+        "number of requests that can be sent now"
+        available, _ = self._take(0, consume=False)
+        return available
+
+    def next_slot(self) -> float:
+        "seconds until the next request can be sent (0.0 if one can be sent now)"
+        _, wait = self._take(1, consume=False)
+        return wait
+
+    def status(self) -> dict:
+        "the current state of the window, e.g. for a scheduler"
+        available, wait = self._take(1, consume=False)
+        _, full_in = self._take(self.capacity, consume=False)
+        return {
+            'tokens_left' : available,
+            'capacity' : self.capacity,
+            'next_slot_in' : wait,
+            'next_slot_at' : time.time() + wait,
+            'full_in' : full_in,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Show the state of the shared handelsregister rate limit')
+    parser.add_argument("path", nargs='?', default="cache/ratelimit.sqlite", help="rate limit state file")
+    status = RateLimiter(parser.parse_args().path).status()
+    print(f"tokens left: {status['tokens_left']:.0f} / {status['capacity']}")
+    print(f"next slot in: {status['next_slot_in']:.0f} s")
+    print(f"all slots free in: {status['full_in']:.0f} s")
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Record the HTTP traffic of a session with the portal and replay it from a local stand-in server.
+With the stand-in, the complete search and download flow runs offline and deterministic, e.g. for benchmarks:
+
+    python handelsregister.py -s gasag -docs --record fixtures/gasag
+    python replay.py fixtures/gasag --port 8080 --latency 0.2
+    python handelsregister.py -s gasag -docs --baseUrl http://127.0.0.1:8080 --rateLimit 100000 -f
+"""
+
+import argparse
+import http.server
+import json
+import logging
+import pathlib
+import threading
+import time
+import urllib.parse
+
+import mechanize
+
+# form fields that change with every session and are ignored when a request is matched to a recorded one
+volatile_fields = {"javax.faces.ViewState"}
+# response headers that are recorded
+recorded_headers = ("Content-Type", "Content-Disposition", "Set-Cookie", "Location")
+
+
+def request_signature(method : str, url : str, data : str | bytes | None) -> dict:
+    "method, path and form fields of a request, the key for finding it again"
+    parts = urllib.parse.urlsplit(url)
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    fields = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+    if data:
+        fields += urllib.parse.parse_qsl(data, keep_blank_values=True)
+    return {
+        'method' : method,
+        'path' : parts.path or "/",
+        'fields' : {k : v for k, v in fields if k not in volatile_fields},
+    }
+
+
+class Recorder:
+    """Writes every request and response of a session to 'directory':
+    'exchanges.jsonl' with one line per request and 'bodies/<nr>' with the response bodies"""
+    def __init__(self, directory : str | pathlib.Path, base_url : str) -> None:
+        self.directory = pathlib.Path(directory)
+        (self.directory / "bodies").mkdir(parents=True, exist_ok=True)
+        self.base_url = base_url
+        self.index = self.directory / "exchanges.jsonl"
+        self.count = len(self.index.read_text(encoding="utf-8").splitlines()) if self.index.exists() else 0
+        self.lock = threading.Lock()
+
+    def record(self, request, response):
+        """Save the exchange. The body is read completely, so a new response with the same data is returned,
+        which has to be used instead of 'response'."""
+        if isinstance(request, str):
+            request = mechanize.Request(request)
+        data = request.data
+        if isinstance(data, dict):
+            data = urllib.parse.urlencode(data)
+        body = response.get_data()
+        headers = [(name, value) for name in recorded_headers for value in response.info().get_all(name, [])]
+        with self.lock:
+            nr = self.count
+            self.count += 1
+            (self.directory / "bodies" / f"{nr:05}").write_bytes(body)
+            exchange = request_signature(request.get_method(), request.get_full_url(), data)
+            exchange.update({
+                'nr' : nr,
+                'base_url' : self.base_url,
+                'status' : response.code,
+                'headers' : headers,
+                'body' : f"bodies/{nr:05}",
+            })
+            with open(self.index, "a", encoding="utf-8") as f:
+                f.write(json.dumps(exchange, ensure_ascii=False) + "\n")
+        return mechanize.make_response(body, headers, response.geturl(), response.code, response.msg)
+
+
+class ReplayPortal:
+    """Local HTTP server that answers requests with the recorded responses of a directory written by Recorder.
+    A request gets the response of the recorded request with the same method, path and form fields (ViewState ignored).
+    Without such a request, the response of a request with the same method and path is used, so that other queries
+    still get a result. Every response is delayed by 'latency' seconds."""
+    def __init__(self, directory : str | pathlib.Path, latency : float = 0.0,
+                 host : str = "127.0.0.1", port : int = 0) -> None:
+        self.directory = pathlib.Path(directory)
+        self.latency = latency
+        with open(self.directory / "exchanges.jsonl", encoding="utf-8") as f:
+            self.exchanges = [json.loads(line) for line in f if line.strip()]
+        self.served : dict[int, int] = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+        portal = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def do_GET(self):
+                portal.handle(self, "GET")
+            def do_POST(self):
+                portal.handle(self, "POST")
+            def log_message(self, format, *args):
+                logging.debug(f"replay: {format % args}")
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread : threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def match(self, signature : dict) -> dict | None:
+        "the recorded exchange for a request, exact matches first, served least often first"
+        same_path = [e for e in self.exchanges
+                     if e['method'] == signature['method'] and e['path'] == signature['path']]
+        exact = [e for e in same_path if e['fields'] == signature['fields']]
+        candidates = exact or same_path
+        if not candidates:
+            return None
+        with self.lock:
+            exchange = min(candidates, key=lambda e: self.served.get(e['nr'], 0))
+            self.served[exchange['nr']] = self.served.get(exchange['nr'], 0) + 1
+            self.requests += 1
+        return exchange
+
+    def handle(self, handler : http.server.BaseHTTPRequestHandler, method : str) -> None:
+        length = int(handler.headers.get("Content-Length") or 0)
+        data = handler.rfile.read(length) if length else None
+        exchange = self.match(request_signature(method, handler.path, data))
+        if self.latency:
+            time.sleep(self.latency)
+        if exchange is None:
+            body = b"not recorded"
+            handler.send_response(404)
+            handler.send_header("Content-Type", "text/plain")
+            handler.send_header("Content-Length", str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+            return
+        body = (self.directory / exchange['body']).read_bytes()
+        headers = exchange['headers']
+        if any(name == "Content-Type" and ("text" in value or "xml" in value) for name, value in headers):
+            # links to the real portal lead to the stand-in
+            body = body.replace(exchange['base_url'].encode("utf-8"), self.url.encode("utf-8"))
+        handler.send_response(exchange['status'])
+        for name, value in headers:
+            if name == "Set-Cookie":
+                # cookies of the portal domain would be rejected for the stand-in
+                value = "; ".join(p for p in value.split(";") if not p.strip().lower().startswith("domain="))
+            elif name == "Location":
+                value = value.replace(exchange['base_url'], self.url)
+            handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def start(self) -> "ReplayPortal":
+        "serve in a background thread"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "ReplayPortal":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve a recorded handelsregister session as a local stand-in portal')
+    parser.add_argument("directory", help="directory written by handelsregister.py --record")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="delay of every response in seconds")
+    args = parser.parse_args()
+    portal = ReplayPortal(args.directory, latency=args.latency, host=args.host, port=args.port)
+    print(f"serving {args.directory} on {portal.url}")
+    try:
+        portal.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
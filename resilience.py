@@ -0,0 +1,127 @@
+"""
+Retry policy and circuit breaker for the requests to the portal.
+Transient errors (timeouts, connection errors, 429 and 5xx) are retried with exponential backoff and full jitter,
+other errors are raised at once. While the portal is down, the circuit breaker pauses all sessions of the process,
+so that failing requests do not use up the rate limit budget.
+"""
+
+import logging
+import random
+import socket
+import threading
+import time
+
+# HTTP status codes worth another attempt, all others are fatal
+retryable_codes = {408, 425, 429, 500, 502, 503, 504}
+
+
+def is_retryable(exc : BaseException) -> bool:
+    "True for errors that may go away with another attempt, False for errors that would fail the same way again"
+    # imported here, they are loaded with mechanize anyway and not needed for a search answered from the cache
+    import http.client
+    import urllib.error
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code in retryable_codes
+    if isinstance(exc, urllib.error.URLError):
+        # connection refused, name resolution, timeout while connecting, ...
+        return True
+    return isinstance(exc, (socket.timeout, TimeoutError, ConnectionError, http.client.HTTPException))
+
+
+def not_sent(exc : BaseException) -> bool:
+    "True for errors that happened before the request reached the portal (connection refused, name not resolved)"
+    import urllib.error
+    if isinstance(exc, urllib.error.URLError) and not isinstance(exc, urllib.error.HTTPError):
+        exc = exc.reason
+    return isinstance(exc, (ConnectionRefusedError, socket.gaierror))
+
+
+class RetryPolicy:
+    """'attempts' tries per request, between them sleep a random time between 0 and
+    min(max_delay, base_delay * 2**retry) (exponential backoff with full jitter)"""
+    def __init__(self, attempts : int = 4, base_delay : float = 2.0, max_delay : float = 120.0) -> None:
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, retry : int, next_slot : float = 0.0) -> float:
+        """seconds to sleep before retry number 'retry' (1, 2, ...).
+        The time until the next token of the rate limit ('next_slot') is waited anyway, it is subtracted."""
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (retry - 1)))
+        return max(0.0, backoff - next_slot)
+
+
+class CircuitBreaker:
+    """Opens after 'failure_threshold' failed requests in a row and stays open for 'reset_timeout' seconds.
+    While it is open, every request waits. Afterwards a single trial request is let through (half open):
+    success closes the breaker, failure opens it again for twice the time (up to 'max_reset_timeout')."""
+    def __init__(self, failure_threshold : int = 5, reset_timeout : float = 60.0,
+                 max_reset_timeout : float = 1800.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.failures = 0
+        self.opened_until = 0.0
+        self.open_for = reset_timeout
+        self.trial_running = False
+        self.lock = threading.Condition()
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            if self.failures < self.failure_threshold:
+                return "closed"
+            return "open" if time.time() < self.opened_until else "half-open"
+
+    @property
+    def exhausted(self) -> bool:
+        "the pause has grown to 'max_reset_timeout': the portal has been down for a long time, give up waiting"
+        with self.lock:
+            return self.open_for >= self.max_reset_timeout
+
+    def before_request(self) -> float:
+        """block while the breaker is open or a trial request is running
+        returns: the seconds spent waiting"""
+        waited = 0.0
+        with self.lock:
+            while self.failures >= self.failure_threshold:
+                pause = self.opened_until - time.time()
+                if pause > 0:
+                    logging.warning(f"portal unavailable, pausing for {pause:.0f} s")
+                elif not self.trial_running:
+                    self.trial_running = True
+                    break
+                else:
+                    # another session sends the trial request
+                    pause = 1.0
+                start = time.time()
+                self.lock.wait(pause)
+                waited += time.time() - start
+        return waited
+
+    def record_success(self) -> None:
+        with self.lock:
+            if self.failures >= self.failure_threshold:
+                logging.warning("portal is available again")
+            self.failures = 0
+            self.open_for = self.reset_timeout
+            self.trial_running = False
+            self.lock.notify_all()
+
+    def trip(self) -> None:
+        "open the breaker at once, e.g. after a request failed all its attempts: the portal is down"
+        with self.lock:
+            self.failures = max(self.failures, self.failure_threshold)
+            self.opened_until = max(self.opened_until, time.time() + self.open_for)
+            self.lock.notify_all()
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.trial_running:
+                # the trial failed: wait longer before the next one
+                self.open_for = min(self.max_reset_timeout, self.open_for * 2)
+                self.trial_running = False
+            if self.failures >= self.failure_threshold:
+                self.opened_until = time.time() + self.open_for
+            self.lock.notify_all()
@@ -0,0 +1,296 @@
+"""
+Priority scheduler for searches and document downloads that share the hourly request budget.
+The work of a job (a search with its documents) is split into tasks in three queues: searches, single documents
+(AD, CD, HD, SI) and document trees (DK). The next task is the most urgent one of the three queues: the priority of
+its job first (interactive before normal before bulk), then the deadline of the job, then the tasks of the job whose
+result page the browser is on, then searches before documents before trees, then the value of the task per request.
+An interactive lookup therefore waits at most for the task that is running, not for the rest of a bulk crawl, jobs
+of the same urgency do not take turns at the cost of searching again, and a job spends its requests on its most
+valuable rows first.
+
+A job can have a deadline and a cap on its requests. A task that starts after the deadline or whose estimated
+requests (including a new search when the browser has left the result page of the job) would exceed the cap is
+skipped; the skipped tasks are reported with the result of the job.
+"""
+
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import copy
+import itertools
+import logging
+import math
+import threading
+import time
+from typing import NamedTuple
+
+from companyindex import CompanyIndex
+from handelsregister import (HandelsRegister, ResultPage, SearchResult, document_flags, find_result_id_nr,
+                             parse_search_results)
+from planner import document_requests
+from searchcache import SearchCache
+
+PRIORITIES = {
+    'interactive' : 0,
+    'normal' : 1,
+    'bulk' : 2,
+}
+QUEUES = ("search", "document", "dk")
+# value of a document of an active company at the top of the result, rows further down are worth less
+DOCUMENT_VALUE = {'AD' : 3.0, 'SI' : 3.0, 'CD' : 2.0, 'HD' : 1.0, 'DK' : 2.0}
+# requests of a search: search form and result page
+SEARCH_REQUESTS = 2
+
+
+class Job:
+    "a search with its documents, as submitted to the scheduler"
+    def __init__(self, args : argparse.Namespace, priority : str = "interactive", deadline : float | None = None,
+                 budget : int | None = None) -> None:
+        self.args = args                    # arguments with the query and the requested documents
+        self.key = SearchCache.key(args.schlagwoerter, args.schlagwortOptionen, args.registerNummer,
+                                   args.registerGericht)
+        self.page_size : int | None = None  # rows per result page, known once the job has searched the portal
+        self.priority = PRIORITIES[priority]
+        self.deadline = deadline            # time.time() by which the tasks have to start, None: no deadline
+        self.budget = budget                # requests the job may use, None: no cap
+        self.spent = 0
+        self.companies : list[SearchResult] = []
+        self.skipped : list[tuple[str, str, str]] = []  # (company name, document type, reason)
+        self.pending = 0                    # tasks in the queues or running
+        self.future : concurrent.futures.Future[list[SearchResult]] = concurrent.futures.Future()
+
+    def result(self, timeout : float | None = None) -> list[SearchResult]:
+        "the companies of the search with the documents that were downloaded, waits until the job is done"
+        return self.future.result(timeout)
+
+
+class Task(NamedTuple):
+    job : Job
+    kind : str                          # one of QUEUES
+    company : SearchResult | None       # None for the search
+    row_index : int
+    doc_type : str
+    value : float
+    cost : float                        # estimated requests, without the way to the result page
+
+
+def document_value(company : SearchResult, row_index : int, doc_type : str) -> float:
+    "value of a document: by type, halved for deleted companies, less for rows further down the result"
+    value = DOCUMENT_VALUE[doc_type] / (1 + row_index / 10)
+    status = (company.status or "").lower()
+    if "deleted" in status or "gelöscht" in status:
+        value /= 2
+    return value
+
+
+class Scheduler:
+    """Runs the tasks of the submitted jobs on one HandelsRegister session, most urgent first.
+    Jobs can be submitted from any thread; run_pending() works off the queues in the calling thread,
+    start() in a worker thread."""
+    def __init__(self, h : HandelsRegister) -> None:
+        self.h = h
+        self.queues : dict[str, list[tuple[int, Task]]] = {kind : [] for kind in QUEUES}
+        self.lock = threading.Condition()
+        self.counter = itertools.count()
+        self.thread : threading.Thread | None = None
+        self.closed = False
+        # the result page loaded by open_result_row and its parsed rows; the rows of the page a job's own search
+        # left the browser on are the companies of the job
+        self.loaded : tuple[ResultPage, list[tuple[int, SearchResult]]] | None = None
+
+    def submit(self, args : argparse.Namespace, priority : str = "interactive", deadline : float | None = None,
+               budget : int | None = None) -> Job:
+        """queue the search of 'args'; its documents are queued when the search is done
+        'deadline' is an absolute time.time()"""
+        job = Job(args, priority, deadline, budget)
+        cached = not args.force and self.h.search_cache.get(job.key) is not None
+        self.push(Task(job, "search", None, 0, "", 1.0, 0 if cached else SEARCH_REQUESTS))
+        return job
+
+    def push(self, task : Task) -> None:
+        with self.lock:
+            task.job.pending += 1
+            # the counter keeps tasks of the same urgency in the order they were queued
+            self.queues[task.kind].append((next(self.counter), task))
+            self.lock.notify()
+
+    def pop(self) -> Task | None:
+        """the most urgent task of the three queues, None if they are empty
+        The urgency depends on the result page the browser is on, so it is computed when the next task is taken."""
+        with self.lock:
+            queued = [(self.urgency(task), n, task) for queue in self.queues.values() for n, task in queue]
+            if not queued:
+                return None
+            _, n, task = min(queued, key=lambda entry: entry[:2])
+            self.queues[task.kind].remove((n, task))
+            return task
+
+    def urgency(self, task : Task) -> tuple:
+        "sort key, the smallest key is the most urgent task"
+        job = task.job
+        deadline = job.deadline if job.deadline is not None else math.inf
+        on_page = task.kind != "search" and self.h.result_page is not None and self.h.result_page.key == job.key
+        cost = task.cost + self.navigation(task)
+        return (job.priority, deadline, not on_page, QUEUES.index(task.kind), -task.value / max(cost, 0.1))
+
+    def navigation(self, task : Task) -> int:
+        "estimated requests to bring the browser to the result page with the row of a document task"
+        if task.kind == "search":
+            return 0
+        page = self.h.result_page
+        if page is not None and page.key == task.job.key:
+            return 0 if page.first <= task.row_index < page.first + page.size else 1
+        # search again; while the page size is not known, a row after the first one may be on another page
+        page_size = task.job.page_size
+        further_page = task.row_index >= page_size if page_size is not None else task.row_index > 0
+        return SEARCH_REQUESTS + further_page
+
+    def queued(self) -> dict[str, int]:
+        with self.lock:
+            return {kind : len(queue) for kind, queue in self.queues.items()}
+
+    def run_pending(self) -> None:
+        "run tasks until the queues are empty"
+        while (task := self.pop()) is not None:
+            self.run(task)
+
+    def start(self) -> None:
+        "run the tasks in a worker thread as they are submitted"
+        self.thread = threading.Thread(target=self.serve, name="scheduler", daemon=True)
+        self.thread.start()
+
+    def serve(self) -> None:
+        while True:
+            with self.lock:
+                while not self.closed and not any(self.queues.values()):
+                    self.lock.wait()
+                if self.closed:
+                    return
+            task = self.pop()
+            if task is not None:
+                self.run(task)
+
+    def close(self) -> None:
+        "stop the worker thread, the queued tasks are not run"
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self, task : Task) -> None:
+        job = task.job
+        name = task.company.name if task.company is not None else ' '.join(job.args.schlagwoerter)
+        reason = None
+        if job.future.done():
+            reason = "search failed"
+        elif job.deadline is not None and time.time() > job.deadline:
+            reason = "deadline"
+        elif job.budget is not None and job.spent + task.cost + self.navigation(task) > job.budget:
+            reason = "budget"
+        if reason is not None:
+            logging.info(f"skip {task.kind} {task.doc_type} of {name}: {reason}")
+            job.skipped.append((name, task.doc_type or "search", reason))
+            self.done(job)
+            return
+        requests_before = self.h.request_count
+        try:
+            if task.kind == "search":
+                self.run_search(task)
+            else:
+                self.run_document(task)
+        except Exception as e:
+            if task.kind == "search":
+                job.future.set_exception(e)
+            else:
+                logging.error(f"{task.doc_type} of {name} failed: {e}")
+                job.skipped.append((name, task.doc_type, f"error: {e}"))
+        finally:
+            requests = self.h.request_count - requests_before
+            job.spent += requests
+            if task.company is not None:
+                task.company.requests += requests
+            self.done(job)
+
+    def done(self, job : Job) -> None:
+        with self.lock:
+            job.pending -= 1
+            finished = job.pending == 0
+        if finished and not job.future.done():
+            job.future.set_result(job.companies)
+
+    def run_search(self, task : Task) -> None:
+        "search without documents (so the result may come from the cache), then queue the documents of every row"
+        job = task.job
+        self.h.args = copy.copy(job.args)
+        for flag in document_flags:
+            setattr(self.h.args, flag, False)
+        job.companies = list(itertools.islice(self.h.iter_companies(), job.args.maxResults))
+        if self.h.result_page is not None and self.h.result_page.key == job.key:
+            job.page_size = self.h.result_page.size
+        documents = [doc_type for flag, doc_type in document_flags.items() if getattr(job.args, flag)]
+        self.h.args = job.args
+        for row_index, company in enumerate(job.companies):
+            for doc_type in documents:
+                self.push(Task(job, "dk" if doc_type == "DK" else "document", company, row_index, doc_type,
+                               document_value(company, row_index, doc_type),
+                               document_requests(company, [doc_type], self.h)))
+
+    def run_document(self, task : Task) -> None:
+        self.h.args = task.job.args
+        id_nr, row_index = self.open_result_row(task)
+        self.h.download_document(task.company, id_nr, row_index, task.doc_type)
+
+    def open_result_row(self, task : Task) -> tuple[str, int]:
+        """bring the browser to the result page with the row of the task, searching again if it is on the result of
+        another search (another job ran in between, or the search was answered from the cache)
+        The result may have changed since the search of the job: the rows of a page that is loaded here are checked,
+        a company that is not found where it is expected raises LookupError, so no document of another company is
+        stored under its name.
+        returns: (id of the result table, row index of the company)"""
+        h = self.h
+        key = task.job.key
+        row_index = task.row_index
+        wanted = row_key(task.company)
+        page = h.result_page
+        rows = self.loaded[1] if self.loaded is not None and self.loaded[0] == page else None
+        if page is None or page.key != key:
+            html = h.submit_search()
+            if html is None:
+                raise RuntimeError("no session")
+            id_nr = find_result_id_nr(html)
+            if id_nr is None:
+                raise RuntimeError("no result table")
+            rows = parse_search_results(html, h.args.parser)
+            if not rows:
+                raise LookupError(f"{task.company.name} is not in the result any more")
+            page = h.result_page = ResultPage(key, id_nr, 0, len(rows))
+            task.job.page_size = page.size
+            self.loaded = (page, rows)
+            found = row_of(rows, wanted)
+            if found is not None:
+                return page.id_nr, found
+        if not page.first <= row_index < page.first + page.size:
+            first = row_index - row_index % page.size
+            html = h.fetch_result_page(first=first, rows=page.size)
+            if html is None:
+                raise RuntimeError(f"could not load the result page with row {row_index}")
+            page = h.result_page = page._replace(first=first)
+            rows = parse_search_results(html, h.args.parser)
+            self.loaded = (page, rows)
+        if rows is not None:
+            row_index = row_of(rows, wanted)
+            if row_index is None:
+                raise LookupError(f"{task.company.name} is not in row {task.row_index} of the result any more")
+        return page.id_nr, row_index
+
+
+def row_key(company : SearchResult) -> str:
+    "the register entry of a result row: the court cell with the register number, or the court cell and the name"
+    return CompanyIndex.company_key(' '.join(company.court.split()), company.register_number, company.name)
+
+
+def row_of(rows : list[tuple[int, SearchResult]], key : str) -> int | None:
+    "row index of the company with the key 'key' in the parsed rows of a result page, None if it is not there"
+    return next((i for i, company in rows if row_key(company) == key), None)
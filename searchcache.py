@@ -0,0 +1,97 @@
+"""
+Persistent read-through cache for the HTML of search results.
+Every request to handelsregister.de costs a part of the hourly budget, so repeated searches are answered from here.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import time
+
+
+class SearchCache:
+    """Cache for search result pages, one file per query.
+    Entries expire after 'ttl' seconds. If more than 'max_entries' are stored, the least recently used ones are removed.
+    The modification time of a file is the time it was written, the access time is set on every hit (LRU)."""
+    def __init__(self, directory : str | pathlib.Path, ttl : float = 24*3600, max_entries : int = 1000) -> None:
+        self.directory = pathlib.Path(directory)
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    @staticmethod
+    def key(schlagwoerter : list[str] | str, schlagwortOptionen : str = "all",
+            registerNummer : list[str] | str | None = None, registerGericht : list[str] | str | None = None) -> str:
+        "build the cache key from all inputs of a search"
+        def normalize(value) -> str:
+            if value is None:
+                return ""
+            if not isinstance(value, str):
+                value = ' '.join(value)
+            return ' '.join(value.lower().split())
+        query = {
+            'schlagwoerter' : normalize(schlagwoerter),
+            'schlagwortOptionen' : schlagwortOptionen,
+            # only the digits of the register number are sent to the portal
+            'registerNummer' : ''.join(c for c in normalize(registerNummer) if c.isnumeric()),
+            'registerGericht' : normalize(registerGericht),
+        }
+        return hashlib.sha256(json.dumps(query, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _path(self, key : str) -> pathlib.Path:
+        return self.directory / f"{key}.html"
+
+    def get(self, key : str) -> str | None:
+        "returns: the cached HTML or None if there is no valid entry"
+        path = self._path(key)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        now = time.time()
+        if now - stat.st_mtime > self.ttl:
+            logging.info(f"cache entry {key} expired")
+            path.unlink(missing_ok=True)
+            return None
+        try:
+            html = path.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            # removed by another process in the meantime
+            return None
+        # mark as recently used, keep the write time
+        os.utime(path, (now, stat.st_mtime))
+        return html
+
+    def put(self, key : str, html : str) -> None:
+        "store an entry atomically, so that concurrent readers never see a partial file"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(html)
+            os.replace(tmp_name, self._path(key))
+        except BaseException:
+            pathlib.Path(tmp_name).unlink(missing_ok=True)
+            raise
+        self.evict()
+
+    def evict(self) -> int:
+        """remove expired entries and the least recently used ones above 'max_entries'
+        returns: number of removed entries"""
+        now = time.time()
+        entries = []
+        for path in self.directory.glob("*.html"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, stat.st_mtime, path))
+        entries.sort()
+        removed = 0
+        for i, (atime, mtime, path) in enumerate(entries):
+            if now - mtime > self.ttl or len(entries) - i > self.max_entries:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Service mode: a local HTTP service that keeps warm HandelsRegister sessions open.
+Tools send their searches to it instead of starting handelsregister.py each time. Identical searches that arrive
+while one of them is running are answered with the result of that one request. All sessions share the rate limit.
+With --schedule the searches run on one session through the priority scheduler (scheduler.py): a search with
+"priority": "interactive" goes ahead of the queued tasks of "bulk" searches.
+
+    python service.py --port 5000 --sessions 2
+    python handelsregister.py -s gasag -si --server http://127.0.0.1:5000
+"""
+
+import argparse
+import concurrent.futures
+import copy
+import itertools
+import json
+import logging
+import pathlib
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Iterator
+
+from flask import Flask, jsonify, request
+
+from batch import QUERY_DEFAULTS, normalize_query, query_id
+from handelsregister import HandelsRegister, SearchResult, build_parser, setup_logging
+from metrics import Metrics
+from resilience import CircuitBreaker, is_retryable
+from scheduler import PRIORITIES, Scheduler
+
+# options of a search besides the query fields of batch.QUERY_DEFAULTS
+SEARCH_OPTIONS = {
+    'force' : False,
+    'local' : False,
+    'maxResults' : None,
+    # used with --schedule: priority, seconds until the deadline and request cap of the search
+    'priority' : "interactive",
+    'deadline' : None,
+    'budget' : None,
+}
+# options that only change when and how the search is run, identical searches are coalesced regardless of them
+SCHEDULE_OPTIONS = ('priority', 'deadline', 'budget')
+
+
+class QueryService:
+    """Runs searches on up to 'sessions' warm HandelsRegister sessions, further searches wait for a free session.
+    A search that is already running is not sent again, the callers share its result.
+    With 'schedule' all searches go to a Scheduler on one session instead."""
+    def __init__(self, args : argparse.Namespace, sessions : int = 1, schedule : bool = False) -> None:
+        self.args = args
+        self.size = sessions
+        self.idle : queue.Queue[HandelsRegister] = queue.Queue()
+        self.sessions : list[HandelsRegister] = []
+        self.metrics = Metrics()
+        self.breaker = CircuitBreaker()
+        self.lock = threading.Lock()
+        self.inflight : dict[str, concurrent.futures.Future] = {}
+        self.searches = 0
+        self.coalesced = 0
+        self.scheduler : Scheduler | None = None
+        if schedule:
+            self.scheduler = Scheduler(self.acquire())
+            self.scheduler.start()
+
+    def acquire(self) -> HandelsRegister:
+        "an idle session, a new one as long as there are less than 'size'"
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if len(self.sessions) < self.size:
+                args = copy.copy(self.args)
+                if self.sessions:
+                    # only the first session may reuse the saved session of the CLI
+                    args.sessionFile = None
+                session = HandelsRegister(args)
+                session.service_args = args
+                session.metrics = self.metrics
+                session.breaker = self.breaker
+                self.sessions.append(session)
+                return session
+        return self.idle.get()
+
+    def release(self, session : HandelsRegister) -> None:
+        self.idle.put(session)
+
+    @staticmethod
+    def normalize(raw : dict) -> tuple[dict, dict]:
+        """split a request into the normalized query and the search options
+        raises ValueError for invalid requests"""
+        raw = dict(raw)
+        options = dict(SEARCH_OPTIONS)
+        for option in SEARCH_OPTIONS:
+            if option in raw:
+                options[option] = raw.pop(option)
+        if options['maxResults'] is not None:
+            options['maxResults'] = int(options['maxResults'])
+        if options['priority'] not in PRIORITIES:
+            raise ValueError(f"priority must be one of {list(PRIORITIES)}")
+        if options['deadline'] is not None:
+            options['deadline'] = float(options['deadline'])
+        if options['budget'] is not None:
+            options['budget'] = int(options['budget'])
+        return normalize_query(raw), options
+
+    def search(self, raw : dict) -> tuple[list[dict], bool]:
+        """run a search, or wait for the identical one that is running
+        returns: (results as dicts, True if the result came from another caller's search)"""
+        query, options = self.normalize(raw)
+        key = query_id({**query, **{option : value for option, value in options.items()
+                                    if option not in SCHEDULE_OPTIONS}})
+        with self.lock:
+            future = self.inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self.inflight[key] = concurrent.futures.Future()
+                self.searches += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result(), True
+        try:
+            results = self.run(query, options)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(results)
+        finally:
+            with self.lock:
+                del self.inflight[key]
+        return results, False
+
+    def run(self, query : dict, options : dict) -> list[dict]:
+        if self.scheduler is not None:
+            return self.run_scheduled(query, options)
+        session = self.acquire()
+        try:
+            session.args = copy.copy(session.service_args)
+            vars(session.args).update(query)
+            vars(session.args).update(options)
+            while True:
+                try:
+                    return [result_dict(company)
+                            for company in itertools.islice(session.iter_companies(), options['maxResults'])]
+                except Exception as e:
+                    if not is_retryable(e) or self.breaker.exhausted:
+                        # an error of the search, or the portal is down for too long (502 to the caller)
+                        raise
+                    # the circuit breaker holds the next request until the portal is back
+                    logging.warning(f"search failed ({e}), it is run again when the portal is back")
+        finally:
+            self.release(session)
+
+    def run_scheduled(self, query : dict, options : dict) -> list[dict]:
+        "submit the search to the scheduler and wait for it"
+        args = copy.copy(self.scheduler.h.service_args)
+        vars(args).update(query)
+        vars(args).update(options)
+        deadline = time.time() + options['deadline'] if options['deadline'] is not None else None
+        job = self.scheduler.submit(args, options['priority'], deadline, options['budget'])
+        companies = job.result()
+        for name, doc_type, reason in job.skipped:
+            logging.info(f"skipped {doc_type} of {name}: {reason}")
+        return [result_dict(company) for company in companies]
+
+    def status(self) -> dict:
+        with self.lock:
+            status = {
+                'sessions' : len(self.sessions),
+                'idle_sessions' : self.idle.qsize(),
+                'inflight' : len(self.inflight),
+                'searches' : self.searches,
+                'coalesced' : self.coalesced,
+            }
+        if self.scheduler is not None:
+            status['queued'] = self.scheduler.queued()
+        status['circuit_breaker'] = self.breaker.state
+        status['rate_limit'] = self.sessions[0].limiter.status() if self.sessions else None
+        status['metrics'] = self.metrics.summary()
+        return status
+
+
+def result_dict(company : SearchResult) -> dict:
+    d = company.toDict()
+    # the caller does not run in the directory of the service
+    for document in d['documents']:
+        document['path'] = str(pathlib.Path(document['path']).resolve())
+    return d
+
+
+def create_app(service : QueryService) -> Flask:
+    "Flask app with POST /search (JSON query, fields as in batch mode) and GET /status"
+    app = Flask(__name__)
+
+    @app.post("/search")
+    def search():
+        raw = request.get_json(silent=True)
+        if not isinstance(raw, dict):
+            return jsonify({'error' : "expected a JSON object with the query"}), 400
+        try:
+            results, coalesced = service.search(raw)
+        except ValueError as e:
+            return jsonify({'error' : str(e)}), 400
+        except OSError as e:
+            logging.error(f"search failed: {e}")
+            return jsonify({'error' : f"portal not reachable: {e}"}), 502
+        return jsonify({'results' : results, 'coalesced' : coalesced})
+
+    @app.get("/status")
+    def status():
+        return jsonify(service.status())
+
+    return app
+
+
+def query_server(url : str, args : argparse.Namespace, timeout : float = 3600) -> Iterator[SearchResult]:
+    "send the search of the command line arguments 'args' to the service at 'url' (client of --server)"
+    body = {field : getattr(args, field) for field in QUERY_DEFAULTS}
+    body.update({option : getattr(args, option) for option in SEARCH_OPTIONS})
+    req = urllib.request.Request(url.rstrip("/") + "/search", data=json.dumps(body).encode("utf-8"),
+                                 headers={'Content-Type' : "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            answer = json.load(response)
+    except urllib.error.HTTPError as e:
+        try:
+            error = json.load(e).get('error', str(e))
+        except (ValueError, AttributeError):
+            # not an answer of the service, e.g. the error page of a proxy
+            error = f"{e.code} {e.reason}"
+        raise RuntimeError(error) from e
+    for d in answer['results']:
+        yield SearchResult.fromDict(d)
+
+
+if __name__ == "__main__":
+    parser = build_parser(description='Serve handelsregister searches from warm sessions')
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--schedule", action="store_true",
+                        help="run the searches by priority, deadline and budget on one session (see README)")
+    args = parser.parse_args()
+    setup_logging(args)
+    service = QueryService(args, sessions=args.sessions, schedule=args.schedule)
+    create_app(service).run(host=args.host, port=args.port, threaded=True)
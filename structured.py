@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Parser and bulk loader for the structured register content (SI, XJustiz XML).
+Each file is parsed incrementally (iterparse, every finished subtree is removed from the tree), so the memory does
+not grow with the size of the file. Officers, capital, legal form, seat and register events are written to an SQLite file in batches.
+Parsing runs on a process pool, so that it keeps up with the downloads.
+
+    python structured.py downloads/*/*SI*.xml --store cache/structured.sqlite
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ET
+from typing import NamedTuple
+
+# role of the company itself among the participants
+company_roles = ("rechtsträger",)
+capital_elements = ("stammkapital", "grundkapital", "kapital", "hafteinlage")
+event_elements = ("registereintragung", "eintragung")
+# elements that are parsed as a whole when they end
+handled_elements = {"beteiligung", "rechtsform", "sitz", *capital_elements, *event_elements}
+
+
+class Officer(NamedTuple):
+    name : str
+    role : str
+    city : str
+    birth_date : str
+    is_person : bool
+
+
+class Event(NamedTuple):
+    number : str
+    date : str
+    text : str
+
+
+class StructuredContent(NamedTuple):
+    sha256 : str
+    court : str
+    register_nr : str
+    name : str
+    legal_form : str
+    seat : str
+    capital : float | None
+    currency : str
+    officers : tuple[Officer, ...]
+    events : tuple[Event, ...]
+
+
+def local_name(tag : str) -> str:
+    "tag without namespace, e.g. '{http://www.xjustiz.de}tns:ort' -> 'ort'"
+    return tag.rsplit("}", 1)[-1].rsplit(":", 1)[-1].lower()
+
+
+def find(elem : ET.Element, *path : str) -> ET.Element | None:
+    "first descendant that matches the local names of 'path' in this order (not necessarily direct children)"
+    for name in path:
+        elem = next((e for e in elem.iter() if e is not elem and local_name(e.tag) == name), None)
+        if elem is None:
+            return None
+    return elem
+
+
+def text(elem : ET.Element | None, *path : str) -> str:
+    "text of the element at 'path', for code list values the text of its 'code' child"
+    if elem is not None and path:
+        elem = find(elem, *path)
+    if elem is None:
+        return ""
+    value = (elem.text or "").strip()
+    if not value:
+        code = find(elem, "code")
+        value = (code.text or "").strip() if code is not None else ""
+    return value
+
+
+def parse_officer(elem : ET.Element) -> Officer:
+    "a participant ('beteiligung') -> Officer"
+    person = find(elem, "natuerlicheperson")
+    if person is not None:
+        name = " ".join(filter(None, (text(person, "vorname"), text(person, "nachname"))))
+        city = text(person, "anschrift", "ort") or text(person, "ort")
+        birth_date = text(person, "geburtsdatum")
+    else:
+        name = text(elem, "bezeichnung.aktuell") or text(elem, "bezeichnung")
+        city = text(elem, "sitz", "ort") or text(elem, "anschrift", "ort")
+        birth_date = ""
+    return Officer(name=name, role=text(elem, "rollenbezeichnung"), city=city, birth_date=birth_date,
+                   is_person=person is not None)
+
+
+def parse_structured_content(path : str | pathlib.Path, sha256 : str = "", court : str = "",
+                             register_nr : str = "") -> StructuredContent:
+    """Parse an SI file. The element names are the ones of the XJustiz register messages, they are matched without
+    namespace, so different versions of the schema work alike."""
+    name = legal_form = seat = currency = ""
+    capital = None
+    officers = []
+    events = []
+    # number of open elements that are handled as a whole, their subtrees are kept until their end
+    open_handled = 0
+    # the open elements, a finished element is removed from its parent
+    path_elems = []
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        tag = local_name(elem.tag)
+        if event == "start":
+            path_elems.append(elem)
+            if tag in handled_elements:
+                open_handled += 1
+            continue
+        path_elems.pop()
+        if tag in handled_elements:
+            open_handled -= 1
+        if open_handled:
+            # part of a handled subtree, e.g. the seat of a participant
+            continue
+        if tag == "beteiligung":
+            officer = parse_officer(elem)
+            if officer.role.lower() in company_roles:
+                name = name or officer.name
+                seat = seat or officer.city
+                legal_form = legal_form or text(elem, "rechtsform")
+            else:
+                officers.append(officer)
+        elif tag in capital_elements and capital is None:
+            amount = text(elem, "zahl") or (elem.text or "").strip()
+            try:
+                capital = float(amount.replace(",", ".")) if amount else None
+            except ValueError:
+                logging.info(f"{path}: invalid capital {amount!r}")
+            currency = text(elem, "waehrung")
+        elif tag == "rechtsform" and not legal_form:
+            legal_form = text(elem)
+        elif tag == "sitz" and not seat:
+            seat = text(elem, "ort") or text(elem)
+        elif tag == "registernummer" and not register_nr:
+            register_nr = text(elem)
+        elif tag in event_elements:
+            events.append(Event(number=text(elem, "laufendenummer"),
+                                date=text(elem, "eintragungsdatum") or text(elem, "datum"),
+                                text=text(elem, "eintragungstext") or text(elem, "text")))
+        # the element is done, free it; its parent only ever holds the child that is being parsed
+        elem.clear()
+        if path_elems:
+            path_elems[-1].remove(elem)
+    return StructuredContent(sha256=sha256, court=court, register_nr=register_nr, name=name,
+                             legal_form=legal_form, seat=seat, capital=capital, currency=currency,
+                             officers=tuple(officers), events=tuple(events))
+
+
+class StructuredStore:
+    "SQLite file with the parsed SI files, one entry per file content (sha256)"
+    def __init__(self, path : str | pathlib.Path) -> None:
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.con:
+            self.con.executescript("""
+                CREATE TABLE IF NOT EXISTS si_documents (
+                    sha256 TEXT PRIMARY KEY, court TEXT NOT NULL, register_nr TEXT NOT NULL, name TEXT NOT NULL,
+                    legal_form TEXT NOT NULL, seat TEXT NOT NULL, capital REAL, currency TEXT NOT NULL,
+                    loaded REAL NOT NULL);
+                CREATE INDEX IF NOT EXISTS si_documents_register ON si_documents (court, register_nr);
+                CREATE TABLE IF NOT EXISTS si_officers (
+                    sha256 TEXT NOT NULL, name TEXT NOT NULL, role TEXT NOT NULL, city TEXT NOT NULL,
+                    birth_date TEXT NOT NULL, is_person INTEGER NOT NULL);
+                CREATE INDEX IF NOT EXISTS si_officers_sha256 ON si_officers (sha256);
+                CREATE TABLE IF NOT EXISTS si_events (
+                    sha256 TEXT NOT NULL, number TEXT NOT NULL, date TEXT NOT NULL, text TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS si_events_sha256 ON si_events (sha256);""")
+
+    def has(self, sha256 : str) -> bool:
+        with self.lock:
+            return self.con.execute("SELECT 1 FROM si_documents WHERE sha256 = ?", (sha256,)).fetchone() is not None
+
+    def insert(self, records : list[StructuredContent]) -> None:
+        "write a batch of records in one transaction, records of the same file replace the old ones"
+        now = time.time()
+        keys = [(r.sha256,) for r in records]
+        with self.lock, self.con:
+            self.con.executemany("DELETE FROM si_officers WHERE sha256 = ?", keys)
+            self.con.executemany("DELETE FROM si_events WHERE sha256 = ?", keys)
+            self.con.executemany("INSERT OR REPLACE INTO si_documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 [(r.sha256, r.court, r.register_nr, r.name, r.legal_form, r.seat, r.capital,
+                                   r.currency, now) for r in records])
+            self.con.executemany("INSERT INTO si_officers VALUES (?, ?, ?, ?, ?, ?)",
+                                 [(r.sha256, *o) for r in records for o in r.officers])
+            self.con.executemany("INSERT INTO si_events VALUES (?, ?, ?, ?)",
+                                 [(r.sha256, *e) for r in records for e in r.events])
+
+    def officers(self, court : str, register_nr : str) -> list[Officer]:
+        "officers of the latest loaded SI file of a company"
+        with self.lock:
+            rows = self.con.execute("""SELECT o.name, o.role, o.city, o.birth_date, o.is_person FROM si_officers o
+                                       WHERE o.sha256 = (SELECT sha256 FROM si_documents
+                                                         WHERE court = ? AND register_nr = ?
+                                                         ORDER BY loaded DESC LIMIT 1)""",
+                                    (court, register_nr)).fetchall()
+        return [Officer(name, role, city, birth_date, bool(is_person))
+                for name, role, city, birth_date, is_person in rows]
+
+    def close(self) -> None:
+        self.con.close()
+
+
+class StructuredLoader:
+    """Parses SI files on a process pool and writes the results to a StructuredStore in batches of 'batch_size'.
+    submit() returns at once, close() waits for all files and writes the rest."""
+    def __init__(self, store : StructuredStore, workers : int | None = None, batch_size : int = 100) -> None:
+        self.store = store
+        self.batch_size = batch_size
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        self.buffer : list[StructuredContent] = []
+        self.submitted : set[str] = set()
+        self.lock = threading.Lock()
+        self.loaded = 0
+        self.failed = 0
+
+    def submit(self, path : str | pathlib.Path, sha256 : str, court : str = "", register_nr : str = "") -> bool:
+        """parse a file in the background, files that are loaded already are skipped
+        returns: True if the file is parsed"""
+        with self.lock:
+            if sha256 in self.submitted:
+                return False
+            self.submitted.add(sha256)
+        if self.store.has(sha256):
+            return False
+        future = self.executor.submit(parse_structured_content, str(path), sha256, court, register_nr)
+        future.add_done_callback(self._done)
+        return True
+
+    def _done(self, future : concurrent.futures.Future) -> None:
+        try:
+            record = future.result()
+        except Exception as e:
+            logging.error(f"could not parse structured content: {e}")
+            with self.lock:
+                self.failed += 1
+            return
+        with self.lock:
+            self.buffer.append(record)
+            if len(self.buffer) >= self.batch_size:
+                self._flush()
+
+    def _flush(self) -> None:
+        # called with self.lock held
+        if self.buffer:
+            self.store.insert(self.buffer)
+            self.loaded += len(self.buffer)
+            self.buffer = []
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            self._flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load structured content (SI) XML files into an SQLite file')
+    parser.add_argument("files", nargs='+', help="SI XML files")
+    parser.add_argument("--store", default="cache/structured.sqlite", help="SQLite file (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="parser processes")
+    parser.add_argument("--batchSize", type=int, default=100, help="records per insert transaction")
+    args = parser.parse_args()
+    loader = StructuredLoader(StructuredStore(args.store), workers=args.workers, batch_size=args.batchSize)
+    for file in args.files:
+        loader.submit(file, hashlib.sha256(pathlib.Path(file).read_bytes()).hexdigest())
+    loader.close()
+    print(f"{loader.loaded} files loaded, {loader.failed} failed")
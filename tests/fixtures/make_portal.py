@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Writes the synthetic recorded session in tests/fixtures/portal/ (format of replay.Recorder).
+The pages follow the structure of the real portal, reduced to the parts the client uses:
+start page, search form, result page with one company, AD and SI download and the documents view (DK) with two files.
+"""
+
+import json
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+from synthetic import result_row
+
+BASE_URL = "https://www.handelsregister.de"
+DIRECTORY = pathlib.Path(__file__).parent / "portal"
+HTML = [("Content-Type", "text/html;charset=UTF-8")]
+XML = [("Content-Type", "text/xml;charset=UTF-8")]
+NAV = '<a href="/rp_web/welcome.xhtml">Startseite</a><a href="/rp_web/erweitertesuche.xhtml">Erweiterte Suche</a>'
+VIEW_STATE = '<input type="hidden" name="javax.faces.ViewState" value="-1141088860331291924:-1787642681138421298"/>'
+ROW = "ergebnissForm:selectedSuchErgebnisFormTable:0:j_idt161"
+
+
+def page(title, body):
+    return f'<html><head><title>{title}</title></head><body>{NAV}{body}</body></html>'
+
+
+def tree_node(id, label, kind):
+    return (f'<li id="dk_form:dktree:{id}" data-rowkey="{id}" class="ui-treenode ui-treenode-{kind} ui-treenode-unselected" role="none">'
+            f'<span class="ui-treenode-content"><span class="ui-treenode-label ui-corner-all" role="treeitem">{label}</span></span></li>')
+
+TREE = ('<ul class="ui-tree-container">' + tree_node("0", "Documents on legal entity", "parent") +
+        tree_node("0_0", "Documents on register number", "parent") +
+        tree_node("0_0_0", "Gesellschaftsvertrag.pdf", "leaf") + tree_node("0_0_1", "Liste der Gesellschafter.pdf", "leaf") +
+        '</ul>')
+BUTTON = ('<button id="dk_form:j_idt42" name="dk_form:j_idt42" class="ui-button ui-widget ui-state-default '
+          'ui-corner-all ui-button-text-only" onclick="" type="submit">Download</button>')
+
+search_form = page("Erweiterte Suche",
+    '<form id="form" name="form" method="post" action="/rp_web/erweitertesuche.xhtml">'
+    '<input type="hidden" name="form" value="form"/>'
+    '<input type="text" name="form:schlagwoerter" value=""/>'
+    '<input type="radio" name="form:schlagwortOptionen" value="1" checked="checked"/>'
+    '<input type="radio" name="form:schlagwortOptionen" value="2"/>'
+    '<input type="radio" name="form:schlagwortOptionen" value="3"/>'
+    '<input type="text" name="form:registerNummer" value=""/>'
+    '<select id="form:registergericht_input" name="form:registergericht_input">'
+    '<option value="">Alle</option><option value="F1103">Berlin (Charlottenburg)</option>'
+    '<option value="D2601">München</option></select>'
+    f'<input type="submit" name="form:btnSuche" value="Suchen"/>{VIEW_STATE}</form>')
+
+result_page = page("Ergebnisse",
+    '<form id="ergebnissForm" name="ergebnissForm" method="post" action="/rp_web/ergebnisse.xhtml">'
+    '<input type="hidden" name="ergebnissForm" value="ergebnissForm"/>'
+    '<table role="grid"><thead></thead><tbody id="ergebnissForm:selectedSuchErgebnisFormTable_data">'
+    + result_row(0, name="GASAG AG", court="District court Berlin (Charlottenburg) HRB 44343",
+                 history=[("1.) Gasag Berliner Gaswerke Aktiengesellschaft", "1.) Berlin")]) +
+    f'</tbody></table>{VIEW_STATE}</form>')
+
+docs_page = page("Dokumente",
+    '<form id="dk_form" name="dk_form" method="post" action="/rp_web/documents-dk.xhtml">'
+    '<input type="hidden" name="dk_form" value="dk_form"/>'
+    '<input type="hidden" name="dk_form:dktree_selection" value=""/>'
+    '<input type="hidden" name="dk_form:dktree_scrollState" value="0,0"/>'
+    f'{TREE}{VIEW_STATE}</form>')
+
+select_response = ('<?xml version="1.0" encoding="UTF-8"?><partial-response id="j_id1"><changes>'
+                   f'<update id="dk_form:dktree"><![CDATA[{TREE}]]></update>'
+                   f'<update id="dk_form:detailsNodePanelGrid"><![CDATA[{BUTTON}]]></update>'
+                   '</changes></partial-response>')
+
+
+def select_fields(node):
+    return {
+        'javax.faces.partial.ajax': 'true', 'javax.faces.source': 'dk_form:dktree',
+        'javax.faces.partial.execute': 'dk_form:dktree',
+        'javax.faces.partial.render': 'dk_form:detailsNodePanelGrid dk_form:dktree',
+        'javax.faces.behavior.event': 'select', 'javax.faces.partial.event': 'select',
+        'dk_form:dktree_instantSelection': node, 'dk_form': 'dk_form',
+        'dk_form:dktree_selection': node, 'dk_form:dktree_scrollState': '0,0'}
+
+
+def download_fields(node):
+    return {'dk_form': 'dk_form', 'dk_form:dktree_selection': node, 'dk_form:dktree_scrollState': '0,0',
+            'dk_form:radio_dkbuttons': 'false', 'dk_form:j_idt42': ''}
+
+
+def attachment(filename, content_type):
+    return [("Content-Type", content_type), ("Content-Disposition", f'attachment; filename="{filename}"')]
+
+
+EXCHANGES = [
+    ("GET", "/", {}, HTML + [("Set-Cookie", "JSESSIONID=fixture; Path=/; Domain=www.handelsregister.de; HttpOnly")],
+     page("Handelsregister", "").encode()),
+    ("GET", "/rp_web/erweitertesuche.xhtml", {}, HTML, search_form.encode()),
+    ("POST", "/rp_web/erweitertesuche.xhtml",
+     {'form': 'form', 'form:schlagwoerter': 'gasag', 'form:schlagwortOptionen': '1', 'form:registerNummer': '',
+      'form:registergericht_input': '', 'form:btnSuche': 'Suchen'}, HTML, result_page.encode()),
+    ("GET", "/rp_web/ergebnisse.xhtml", {}, HTML, result_page.encode()),
+    ("POST", "/rp_web/ergebnisse.xhtml", {'ergebnissForm': 'ergebnissForm', f'{ROW}:0:fade': ''},
+     attachment("HRB44343_AD.pdf", "application/pdf"), b"%PDF-1.4 current hard copy of GASAG AG\n"),
+    ("POST", "/rp_web/ergebnisse.xhtml", {'ergebnissForm': 'ergebnissForm', f'{ROW}:6:fade': ''},
+     attachment("HRB44343_SI.xml", "application/xml"),
+     b'<?xml version="1.0" encoding="UTF-8"?><nachricht><firma>GASAG AG</firma></nachricht>\n'),
+    ("POST", "/rp_web/ergebnisse.xhtml", {'ergebnissForm': 'ergebnissForm', f'{ROW}:3:fade': ''}, HTML,
+     docs_page.encode()),
+    ("POST", "/rp_web/documents-dk.xhtml", select_fields("0_0_0"), XML, select_response.encode()),
+    ("POST", "/rp_web/documents-dk.xhtml", download_fields("0_0_0"),
+     attachment("Gesellschaftsvertrag.pdf", "application/pdf"), b"%PDF-1.4 Gesellschaftsvertrag\n"),
+    ("POST", "/rp_web/documents-dk.xhtml", download_fields("0_0_1"),
+     attachment("Liste der Gesellschafter.pdf", "application/pdf"), b"%PDF-1.4 Liste der Gesellschafter\n"),
+]
+
+
+if __name__ == "__main__":
+    (DIRECTORY / "bodies").mkdir(parents=True, exist_ok=True)
+    with open(DIRECTORY / "exchanges.jsonl", "w", encoding="utf-8") as f:
+        for nr, (method, path, fields, headers, body) in enumerate(EXCHANGES):
+            (DIRECTORY / "bodies" / f"{nr:05}").write_bytes(body)
+            f.write(json.dumps({'method' : method, 'path' : path, 'fields' : fields, 'nr' : nr,
+                                'base_url' : BASE_URL, 'status' : 200, 'headers' : headers,
+                                'body' : f"bodies/{nr:05}"}, ensure_ascii=False) + "\n")
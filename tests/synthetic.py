@@ -0,0 +1,115 @@
+"""
+Generators for synthetic pages of the portal, modelled on the structure of the real pages.
+Used by the parser tests and the benchmarks.
+"""
+
+import html as html_lib
+
+
+def result_row(index : int, name : str, court : str, city : str = "Berlin", status : str = "currently registered",
+               history : list[tuple[str, str]] = (), id_nr : str = "161") -> str:
+    "one row (data-ri) of the result table"
+    e = html_lib.escape
+    links = "".join(
+        f'<a id="ergebnissForm:selectedSuchErgebnisFormTable:{index}:j_idt{id_nr}:{col}:fade" href="#" class="dokumentList">'
+        f'<span class="underlinedText">{label}</span></a>'
+        for col, label in enumerate(("AD", "CD", "HD", "DK", "UT", "VÖ", "SI")))
+    history_rows = "".join(
+        f'<tr class="ui-widget-content" role="row">'
+        f'<td role="gridcell" class="ui-panelgrid-cell" colspan="5"><span class="marginLeft20 fontSize85">{e(h_name)}</span></td>'
+        f'<td role="gridcell" class="ui-panelgrid-cell"><span class="fontSize85">{e(h_location)}</span></td>'
+        f'<td role="gridcell" class="ui-panelgrid-cell textAlignCenter"></td></tr>'
+        for h_name, h_location in history)
+    return (
+        f'<tr data-ri="{index}" class="ui-widget-content" role="row"><td role="gridcell" colspan="9" class="borderBottom3">'
+        f'<table id="ergebnissForm:selectedSuchErgebnisFormTable:{index}:j_idt147" class="ui-panelgrid ui-widget" role="grid"><tbody>'
+        f'<tr class="ui-widget-content" role="row"><td role="gridcell" class="ui-panelgrid-cell fontTableNameSize" colspan="5">'
+        f'{e(city)}  <span class="fontWeightBold"> {e(court)}  </span></td></tr>'
+        f'<tr class="ui-widget-content" role="row"><td role="gridcell" class="ui-panelgrid-cell" colspan="5">'
+        f'<span class="marginLeft20">{e(name)}</span></td>'
+        f'<td role="gridcell" class="ui-panelgrid-cell"><span class="verticalText ">{e(city)}</span></td>'
+        f'<td role="gridcell" class="ui-panelgrid-cell"><span class="verticalText">{e(status)}</span></td>'
+        f'<td role="gridcell" class="ui-panelgrid-cell" colspan="2"><div class="ui-outputpanel ui-widget linksPanel">{links}</div></td></tr>'
+        f'<tr class="ui-widget-content" role="row"><td role="gridcell" class="ui-panelgrid-cell" colspan="7">'
+        f'<table class="ui-panelgrid ui-widget marginLeft20" role="grid"><tbody><tr class="ui-widget-content" role="row">'
+        f'<td role="gridcell" class="ui-panelgrid-cell padding0Px">History</td></tr></tbody></table>'
+        f'<table class="ui-panelgrid ui-widget" role="grid"><tbody>{history_rows}</tbody></table>'
+        f'</td></tr></tbody></table></td></tr>')
+
+
+def result_rows(rows : int, start : int = 0) -> str:
+    "'rows' synthetic rows, starting at row index 'start'"
+    return "".join(
+        result_row(i, name=f"Muster & Söhne {i} GmbH", court=f"District court Berlin (Charlottenburg) HRB {10000 + i} B",
+                   city=["Berlin", "München", "Köln"][i % 3], status="currently registered",
+                   history=[(f"{n + 1}.) Muster {i}&nbsp;{n} GmbH", f"{n + 1}.) Berlin") for n in range(i % 4)])
+        for i in range(start, start + rows))
+
+
+def result_page(rows : int, id_nr : str = "161") -> str:
+    "a complete result page with 'rows' companies"
+    return result_page_of(result_rows(rows))
+
+
+def result_page_of(rows : str) -> str:
+    "a complete result page with the rows 'rows' (HTML of result_row)"
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n<html><head><title>Ergebnisse</title></head><body>'
+            '<form id="ergebnissForm" name="ergebnissForm" method="post" action="/rp_web/ergebnisse.xhtml">'
+            '<table role="grid"><thead></thead>'
+            '<tbody id="ergebnissForm:selectedSuchErgebnisFormTable_data" class="ui-datatable-data ui-widget-content">'
+            f'{rows}</tbody></table></form></body></html>')
+
+
+def court_options_page(courts : dict[str, str]) -> str:
+    "a search form with the register court select"
+    options = "".join(f'<option value="{id}">{html_lib.escape(name)}</option>' for name, id in courts.items())
+    return ('<html><body><form id="form" name="form"><select id="form:registergericht_input" name="form:registergericht_input">'
+            f'<option value="">-- none --</option>{options}</select></form></body></html>')
+
+
+def dk_tree(folders : int, files_per_folder : int) -> str:
+    "HTML of a documents view with a fully rendered tree, each folder has 'files_per_folder' files"
+    def node(id, label, kind):
+        return (f'<li id="dk_form:dktree:{id}" data-rowkey="{id}" class="ui-treenode ui-treenode-{kind} ui-treenode-unselected" role="none">'
+                f'<span class="ui-treenode-content"><span class="ui-treenode-label ui-corner-all" role="treeitem">{label}</span></span></li>')
+    nodes = [node("0", "Documents on legal entity", "parent")]
+    for f in range(folders):
+        nodes.append(node(f"0_{f}", f"Folder {f}", "parent"))
+        nodes.extend(node(f"0_{f}_{n}", f"document_{f}_{n}.pdf", "leaf") for n in range(files_per_folder))
+    button = ('<button id="dk_form:j_idt42" name="dk_form:j_idt42" class="ui-button ui-widget ui-state-default '
+              'ui-corner-all ui-button-text-only" onclick="" type="submit">')
+    return f'<form id="dk_form" name="dk_form"><ul class="ui-tree-container">{"".join(nodes)}</ul>{button}</form>'
+
+
+def si_document(name : str, officers : list[tuple[str, str, str]] = (), capital : str = "25000.00",
+                legal_form : str = "Gesellschaft mit beschränkter Haftung", seat : str = "Berlin",
+                events : int = 0) -> str:
+    "structured content (SI) in the layout of the XJustiz register messages, officers as (first name, last name, role)"
+    e = html_lib.escape
+    def participant(body, role):
+        return (f'<tns:beteiligung><tns:beteiligter><tns:auswahl_beteiligter>{body}</tns:auswahl_beteiligter>'
+                f'</tns:beteiligter><tns:rolle><tns:rollenbezeichnung><code>{e(role)}</code></tns:rollenbezeichnung>'
+                '</tns:rolle></tns:beteiligung>')
+    company = participant(f'<tns:organisation><tns:bezeichnung><tns:bezeichnung.aktuell>{e(name)}'
+                          '</tns:bezeichnung.aktuell></tns:bezeichnung>'
+                          f'<tns:sitz><tns:ort>{e(seat)}</tns:ort></tns:sitz>'
+                          f'<tns:rechtsform><code>{e(legal_form)}</code></tns:rechtsform></tns:organisation>',
+                          "Rechtsträger")
+    people = "".join(participant(f'<tns:natuerlichePerson><tns:vollerName><tns:vorname>{e(first)}</tns:vorname>'
+                                 f'<tns:nachname>{e(last)}</tns:nachname></tns:vollerName>'
+                                 '<tns:geburt><tns:geburtsdatum>1970-01-01</tns:geburtsdatum></tns:geburt>'
+                                 '<tns:anschrift><tns:ort>Berlin</tns:ort></tns:anschrift></tns:natuerlichePerson>',
+                                 role)
+                     for first, last, role in officers)
+    entries = "".join(f'<tns:registereintragung><tns:laufendeNummer>{n + 1}</tns:laufendeNummer>'
+                      f'<tns:eintragungsdatum>2020-01-{n % 28 + 1:02}</tns:eintragungsdatum>'
+                      f'<tns:eintragungstext>Eintragung {n + 1}</tns:eintragungstext></tns:registereintragung>'
+                      for n in range(events))
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<tns:nachricht.reg.0400003 xmlns:tns="http://www.xjustiz.de">'
+            f'<tns:grunddaten><tns:verfahrensdaten><tns:beteiligung_liste>{company}{people}</tns:beteiligung_liste>'
+            '</tns:verfahrensdaten></tns:grunddaten><tns:fachdatenRegister><tns:basisdatenRegister>'
+            '<tns:registrierung><tns:registernummer>HRB 12345 B</tns:registernummer></tns:registrierung>'
+            f'<tns:stammkapital><tns:zahl>{capital}</tns:zahl><tns:waehrung><code>EUR</code></tns:waehrung>'
+            f'</tns:stammkapital></tns:basisdatenRegister><tns:eintragungen>{entries}</tns:eintragungen>'
+            '</tns:fachdatenRegister></tns:nachricht.reg.0400003>')
@@ -0,0 +1,61 @@
+import json
+import pytest
+from batch import normalize_query, read_queries, run_batch
+from handelsregister import HandelsRegister, SearchResult, parse_args
+
+
+def test_read_csv_queries(tmp_path):
+    path = tmp_path / "queries.csv"
+    path.write_text("schlagwoerter,registerGericht,registerNummer,structuredContent\n"
+                    "gasag,Berlin (Charlottenburg),HRB 44343,yes\n"
+                    "deutsche bahn,,,\n")
+    queries = [normalize_query(q) for q in read_queries(path)]
+    assert queries[0]['schlagwoerter'] == ['gasag']
+    assert queries[0]['registerGericht'] == ['Berlin', '(Charlottenburg)']
+    assert queries[0]['structuredContent'] is True
+    assert queries[1]['schlagwoerter'] == ['deutsche', 'bahn']
+    assert queries[1]['registerNummer'] is None
+    assert queries[1]['schlagwortOptionen'] == 'all'
+
+
+def test_invalid_query():
+    with pytest.raises(ValueError):
+        normalize_query({'registerNummer' : 'HRB 1'})
+    with pytest.raises(ValueError):
+        normalize_query({'schlagwoerter' : 'x', 'unknown' : 1})
+
+
+def test_batch_resumes_from_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queries = tmp_path / "queries.jsonl"
+    queries.write_text("\n".join(json.dumps({'schlagwoerter' : name}) for name in ("a", "b", "c")) + "\n")
+    searched = []
+    def iter_companies(self):
+        name = ' '.join(self.args.schlagwoerter)
+        searched.append(name)
+        yield SearchResult(name=name.upper())
+        if name == "b" and searched.count("b") == 1:
+            raise KeyboardInterrupt  # the job gets killed during the second query
+    monkeypatch.setattr(HandelsRegister, "iter_companies", iter_companies)
+
+    args = parse_args(f"-b {queries}")
+    with pytest.raises(KeyboardInterrupt):
+        run_batch(args)
+    assert run_batch(args) == 2
+    assert searched == ["a", "b", "b", "c"]
+    results = [json.loads(line) for line in (tmp_path / "queries.results.jsonl").read_text().splitlines()]
+    assert [r['results'][0]['name'] for r in results] == ["A", "B", "C"]
+    assert run_batch(args) == 0
+
+
+def test_query_error_is_recorded(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queries = tmp_path / "queries.jsonl"
+    queries.write_text(json.dumps({'schlagwoerter' : "a", 'registerGericht' : "Nirgendwo"}) + "\n")
+    def iter_companies(self):
+        raise ValueError("specified register court ['Nirgendwo'] is invalid")
+        yield
+    monkeypatch.setattr(HandelsRegister, "iter_companies", iter_companies)
+    assert run_batch(parse_args(f"-b {queries}")) == 1
+    [record] = [json.loads(line) for line in (tmp_path / "queries.results.jsonl").read_text().splitlines()]
+    assert "results" not in record and "Nirgendwo" in record['error']
@@ -0,0 +1,117 @@
+"""
+Benchmarks of the parsing and of the result objects on synthetic pages, offline.
+Besides the time, every benchmark records the throughput (items per second) and the peak memory of one run in
+'extra_info'. Compare a change against the reference run in tests/benchmarks/baseline.json:
+
+    python -m pytest tests/test_benchmarks.py --benchmark-only --benchmark-storage=tests/benchmarks \
+        --benchmark-compare=baseline --benchmark-columns=min,mean,ops
+
+The benchmarks take about a minute, the normal test run skips them.
+"""
+
+import subprocess
+import sys
+import tracemalloc
+import pytest
+from bs4 import BeautifulSoup
+from handelsregister import (SearchResult, find_dk_download_button, find_result_id_nr, parse_dk_tree, parse_result,
+                             parse_search_results)
+from synthetic import dk_tree, result_page
+
+pytest.importorskip("pytest_benchmark")
+pytestmark = pytest.mark.benchmark(max_time=0.5, min_rounds=3, warmup=False)
+
+
+@pytest.fixture(autouse=True)
+def benchmarks_only(request):
+    if not request.config.getoption("benchmark_only"):
+        pytest.skip("benchmark, run with --benchmark-only")
+
+ROWS = [10, 100, 1000]
+TREES = [(10, 10), (50, 100), (200, 100)]   # (folders, files per folder)
+
+
+def run(benchmark, items : int, function, *args):
+    "benchmark function(*args), then record throughput and peak memory of one more run"
+    result = benchmark(function, *args)
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    benchmark.extra_info['items'] = items
+    benchmark.extra_info['peak_memory_kib'] = round(peak / 1024, 1)
+    if benchmark.stats:
+        benchmark.extra_info['items_per_second'] = round(items / benchmark.stats.stats.mean, 1)
+    return result
+
+
+def results(count : int) -> list[SearchResult]:
+    companies = [company for _, company in parse_search_results(result_page(100), "bs4")]
+    return [companies[i % len(companies)] for i in range(count)]
+
+
+@pytest.mark.parametrize("rows", ROWS)
+def test_parse_result(benchmark, rows):
+    soup = BeautifulSoup(result_page(rows), 'html.parser')
+    table_rows = soup.find_all('tr', attrs={'data-ri': True})
+    companies = run(benchmark, rows, lambda: [parse_result(row) for row in table_rows])
+    assert len(companies) == rows
+
+
+@pytest.mark.parametrize("backend", ["bs4", "lxml"])
+@pytest.mark.parametrize("rows", ROWS)
+def test_parse_search_results(benchmark, rows, backend):
+    if backend == "lxml":
+        pytest.importorskip("lxml")
+    html = result_page(rows)
+    companies = run(benchmark, rows, parse_search_results, html, backend)
+    assert len(companies) == rows
+
+
+@pytest.mark.parametrize("rows", ROWS)
+def test_find_result_id_nr(benchmark, rows):
+    html = result_page(rows)
+    assert run(benchmark, rows, find_result_id_nr, html) == "161"
+
+
+@pytest.mark.parametrize("folders,files", TREES)
+def test_parse_dk_tree(benchmark, folders, files):
+    html = dk_tree(folders, files)
+    nodes = run(benchmark, 1 + folders * (files + 1), parse_dk_tree, html)
+    assert len(nodes) == 1 + folders * (files + 1)
+
+
+@pytest.mark.parametrize("folders,files", TREES)
+def test_find_dk_download_button(benchmark, folders, files):
+    html = dk_tree(folders, files)
+    assert run(benchmark, 1, find_dk_download_button, html) == "42"
+
+
+@pytest.mark.parametrize("count", [1000, 10000])
+def test_to_dict(benchmark, count):
+    companies = results(count)
+    dicts = run(benchmark, count, lambda: [company.toDict() for company in companies])
+    assert len(dicts) == count
+
+
+@pytest.mark.parametrize("count", [1000, 10000])
+def test_str(benchmark, count):
+    companies = results(count)
+    texts = run(benchmark, count, lambda: [str(company) for company in companies])
+    assert texts[0].startswith("name: Muster")
+
+
+def test_startup_import(benchmark):
+    "time of 'import handelsregister' in a new interpreter"
+    from test_startup import ROOT
+    command = [sys.executable, "-c", "import handelsregister"]
+    benchmark.pedantic(subprocess.run, args=(command,), kwargs={'cwd' : ROOT, 'check' : True}, rounds=10)
+
+
+def test_startup_cached_search(benchmark, tmp_path, monkeypatch):
+    "time of a CLI run that is answered from the search cache"
+    from test_startup import RUN_CLI, cached_search
+    monkeypatch.chdir(tmp_path)
+    cached_search("-s gasag")
+    command = [sys.executable, "-c", RUN_CLI, "-s", "gasag", "--output", "jsonl"]
+    benchmark.pedantic(subprocess.run, args=(command,), kwargs={'capture_output' : True, 'check' : True}, rounds=10)
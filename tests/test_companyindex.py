@@ -0,0 +1,75 @@
+import pathlib
+from companyindex import CompanyIndex
+from handelsregister import HandelsRegister, SearchResult, parse_args
+from replay import ReplayPortal
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+
+
+def company(name, court, city="Berlin", status="currently registered", history=()):
+    c = SearchResult(name=name, court=court, city=city, status=status)
+    c.history = tuple((n, city) for n in history)
+    return c
+
+
+def test_search_options(tmp_path):
+    index = CompanyIndex(tmp_path / "companies.sqlite")
+    index.upsert([
+        company("GASAG AG", "Berlin District court Berlin (Charlottenburg) HRB 44343 B", history=["Berliner Gaswerke AG"]),
+        company("Gas Service GmbH", "Hamburg District court Hamburg HRB 1234", city="Hamburg"),
+        company("Berliner Wasserbetriebe", "Berlin District court Berlin (Charlottenburg) HRA 999"),
+    ])
+    names = lambda results: sorted(r['name'] for r in results)
+    assert names(index.search("gasag")) == ["GASAG AG"]
+    # former names are found as well
+    assert names(index.search("gaswerke")) == ["GASAG AG"]
+    assert names(index.search("gas service")) == ["Gas Service GmbH"]
+    assert names(index.search("gasag gmbh", "min")) == ["GASAG AG", "Gas Service GmbH"]
+    assert names(index.search("service gas", "exact")) == []
+    assert names(index.search("gas service", "exact")) == ["Gas Service GmbH"]
+    assert names(index.search("berliner", registerGericht=["Berlin", "(Charlottenburg)"])) == \
+        ["Berliner Wasserbetriebe", "GASAG AG"]
+    assert names(index.search("berliner", registerNummer=["HRB", "44343"])) == ["GASAG AG"]
+
+
+def test_court_is_no_like_pattern(tmp_path):
+    index = CompanyIndex(tmp_path / "companies.sqlite")
+    index.upsert([company("GASAG AG", "Berlin District court Berlin_Charlottenburg HRB 44343 B"),
+                  company("GASAG Service GmbH", "Berlin District court Berlin-Charlottenburg HRB 12345 B"),
+                  company("GASAG 100% GmbH", "Hamburg District court Hamburg 100% HRB 1 B")])
+    names = lambda results: sorted(r['name'] for r in results)
+    # _ and % match only themselves
+    assert names(index.search("gasag", registerGericht="Berlin_Charlottenburg")) == ["GASAG AG"]
+    assert names(index.search("gasag", registerGericht="Berlin%Charlottenburg")) == []
+    assert names(index.search("gasag", registerGericht="100%")) == ["GASAG 100% GmbH"]
+    assert names(index.search("gasag", registerGericht="Berlin\\")) == []
+
+
+def test_upsert_updates_entry(tmp_path):
+    index = CompanyIndex(tmp_path / "companies.sqlite")
+    court = "Berlin District court Berlin (Charlottenburg) HRB 44343 B"
+    index.upsert([company("GASAG AG", court)])
+    index.upsert([company("GASAG Berlin AG", court, status="currently registered", history=["GASAG AG"])])
+    assert len(index) == 1
+    [result] = index.search("gasag berlin")
+    assert result['history'] == [{'name' : "GASAG AG", 'location' : "Berlin"}]
+    assert index.search("gasag")
+
+
+def test_local_search_without_requests(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with ReplayPortal(FIXTURES / "portal") as portal:
+        h = HandelsRegister(parse_args(f"-s gasag -f --sessionMaxIdle 0 --baseUrl {portal.url}"))
+        online = h.search_companies()
+        requests = portal.requests
+
+        h = HandelsRegister(parse_args(f"-s gasag --local --baseUrl {portal.url}"))
+        local = h.search_companies()
+        assert portal.requests == requests
+        assert h.request_count == 0
+        assert [c.toDict() for c in local] == [c.toDict() for c in online]
+
+        # nothing in the index: the portal is asked
+        h = HandelsRegister(parse_args(f"-s unbekannt --local --sessionMaxIdle 0 --baseUrl {portal.url}"))
+        h.search_companies()
+        assert h.request_count > 0
@@ -0,0 +1,88 @@
+import json
+import pytest
+import handelsregister
+from batch import check_courts, normalize_query
+from courts import CourtTable, court_aliases, normalize
+from handelsregister import HandelsRegister, parse_args, parse_court_names
+from synthetic import court_options_page
+
+COURTS = {
+    "Berlin (Charlottenburg)" : "F1103",
+    "München" : "D2601",
+    "Köln" : "R3101",
+    "Kiel" : "U1206",
+    "Frankfurt am Main" : "F1103X",
+    "Frankfurt (Oder)" : "Y1605",
+}
+
+
+@pytest.fixture
+def index(tmp_path):
+    return CourtTable(tmp_path / "courts.json").update(COURTS)
+
+
+def test_normalize():
+    assert normalize("  Köln (Rhein) ") == "koeln rhein"
+    assert normalize("MÜNCHEN") == normalize("muenchen") == "muenchen"
+    assert court_aliases("Berlin (Charlottenburg)") == ("Amtsgericht Berlin (Charlottenburg)", "Charlottenburg")
+
+
+def test_match(index):
+    assert index.match(["Berlin", "(Charlottenburg)"]).id == "F1103"
+    assert index.match("charlottenburg").id == "F1103"
+    assert index.match("Amtsgericht München").id == "D2601"
+    assert index.match("koeln").id == "R3101"
+    # unique prefix
+    assert index.match("Mün").id == "D2601"
+    # misspelled
+    assert index.match("Muenchn").id == "D2601"
+    assert index.match("Frankfurt Oder").id == "Y1605"
+
+
+def test_no_match(index):
+    with pytest.raises(ValueError, match="ambiguous"):
+        index.match("Frankfurt")
+    with pytest.raises(ValueError, match="ambiguous"):
+        index.match("K")
+    with pytest.raises(ValueError, match="invalid"):
+        index.match("Nirgendwo")
+
+
+def test_table_on_disk(tmp_path):
+    table = CourtTable(tmp_path / "courts.json", max_age=3600)
+    assert table.load() is None and table.is_stale()
+    table.update(COURTS)
+    again = CourtTable(tmp_path / "courts.json", max_age=3600)
+    assert len(again.load()) == len(COURTS) and not again.is_stale()
+    data = json.loads((tmp_path / "courts.json").read_text(encoding="utf-8"))
+    data['fetched'] -= 7200
+    (tmp_path / "courts.json").write_text(json.dumps(data), encoding="utf-8")
+    assert CourtTable(tmp_path / "courts.json", max_age=3600).is_stale()
+
+
+def test_search_form_is_parsed_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    html = court_options_page(COURTS)
+    parsed = []
+    def parse(html, backend):
+        parsed.append(backend)
+        return parse_court_names(html, backend)
+    monkeypatch.setattr(handelsregister, "parse_court_names", parse)
+    h = HandelsRegister(parse_args("-s x -gericht muenchen"))
+    assert h.find_court(html).id == "D2601"
+    h = HandelsRegister(parse_args("-s x -gericht Charlottenburg"))
+    assert h.find_court(html).id == "F1103"
+    assert len(parsed) == 1
+    # a court that is not in the table yet is looked up in the form
+    html = court_options_page({**COURTS, "Neustadt" : "N1"})
+    assert HandelsRegister(parse_args("-s x -gericht Neustadt")).find_court(html).id == "N1"
+    assert len(parsed) == 2
+    with pytest.raises(ValueError):
+        HandelsRegister(parse_args("-s x -gericht Altstadt")).find_court(html)
+
+
+def test_batch_checks_courts(index):
+    queries = [normalize_query({'schlagwoerter' : "a", 'registerGericht' : court})
+               for court in ("Köln", "Nirgendwo", "")]
+    assert [q['registerGericht'] for q in check_courts(queries, index)] == [["Köln"], None]
+    assert check_courts(queries, None) == queries
@@ -0,0 +1,59 @@
+import hashlib
+from handelsregister import (HandelsRegister, SearchResult, DownloadedFile, parse_args, parse_dk_tree,
+                             find_dk_download_button)
+
+
+def node(id, label, kind):
+    css = {"leaf" : "ui-treenode ui-treenode-leaf", "parent" : "ui-treenode ui-treenode-parent", "": "ui-treenode"}[kind]
+    return (f'<li id="dk_form:dktree:{id}" data-rowkey="{id}" class="{css} ui-treenode-unselected">'
+            f'<span class="ui-treenode-label ui-corner-all" role="treeitem">{label}</span></li>')
+
+BUTTON = ('<button id="dk_form:j_idt42" name="dk_form:j_idt42" class="ui-button ui-widget ui-state-default '
+          'ui-corner-all ui-button-text-only" onclick="" type="submit">')
+
+TREE = "".join([node("0", "Documents on legal entity", "parent"),
+                node("0_0", "Register number", "parent"),
+                node("0_0_0", "a.pdf", "leaf"),
+                node("0_0_1", "b.pdf", "leaf"),
+                node("0_1", "Other", "parent")])
+EXPANDED = TREE + node("0_1_0", "c.pdf", "leaf")
+
+
+def test_parse_dk_tree():
+    assert parse_dk_tree(TREE)[:3] == [("0", "Documents on legal entity", False),
+                                       ("0_0", "Register number", False),
+                                       ("0_0_0", "a.pdf", True)]
+    assert parse_dk_tree(node("0", "x", ""))[0][2] is None
+    assert find_dk_download_button("<div>" + BUTTON) == "42"
+    assert find_dk_download_button("<div>") is None
+
+
+def test_walk_selects_only_unexpanded_folders(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    h = HandelsRegister(parse_args("-s gasag -docs"))
+    selected = []
+    def select_dk_node(browser, view_state, id):
+        selected.append(id)
+        return EXPANDED
+    monkeypatch.setattr(h, "select_dk_node", select_dk_node)
+    files, j_id = h.walk_dk_tree(h.browser, "state", TREE)
+    assert files == [("0_0_0", "a.pdf"), ("0_0_1", "b.pdf"), ("0_1_0", "c.pdf")]
+    assert selected == ["0_1"]
+
+
+def test_known_tree_in_store_needs_no_request(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    h = HandelsRegister(parse_args("-s gasag -docs"))
+    company = SearchResult(name="GASAG AG", court="Berlin District court Berlin (Charlottenburg) HRB 44343")
+    files = [("0_0_0", "a.pdf"), ("0_0_1", "b.pdf")]
+    h.save_dk_tree(company, files, "42")
+    for id, label in files:
+        path = h.companyname2downloadname("tmp", label)
+        path.write_bytes(label.encode())
+        h.store_document(company, "DK", DownloadedFile(label, path, 5, hashlib.sha256(label.encode()).hexdigest()),
+                         node=id, label=label)
+    def fetch(*args, **kwargs):
+        raise AssertionError("everything is known locally")
+    monkeypatch.setattr(h, "fetch", fetch)
+    assert h.getDocsFromDocsPage(h.browser, "161", 0, company) == 2
+    assert [d.filename for d in company.documents] == ["a.pdf", "b.pdf"]
@@ -0,0 +1,49 @@
+import hashlib
+from docstore import DocumentStore
+from handelsregister import DownloadedFile, HandelsRegister, SearchResult, parse_args, split_register_number
+
+
+def add_file(store, tmp_path, name, data, **key):
+    path = tmp_path / name
+    path.write_bytes(data)
+    sha256 = hashlib.sha256(data).hexdigest()
+    return store.add(filename=name, path=path, sha256=sha256, size=len(data), **key)
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = DocumentStore(tmp_path / "store")
+    first = add_file(store, tmp_path, "a.pdf", b"same", court="Berlin", register_nr="HRB 1", doc_type="DK",
+                     node="0_0", label="a.pdf")
+    second = add_file(store, tmp_path, "b.pdf", b"same", court="Berlin", register_nr="HRB 2", doc_type="DK",
+                      node="0_1", label="b.pdf")
+    assert first == second
+    assert len(list(store.objects.rglob("*"))) == 2  # one prefix directory, one object
+    assert (tmp_path / "a.pdf").read_bytes() == b"same"
+    assert (tmp_path / "b.pdf").samefile(first)
+    filename, sha256, size, path = store.lookup("Berlin", "HRB 2", "DK", "0_1", "b.pdf")
+    assert (filename, size, path) == ("b.pdf", 4, first)
+    assert store.lookup("Berlin", "HRB 2", "DK", "0_1", "other.pdf") is None
+    assert store.lookup("Berlin", "HRB 1", "DK", "0_0", "a.pdf", max_age=-1) is None
+
+
+def test_split_register_number():
+    assert split_register_number("Berlin  District court Berlin (Charlottenburg) HRB 44343  ") == \
+        ("Berlin District court Berlin (Charlottenburg)", "HRB 44343")
+    assert split_register_number("Bayern Amtsgericht München HRB 12345 B")[1] == "HRB 12345 B"
+    assert split_register_number("Bayern Amtsgericht München") == ("Bayern Amtsgericht München", "")
+
+
+def test_stored_document_needs_no_request(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    h = HandelsRegister(parse_args('-s gasag -ad'))
+    company = SearchResult(name="GASAG AG", court="Berlin District court Berlin (Charlottenburg) HRB 44343")
+    path = h.companyname2downloadname("x", "AD.pdf")
+    path.write_bytes(b"%PDF")
+    h.store_document(company, "AD", DownloadedFile("AD.pdf", path, 4, hashlib.sha256(b"%PDF").hexdigest()))
+
+    def fetch(*args, **kwargs):
+        raise AssertionError("the document is in the store")
+    monkeypatch.setattr(h, "fetch", fetch)
+    h.getDocumentFromSearchResult(type="AD", id_nr="161", browser=h.browser, row_index=0, company=company)
+    assert [d.filename for d in company.documents] == ["AD.pdf"]
+    assert company.documents[0].content == b"%PDF"
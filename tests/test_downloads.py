@@ -0,0 +1,75 @@
+import hashlib
+import json
+import pathlib
+import tracemalloc
+import mechanize
+from handelsregister import DownloadedFile, HandelsRegister, SearchResult, parse_args
+from replay import ReplayPortal
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+
+
+def test_stream_response_to_disk(tmp_path):
+    data = bytes(range(256)) * 4096  # 1 MiB
+    response = mechanize.make_response(data, [("Content-Type", "application/pdf")])
+    path = tmp_path / "AD.pdf"
+    document = DownloadedFile.from_response(response, "AD.pdf", path, chunk_size=1000)
+    assert document.size == len(data)
+    assert document.sha256 == hashlib.sha256(data).hexdigest()
+    assert path.read_bytes() == data
+    assert list(tmp_path.glob("*.part")) == []
+    assert str(document).endswith("Byte -> AD.pdf")
+
+    company = SearchResult(name="GASAG AG")
+    company.documents.append(document)
+    assert company.toDict()['documents'] == [
+        {'filename' : "AD.pdf", 'length' : len(data), 'path' : str(path), 'sha256' : document.sha256}]
+
+
+def test_download_names_stay_in_download_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    h = HandelsRegister(parse_args('-s gasag'))
+    path = h.companyname2downloadname("District court Berlin HRB 1/2 GASAG AG", "../../etc/passwd")
+    assert path.parent.parent == h.downloaddir
+    assert path.name == "passwd"
+
+
+def test_stream_keeps_memory_bounded(tmp_path):
+    data = b"%PDF" * 2_500_000  # 10 MB
+    response = mechanize.make_response(data, [("Content-Type", "application/pdf")])
+    tracemalloc.start()
+    document = DownloadedFile.from_response(response, "AD.pdf", tmp_path / "AD.pdf")
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert document.size == len(data)
+    # a few chunks, not the document
+    assert peak < 1_000_000
+
+
+def test_xml_download_against_replay(tmp_path, monkeypatch):
+    # mechanize reads the head of XML responses for http-equiv headers, not so for a download
+    monkeypatch.chdir(tmp_path)
+    exchanges = [json.loads(line) for line in (FIXTURES / "portal" / "exchanges.jsonl").open(encoding="utf-8")]
+    [si] = [e for e in exchanges if dict(e['headers'])['Content-Type'] == "application/xml"]
+    with ReplayPortal(FIXTURES / "portal") as portal:
+        h = HandelsRegister(parse_args(f"-s gasag -si -f --sessionMaxIdle 0 --baseUrl {portal.url}"))
+        [company] = h.search_companies()
+    [document] = company.documents
+    assert document.content == (FIXTURES / "portal" / si['body']).read_bytes()
+
+
+def test_same_file_name_of_two_documents(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    h = HandelsRegister(parse_args('-s gasag'))
+    company = "District court Berlin HRB 1 GASAG AG"
+    ad = h.companyname2downloadname(company, "GASAG.pdf", "AD")
+    ad.write_bytes(b"AD")
+    cd = h.companyname2downloadname(company, "GASAG.pdf", "CD")
+    assert cd.name == "GASAG [CD].pdf" and cd.parent == ad.parent
+    assert h.companyname2downloadname(company, "GASAG.pdf", "0_1/2").name == "GASAG [0_1_2].pdf"
+    # the same document again keeps its name
+    assert h.companyname2downloadname(company, "GASAG.pdf", "AD") == ad
+
+    # the next run replaces the files of the earlier one
+    h = HandelsRegister(parse_args('-s gasag'))
+    assert h.companyname2downloadname(company, "GASAG.pdf", "CD") == ad
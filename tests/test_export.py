@@ -0,0 +1,51 @@
+import csv
+import io
+import json
+import pathlib
+import pytest
+from export import make_writer, write_all
+from handelsregister import DownloadedFile, SearchResult
+
+
+def company(i):
+    c = SearchResult(name=f"Muster {i} GmbH", court=f"Berlin District court Berlin (Charlottenburg) HRB {i}",
+                     city="Berlin", status="currently registered")
+    c.history = ((f"Alt {i} GmbH", "Berlin"),)
+    c.documents = [DownloadedFile(filename=f"{i}.pdf", path=pathlib.Path(f"downloads/{i}.pdf"), size=i, sha256="ab")]
+    return c
+
+
+def test_slots():
+    with pytest.raises(AttributeError):
+        SearchResult().extra = 1
+    with pytest.raises(AttributeError):
+        DownloadedFile().extra = 1
+
+
+def test_jsonl():
+    out = io.StringIO()
+    assert write_all((company(i) for i in range(3)), "jsonl", out) == 3
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert records[1] == company(1).toDict()
+    assert records[1]['history'] == [{'name' : "Alt 1 GmbH", 'location' : "Berlin"}]
+
+
+def test_csv():
+    out = io.StringIO()
+    write_all((company(i) for i in range(3)), "csv", out)
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert [r['register_number'] for r in rows] == ["HRB 0", "HRB 1", "HRB 2"]
+    assert json.loads(rows[2]['documents'])[0]['filename'] == "2.pdf"
+    assert json.loads(rows[2]['history']) == [{'name' : "Alt 2 GmbH", 'location' : "Berlin"}]
+
+
+def test_writes_while_produced():
+    out = io.StringIO()
+    writer = make_writer("jsonl", out)
+    def companies():
+        for i in range(3):
+            yield company(i)
+            # the previous company is written before the next one is produced
+            assert out.getvalue().count("\n") == i + 1
+    for c in companies():
+        writer.write(c)
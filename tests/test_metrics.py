@@ -0,0 +1,68 @@
+import json
+import pathlib
+from handelsregister import HandelsRegister, parse_args
+import metrics as metrics_module
+from metrics import Metrics, percentile
+from replay import ReplayPortal
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+
+
+def test_percentile():
+    values = sorted(float(i) for i in range(1, 101))
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([3.0], 90) == 3.0
+    assert percentile([], 50) == 0.0
+
+
+def test_summary_and_files(tmp_path):
+    metrics = Metrics()
+    metrics.record_request("search_submit", 0.5, 200, 1000, wait=2.0)
+    metrics.record_request("startpage", 1.0, None, retry=0)
+    metrics.record_request("startpage", 0.2, 200, 100, retry=1)
+    with metrics.timer("parse_results"):
+        pass
+    summary = metrics.summary()
+    assert summary['requests'] == 3 and summary['bytes'] == 1100
+    assert summary['rate_limit_wait_seconds'] == 2.0
+    assert summary['operations']['startpage']['errors'] == 1
+    assert summary['operations']['startpage']['retries'] == 1
+    assert summary['operations']['parse_results']['count'] == 1
+    assert "search_submit" in metrics.report()
+
+    metrics.write(tmp_path / "metrics.json")
+    assert json.loads((tmp_path / "metrics.json").read_text())['requests'] == 3
+    metrics.write(tmp_path / "handelsregister.prom")
+    prom = (tmp_path / "handelsregister.prom").read_text()
+    assert 'handelsregister_requests_total{operation="startpage",code="200"} 1' in prom
+    assert 'handelsregister_operation_seconds_count{operation="startpage"} 2' in prom
+
+
+def test_memory_of_a_long_run_is_bounded():
+    metrics = Metrics()
+    for i in range(1, 100001):
+        metrics.record_request("search_submit", i / 100000, 200)
+    stats = metrics.operations['search_submit']
+    assert len(stats.seconds) == metrics_module.RESERVOIR_SIZE
+    d = metrics.summary()['operations']['search_submit']
+    # count, total and max are exact, the quantiles come from a sample of all calls
+    assert d['count'] == 100000 and d['max_seconds'] == 1.0
+    assert abs(d['total_seconds'] - 50000.5) < 1e-6
+    assert abs(d['p50_seconds'] - 0.5) < 0.1 and abs(d['p90_seconds'] - 0.9) < 0.05
+
+
+def test_every_request_is_recorded(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    with ReplayPortal(FIXTURES / "portal") as portal:
+        args = parse_args(f"-s gasag -ad -docs -f --sessionMaxIdle 0 --profile "
+                          f"--metricsFile {tmp_path / 'metrics.json'} --baseUrl {portal.url}")
+        h = HandelsRegister(args)
+        companies = h.search_companies()
+        h.write_metrics()
+    summary = json.loads((tmp_path / "metrics.json").read_text())
+    assert summary['requests'] == h.request_count == portal.requests
+    operations = summary['operations']
+    assert {"startpage", "search_form", "search_submit", "document_AD", "docs_page", "parse_results"} <= set(operations)
+    assert operations['document_AD']['bytes'] == companies[0].documents[0].size
+    assert "search_submit" in capsys.readouterr().err
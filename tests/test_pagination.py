@@ -0,0 +1,39 @@
+import itertools
+from handelsregister import HandelsRegister, parse_args
+from synthetic import result_page, result_rows
+
+PAGINATOR = '<div id="ergebnissForm:selectedSuchErgebnisFormTable_paginator_bottom" class="ui-paginator"></div>'
+
+
+def paged_register(tmp_path, monkeypatch, total):
+    monkeypatch.chdir(tmp_path)
+    h = HandelsRegister(parse_args("-s muster"))
+    monkeypatch.setattr(h, "submit_search", lambda: result_page(10) + PAGINATOR)
+    pages = []
+    def fetch_result_page(first, rows):
+        pages.append(first)
+        return f'<table role="grid"><tbody>{result_rows(min(rows, total - first), start=first)}</tbody></table>'
+    monkeypatch.setattr(h, "fetch_result_page", fetch_result_page)
+    return h, pages
+
+
+def test_pages_are_requested_lazily(tmp_path, monkeypatch):
+    h, pages = paged_register(tmp_path, monkeypatch, total=25)
+    first = list(itertools.islice(h.iter_companies(), 3))
+    assert [c.name for c in first] == [f"Muster & Söhne {i} GmbH" for i in range(3)]
+    assert pages == []
+    list(itertools.islice(h.iter_companies(), 11))
+    assert pages == [10]
+
+
+def test_all_pages_and_cache(tmp_path, monkeypatch):
+    h, pages = paged_register(tmp_path, monkeypatch, total=25)
+    companies = h.search_companies()
+    assert len(companies) == 25
+    assert pages == [10, 20]
+    assert companies[24].court.endswith("HRB 10024 B")
+
+    # the complete result is cached with all pages
+    monkeypatch.setattr(h, "submit_search", lambda: None)
+    assert [c.name for c in h.search_companies()] == [c.name for c in companies]
+    assert pages == [10, 20]
@@ -0,0 +1,43 @@
+import pathlib
+import pytest
+from handelsregister import parse_search_results, parse_court_names
+from synthetic import result_page, court_options_page
+
+pytest.importorskip("lxml")
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+
+
+def as_tuples(results):
+    return [(i, c.name, c.court, c.city, c.status, c.history) for i, c in results]
+
+
+@pytest.mark.parametrize("html", [
+    (FIXTURES / "search_result.html").read_text(),
+    result_page(0),
+    result_page(1),
+    result_page(50),
+])
+def test_lxml_parser_equals_bs4(html):
+    expected = as_tuples(parse_search_results(html, "bs4"))
+    assert as_tuples(parse_search_results(html, "lxml")) == expected
+
+
+def test_fixture_values():
+    [(index, company)] = parse_search_results((FIXTURES / "search_result.html").read_text(), "lxml")
+    assert index == 0
+    assert company.name == "GASAG AG"
+    assert company.court == "Berlin   District court Berlin (Charlottenburg) HRB 44343"
+    assert company.status == "currently registered"
+    assert company.history == (("1.) Gasag Berliner Gaswerke Aktiengesellschaft", "1.) Berlin"),)
+
+
+def test_court_options_equal():
+    html = court_options_page({"Berlin (Charlottenburg)" : "F1103", "München" : "D2601", "Köln &amp; Bonn" : "R3101"})
+    assert parse_court_names(html, "lxml") == parse_court_names(html, "bs4")
+    assert parse_court_names(html, "lxml")["Berlin (Charlottenburg)"] == "F1103"
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        parse_search_results("<html></html>", "regex")
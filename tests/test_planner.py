@@ -0,0 +1,155 @@
+import hashlib
+import json
+from batch import normalize_query, query_id, run_batch
+from courts import CourtTable
+from handelsregister import DownloadedFile, HandelsRegister, SearchResult, parse_args
+from planner import estimate_requests, format_plan, plan_queries
+from synthetic import result_page_of, result_row
+
+COURT = "Berlin District court Berlin (Charlottenburg) HRB 44343"
+
+
+def planned(*raw, index=None, courts=None):
+    queries = [normalize_query(q) for q in raw]
+    return plan_queries([(query_id(q), q) for q in queries], index, courts)
+
+
+def gasag_index(tmp_path):
+    h = HandelsRegister(parse_args(f"-s x --indexFile {tmp_path / 'companies.sqlite'}"))
+    h.company_index.upsert([SearchResult(name="GASAG AG", court=COURT, city="Berlin", status="currently registered"),
+                            SearchResult(name="GASAG Solution Plus GmbH", court=COURT.replace("44343", "12345"),
+                                         city="Berlin", status="currently registered")])
+    return h
+
+
+def test_spellings_are_collapsed():
+    plan = planned({'schlagwoerter' : "Deutsche  Bahn", 'currentHardCopy' : True},
+                   {'schlagwoerter' : "deutsche bahn", 'structuredContent' : True},
+                   {'schlagwoerter' : "deutsche bahn", 'schlagwortOptionen' : "exact"})
+    assert [len(p.members) for p in plan] == [2, 1]
+    assert plan[0].documents == ["AD", "SI"]
+    assert plan[1].documents == []
+
+
+def test_queries_of_one_company_become_one_lookup(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    h = gasag_index(tmp_path)
+    courts = CourtTable(tmp_path / "courts.json").update({"Berlin (Charlottenburg)" : "F1103", "München" : "D2601"})
+    plan = planned({'schlagwoerter' : "gasag ag", 'schlagwortOptionen' : "exact", 'currentHardCopy' : True},
+                   {'schlagwoerter' : "gasag", 'registerNummer' : "HRB 44343",
+                    'registerGericht' : "Charlottenburg", 'structuredContent' : True},
+                   # a part of the name or an unknown court names no single company
+                   {'schlagwoerter' : "gasag", 'schlagwortOptionen' : "exact"},
+                   {'schlagwoerter' : "gasag", 'registerNummer' : "HRB 44343", 'registerGericht' : "München"},
+                   index=h.company_index, courts=courts)
+    assert [len(p.members) for p in plan] == [2, 1, 1]
+    lookup = plan[0].query
+    assert lookup['schlagwoerter'] == ["GASAG", "AG"] and lookup['schlagwortOptionen'] == "exact"
+    assert lookup['registerNummer'] == ["HRB", "44343"]
+    assert lookup['registerGericht'] == ["Berlin (Charlottenburg)"]
+    assert plan[0].documents == ["AD", "SI"]
+    assert plan[1].company is None and plan[2].company is None
+
+
+def test_companies_of_one_court_stay_apart(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    h = gasag_index(tmp_path)
+    plan = planned({'schlagwoerter' : "gasag ag", 'schlagwortOptionen' : "exact"},
+                   {'schlagwoerter' : "gasag solution plus gmbh", 'schlagwortOptionen' : "exact"},
+                   index=h.company_index)
+    assert [p.company['name'] for p in plan] == ["GASAG AG", "GASAG Solution Plus GmbH"]
+
+
+def test_estimate(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    h = gasag_index(tmp_path)
+    company = SearchResult(name="GASAG AG", court=COURT)
+    path = h.companyname2downloadname("tmp", "ad.pdf")
+    path.write_bytes(b"%PDF")
+    h.store_document(company, "AD", DownloadedFile("ad.pdf", path, 4, hashlib.sha256(b"%PDF").hexdigest()))
+    h.search_cache.put(h.search_cache.key(["nobody"]), "<html></html>")
+    plan = planned({'schlagwoerter' : "GASAG AG", 'schlagwortOptionen' : "exact", 'currentHardCopy' : True,
+                    'structuredContent' : True},
+                   {'schlagwoerter' : "nobody"},
+                   {'schlagwoerter' : "somebody", 'downloadAllDocuments' : True},
+                   index=h.company_index)
+    total = estimate_requests(plan, h)
+    # the AD is stored, the SI is not; the second search is cached; the DK tree of an unknown company
+    assert [p.requests for p in plan] == [2 + 1, 0, 2 + 6]
+    assert total == 3 + 8 + 1
+    text = format_plan(plan, total, 60, 60)
+    assert text.startswith("3 queries -> 3 searches (0 duplicates, 1 register number lookups)")
+    assert "at least 12" in text
+
+    # every session of the pool that downloads runs the search, and opens the start page once
+    h.args = parse_args("-s x --sessions 4")
+    plan = planned({'schlagwoerter' : "gasag", 'structuredContent' : True}, index=h.company_index)
+    assert estimate_requests(plan, h) == 2 + 2 + 2 * 2 + 1 + 2
+    # the AD of GASAG AG is stored, a single download is not worth the search of a pool session
+    plan = planned({'schlagwoerter' : "gasag", 'currentHardCopy' : True}, index=h.company_index)
+    assert estimate_requests(plan, h) == 2 + 1 + 1
+
+
+def test_batch_searches_duplicates_once(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    queries = tmp_path / "queries.jsonl"
+    queries.write_text("\n".join(json.dumps({'schlagwoerter' : name}) for name in ("a", "A ", "b")) + "\n")
+    searched = []
+    def iter_companies(self):
+        searched.append(' '.join(self.args.schlagwoerter))
+        yield SearchResult(name=searched[-1].upper())
+    monkeypatch.setattr(HandelsRegister, "iter_companies", iter_companies)
+
+    assert run_batch(parse_args(f"-b {queries} --plan")) == 0
+    assert searched == [] and not (tmp_path / "queries.results.jsonl").exists()
+    assert "3 queries -> 2 searches (1 duplicates" in capsys.readouterr().out
+
+    assert run_batch(parse_args(f"-b {queries}")) == 3
+    assert searched == ["a", "b"]
+    records = [json.loads(line) for line in (tmp_path / "queries.results.jsonl").read_text().splitlines()]
+    assert [r['query']['schlagwoerter'] for r in records] == [["a"], ["A"], ["b"]]
+    assert [r['results'][0]['name'] for r in records] == ["A", "A", "B"]
+
+
+def test_forced_download_once_per_run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    h = HandelsRegister(parse_args("-s gasag -f"))
+    company = SearchResult(name="GASAG AG", court=COURT)
+    path = h.companyname2downloadname("tmp", "ad.pdf")
+    path.write_bytes(b"%PDF")
+    document = DownloadedFile("ad.pdf", path, 4, hashlib.sha256(b"%PDF").hexdigest())
+    h.docstore.add("Berlin District court Berlin (Charlottenburg)", "HRB 44343", "AD", "", "", "ad.pdf",
+                   path, document.sha256, 4)
+    # stored by an earlier run: -f downloads it again
+    assert h.document_from_store(company, "AD") is None
+    h.store_document(company, "AD", document)
+    assert h.document_from_store(company, "AD").sha256 == document.sha256
+
+
+def test_forced_download_once_with_pool(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queries = tmp_path / "queries.jsonl"
+    queries.write_text("\n".join(json.dumps({'schlagwoerter' : name, 'currentHardCopy' : True})
+                                 for name in ("gasag", "gasag ag")) + "\n")
+    page = result_page_of(result_row(0, "GASAG AG", "District court Berlin (Charlottenburg) HRB 44343") +
+                          result_row(1, "GASAG Solution Plus GmbH", "District court Berlin (Charlottenburg) HRB 12345"))
+    monkeypatch.setattr(HandelsRegister, "submit_search", lambda self: page)
+    downloads = []
+    def get_document(self, type, id_nr, browser, row_index, company):
+        document = self.document_from_store(company, type)
+        if document is None:
+            downloads.append((company.name, type))
+            path = self.companyname2downloadname(company.name, "ad.pdf")
+            path.write_bytes(b"%PDF")
+            document = DownloadedFile("ad.pdf", path, 4, hashlib.sha256(b"%PDF").hexdigest())
+            self.store_document(company, type, document)
+        company.documents.append(document)
+    monkeypatch.setattr(HandelsRegister, "getDocumentFromSearchResult", get_document)
+    shared = []
+    monkeypatch.setattr(HandelsRegister, "close",
+                        lambda self: shared.extend(s.downloaded is self.downloaded for s in self.pool.sessions))
+
+    # two searches find the same companies, the sessions of the pool download their AD once
+    assert run_batch(parse_args(f"-b {queries} --sessions 2 -f")) == 2
+    assert sorted(downloads) == [("GASAG AG", "AD"), ("GASAG Solution Plus GmbH", "AD")]
+    assert shared and all(shared)
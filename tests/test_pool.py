@@ -0,0 +1,96 @@
+import pathlib
+import threading
+import time
+from handelsregister import HandelsRegister, SearchResult, parse_args
+from pool import SessionPool
+from replay import ReplayPortal
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+RESULT_HTML = '<a id="ergebnissForm:selectedSuchErgebnisFormTable:0:j_idt42:0:fade"></a>'
+
+
+def test_downloads_overlap(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    searches = []
+    running = []
+    lock = threading.Lock()
+    def submit_search(self):
+        searches.append(self)
+        return RESULT_HTML
+    def download_documents(self, company, id_nr, row_index):
+        with lock:
+            running.append(threading.get_ident())
+        time.sleep(0.2)
+        company.requests = row_index
+    monkeypatch.setattr(HandelsRegister, "submit_search", submit_search)
+    monkeypatch.setattr(HandelsRegister, "download_documents", download_documents)
+
+    args = parse_args("-s gasag -ad")
+    with SessionPool(args, 4) as pool:
+        start = time.perf_counter()
+        futures = [pool.submit(args, SearchResult(name=f"company {i}"), i) for i in range(4)]
+        companies = [f.result() for f in futures]
+        elapsed = time.perf_counter() - start
+    assert [c.requests for c in companies] == [0, 1, 2, 3]
+    assert elapsed < 0.6
+    assert len(set(running)) == 4
+    # every session runs the search once, with its own browser and without the saved session
+    assert len(searches) == len(pool.sessions) == 4
+    assert len({id(s.browser) for s in pool.sessions}) == 4
+    assert all(s.args.sessionFile is None for s in pool.sessions)
+    assert all(s.limiter.path == pool.sessions[0].limiter.path for s in pool.sessions)
+
+
+def test_session_keeps_its_search(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    searches = []
+    monkeypatch.setattr(HandelsRegister, "submit_search", lambda self: searches.append(1) or RESULT_HTML)
+    monkeypatch.setattr(HandelsRegister, "download_documents", lambda self, company, id_nr, row_index: None)
+    args = parse_args("-s gasag -ad")
+    with SessionPool(args, 1) as pool:
+        for i in range(3):
+            pool.download_documents(args, SearchResult(), i)
+        assert len(searches) == 1
+        pool.download_documents(parse_args("-s bvg -ad"), SearchResult(), 0)
+        assert len(searches) == 2
+
+
+def test_pool_against_replay(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with ReplayPortal(FIXTURES / "portal") as portal:
+        args = parse_args(f"-s gasag -ad -f --sessionMaxIdle 0 --baseUrl {portal.url}")
+        h = HandelsRegister(args)
+        single = h.search_companies()
+
+        h = HandelsRegister(args)
+        h.pool = SessionPool(args, 2)
+        # the result has a single row, which is downloaded by a session of the pool all the same
+        monkeypatch.setattr(HandelsRegister, "pool_rows", lambda self, rows: {row_index for row_index, _ in rows})
+        pooled = h.search_companies()
+        h.pool.close()
+    assert [d.sha256 for d in pooled[0].documents] == [d.sha256 for d in single[0].documents]
+    assert pooled[0].documents
+    assert h.pool.request_count > 0
+
+
+def test_pool_only_for_several_rows_to_download(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    court = "District court Berlin (Charlottenburg) HRB "
+    rows = [(i, SearchResult(name=f"company {i}", court=f"{court}{i + 1}")) for i in range(3)]
+    h = HandelsRegister(parse_args("-s x -ad --sessions 4"))
+    h.start_workers()
+    assert h.pool_rows(rows) == {0, 1, 2}
+    # a row whose AD is in the store costs no request, a single row is not worth the search of a pool session
+    monkeypatch.setattr(HandelsRegister, "stored_document",
+                        lambda self, company, doc_type, node="", label="": company.name != "company 2" or None)
+    assert h.pool_rows(rows) == set()
+    h.close()
+
+    # a pool session for every row of --maxResults at the most
+    h = HandelsRegister(parse_args("-s x -ad --sessions 4 --maxResults 1"))
+    h.start_workers()
+    assert h.pool is None
+    h = HandelsRegister(parse_args("-s x -ad --sessions 4 --maxResults 2"))
+    h.start_workers()
+    assert h.pool.size == 2
+    h.close()
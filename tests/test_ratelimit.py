@@ -0,0 +1,46 @@
+import pytest
+import ratelimit
+from ratelimit import RateLimiter
+
+
+def test_acquire_takes_tokens(tmp_path):
+    limiter = RateLimiter(tmp_path / "ratelimit.sqlite", capacity=3)
+    assert limiter.acquire() == 0.0
+    assert limiter.acquire() == 0.0
+    assert 0.9 < limiter.tokens_left() < 1.1
+    assert limiter.next_slot() == 0.0
+
+
+def test_full_window_reports_next_slot(tmp_path):
+    limiter = RateLimiter(tmp_path / "ratelimit.sqlite", capacity=2, period=3600)
+    limiter.acquire(2)
+    with pytest.raises(TimeoutError):
+        limiter.acquire(block=False)
+    status = limiter.status()
+    assert status['tokens_left'] < 1
+    # both slots are taken until the requests leave the window
+    assert 3500 < status['next_slot_in'] <= 3600
+
+
+def test_budget_is_shared_between_instances(tmp_path):
+    path = tmp_path / "ratelimit.sqlite"
+    first = RateLimiter(path, capacity=2)
+    second = RateLimiter(path, capacity=2)
+    first.acquire()
+    second.acquire()
+    assert first.try_acquire() > 0
+    assert second.tokens_left() < 1
+
+
+def test_at_most_capacity_requests_per_hour(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, "time", lambda: now[0])
+    limiter = RateLimiter(tmp_path / "ratelimit.sqlite")
+    sent = []
+    # a cold start, then one attempt every 10 s for two hours
+    while now[0] < 1000.0 + 2 * 3600:
+        if limiter.try_acquire() == 0.0:
+            sent.append(now[0])
+        now[0] += 10
+    assert all(sum(1 for t in sent if start <= t < start + 3600) <= 60 for start in sent)
+    assert len(sent) == 120
@@ -0,0 +1,35 @@
+import json
+import pathlib
+import time
+from handelsregister import HandelsRegister, parse_args
+from replay import ReplayPortal, request_signature
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+
+
+def run_session(url, *extra):
+    h = HandelsRegister(parse_args(" ".join(("-s gasag -ad -docs -f --baseUrl", url) + extra)))
+    return h.search_companies(), h
+
+
+def test_request_signature_ignores_view_state():
+    signature = request_signature("POST", "http://localhost/rp_web/ergebnisse.xhtml",
+                                  "ergebnissForm=ergebnissForm&javax.faces.ViewState=1%3A2&a%3A0%3Afade")
+    assert signature == {'method' : "POST", 'path' : "/rp_web/ergebnisse.xhtml",
+                         'fields' : {'ergebnissForm' : "ergebnissForm", 'a:0:fade' : ""}}
+
+
+def test_record_and_replay(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with ReplayPortal(FIXTURES / "portal") as portal:
+        recorded, h = run_session(portal.url, "--record", str(tmp_path / "recording"))
+    exchanges = (tmp_path / "recording" / "exchanges.jsonl").read_text().splitlines()
+    assert len(exchanges) == h.request_count
+    assert json.loads(exchanges[0])['base_url'] == portal.url
+
+    with ReplayPortal(tmp_path / "recording", latency=0.05) as replayed:
+        start = time.perf_counter()
+        companies, h = run_session(replayed.url, "--sessionMaxIdle", "0")
+        elapsed = time.perf_counter() - start
+    assert [d.sha256 for d in companies[0].documents] == [d.sha256 for d in recorded[0].documents]
+    assert elapsed >= 0.05 * replayed.requests
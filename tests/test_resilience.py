@@ -0,0 +1,154 @@
+import functools
+import io
+import json
+import socket
+import threading
+import time
+import urllib.error
+import pytest
+import handelsregister
+import resilience
+from batch import run_batch
+from handelsregister import HandelsRegister, SearchResult, parse_args
+from resilience import CircuitBreaker, RetryPolicy, is_retryable, not_sent
+
+
+def http_error(code):
+    return urllib.error.HTTPError("http://portal/", code, "error", {}, io.BytesIO(b""))
+
+
+def test_classification():
+    assert is_retryable(http_error(503))
+    assert is_retryable(http_error(429))
+    assert not is_retryable(http_error(404))
+    assert is_retryable(urllib.error.URLError("connection refused"))
+    assert is_retryable(socket.timeout("timed out"))
+    assert is_retryable(ConnectionResetError())
+    assert not is_retryable(ValueError("invalid court"))
+    assert not_sent(urllib.error.URLError(ConnectionRefusedError()))
+    assert not not_sent(socket.timeout("timed out"))
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy(base_delay=2, max_delay=10)
+    delays = [policy.delay(retry) for retry in range(1, 8) for _ in range(50)]
+    assert all(0 <= d <= 10 for d in delays)
+    assert len(set(delays)) > 1
+    # the wait for the next token of the rate limit counts as backoff
+    assert policy.delay(1, next_slot=100) == 0.0
+
+
+def test_breaker_pauses_until_trial(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    start = time.time()
+    breaker.before_request()
+    assert time.time() - start >= 0.15
+    # a second session waits while the trial request is running
+    waited = []
+    other = threading.Thread(target=lambda: waited.append(breaker.before_request()))
+    other.start()
+    time.sleep(0.1)
+    assert other.is_alive()
+    breaker.record_success()
+    other.join(2)
+    assert not other.is_alive()
+    assert breaker.state == "closed"
+
+
+def make_session(tmp_path, monkeypatch, outcomes):
+    "HandelsRegister whose browser raises or returns the items of 'outcomes' in turn"
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(resilience.random, "uniform", lambda a, b: 0.0)
+    h = HandelsRegister(parse_args("-s gasag --retries 2"))
+    calls = []
+    def open(request, timeout=None):
+        calls.append(timeout)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+    monkeypatch.setattr(h.browser, "open", open)
+    return h, calls
+
+
+class Response:
+    code = 200
+    def get_data(self):
+        return b"<html></html>"
+
+
+def test_fetch_retries_transient_errors(tmp_path, monkeypatch):
+    h, calls = make_session(tmp_path, monkeypatch, [socket.timeout("timed out"), http_error(503), Response()])
+    assert h.fetch(h.browser, "http://portal/").code == 200
+    assert calls == [30, 30, 30]
+    assert h.request_count == 3
+    assert h.metrics.summary()['operations']['request']['retries'] == 2
+
+
+def test_fetch_raises_fatal_errors_at_once(tmp_path, monkeypatch):
+    h, calls = make_session(tmp_path, monkeypatch, [http_error(404), Response()])
+    with pytest.raises(urllib.error.HTTPError):
+        h.fetch(h.browser, "http://portal/")
+    assert len(calls) == 1
+
+
+def test_open_startpage_raises_on_final_failure(tmp_path, monkeypatch):
+    h, calls = make_session(tmp_path, monkeypatch, [urllib.error.URLError("down")] * 3)
+    with pytest.raises(urllib.error.URLError):
+        h.open_startpage()
+    assert len(calls) == 3
+
+
+def test_batch_waits_through_an_outage(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(resilience.random, "uniform", lambda a, b: 0.0)
+    monkeypatch.setattr(handelsregister, "CircuitBreaker", functools.partial(CircuitBreaker, reset_timeout=0.05))
+    outcomes = [urllib.error.URLError(ConnectionRefusedError())] * 6 + [Response(), Response()]
+    class Browser:
+        def open(self, request, timeout=None):
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, BaseException):
+                raise outcome
+            return outcome
+    def iter_companies(self):
+        self.fetch(Browser(), "http://portal/")
+        yield SearchResult(name=' '.join(self.args.schlagwoerter))
+    monkeypatch.setattr(HandelsRegister, "iter_companies", iter_companies)
+    queries = tmp_path / "queries.jsonl"
+    queries.write_text('{"schlagwoerter": "a"}\n{"schlagwoerter": "b"}\n')
+
+    # the four attempts of the first search fail, it is run again after the pauses of the circuit breaker
+    assert run_batch(parse_args(f"-b {queries}")) == 2
+    assert outcomes == []
+    records = [json.loads(line) for line in (tmp_path / "queries.results.jsonl").read_text().splitlines()]
+    assert [r['results'][0]['name'] for r in records] == ["a", "b"]
+    # refused connections do not count against the rate limit
+    h = HandelsRegister(parse_args("-s x"))
+    assert h.limiter.tokens_left() == 60 - 2
+
+
+def test_batch_gives_up_on_a_long_outage(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(resilience.random, "uniform", lambda a, b: 0.0)
+    monkeypatch.setattr(handelsregister, "CircuitBreaker",
+                        functools.partial(CircuitBreaker, reset_timeout=0.01, max_reset_timeout=0.08))
+    class Browser:
+        def open(self, request, timeout=None):
+            raise urllib.error.URLError(ConnectionRefusedError())
+    def iter_companies(self):
+        self.fetch(Browser(), "http://portal/")
+        yield SearchResult(name=' '.join(self.args.schlagwoerter))
+    monkeypatch.setattr(HandelsRegister, "iter_companies", iter_companies)
+    queries = tmp_path / "queries.jsonl"
+    queries.write_text('{"schlagwoerter": "a"}\n{"schlagwoerter": "b"}\n')
+
+    # the pauses of the circuit breaker reach their maximum, the queries are written as failed and not done
+    assert run_batch(parse_args(f"-b {queries}")) == 0
+    records = [json.loads(line) for line in (tmp_path / "queries.results.jsonl").read_text().splitlines()]
+    assert [r['query']['schlagwoerter'] for r in records] == [["a"], ["b"]]
+    assert all(r['error'].startswith("portal unavailable") and 'results' not in r for r in records)
+    assert not (tmp_path / "queries.checkpoint.json").exists()
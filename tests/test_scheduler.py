@@ -0,0 +1,179 @@
+import time
+import pytest
+from handelsregister import HandelsRegister, ResultPage, parse_args, parse_search_results
+from scheduler import Scheduler, Task
+from synthetic import result_page_of, result_row
+
+
+def companies(prefix, count, status="currently registered"):
+    "(name, court, status) of 'count' companies at one court, the register numbers differ by prefix"
+    base = sum(map(ord, prefix)) * 100
+    return [(f"{prefix} {i}", f"District court Berlin (Charlottenburg) HRB {base + i}", status) for i in range(count)]
+
+
+def table_rows(entries, start=0):
+    return "".join(result_row(start + i, name, court, status=status) for i, (name, court, status) in enumerate(entries))
+
+
+def parsed(entries):
+    return [company for _, company in parse_search_results(result_page_of(table_rows(entries)), "bs4")]
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    """a session whose searches find the companies of 'results' on one result page and whose downloads cost one
+    request each"""
+    monkeypatch.chdir(tmp_path)
+    log = []
+    results = {}
+    def iter_companies(self):
+        query = ' '.join(self.args.schlagwoerter)
+        log.append(("search", query))
+        self.request_count += 2
+        self.result_page = ResultPage(self.search_cache_key(), "161", 0, 100)
+        yield from parsed(results[query])
+    def submit_search(self):
+        query = ' '.join(self.args.schlagwoerter)
+        log.append(("search", query))
+        self.request_count += 2
+        return result_page_of(table_rows(results[query]))
+    def download_document(self, company, id_nr, row_index, doc_type):
+        log.append((doc_type, company.name))
+        self.request_count += 1
+    monkeypatch.setattr(HandelsRegister, "iter_companies", iter_companies)
+    monkeypatch.setattr(HandelsRegister, "submit_search", submit_search)
+    monkeypatch.setattr(HandelsRegister, "download_document", download_document)
+    return HandelsRegister(parse_args("-s x")), log, results
+
+
+def test_interactive_search_goes_ahead_of_bulk_documents(session):
+    h, log, results = session
+    results["crawl"] = companies("crawl", 3)
+    results["lookup"] = companies("lookup", 1)
+    scheduler = Scheduler(h)
+    bulk = scheduler.submit(parse_args("-s crawl -ad -docs"), priority="bulk")
+    scheduler.run(scheduler.pop())
+    assert scheduler.queued() == {'search' : 0, 'document' : 3, 'dk' : 3}
+    interactive = scheduler.submit(parse_args("-s lookup -si"), priority="interactive")
+    scheduler.run_pending()
+    # the crawl searches again to get back to its result page
+    assert log[:5] == [("search", "crawl"), ("search", "lookup"), ("SI", "lookup 0"), ("search", "crawl"),
+                       ("AD", "crawl 0")]
+    # documents before trees, top rows first
+    assert log[5:] == [("AD", "crawl 1"), ("AD", "crawl 2"), ("DK", "crawl 0"), ("DK", "crawl 1"), ("DK", "crawl 2")]
+    assert [c.name for c in interactive.result(0)] == ["lookup 0"]
+    assert bulk.result(0)[1].requests == 2 and bulk.spent == 2 + 2 + 6
+
+
+def test_jobs_of_the_same_priority_do_not_take_turns(session):
+    h, log, results = session
+    results["a"] = companies("a", 3)
+    results["b"] = companies("b", 3)
+    scheduler = Scheduler(h)
+    jobs = [scheduler.submit(parse_args(f"-s {query} -ad"), priority="bulk") for query in ("a", "b")]
+    scheduler.run_pending()
+    # each job downloads its documents while the browser is on its result page, no search is sent twice
+    assert [entry for entry in log if entry[0] == "search"] == [("search", "a"), ("search", "b")]
+    assert h.request_count == 2 * (2 + 3)
+    assert [job.spent for job in jobs] == [5, 5]
+
+
+def test_deleted_companies_come_last(session):
+    h, log, results = session
+    results["x"] = companies("deleted", 1, status="deleted") + companies("active", 2)
+    scheduler = Scheduler(h)
+    scheduler.submit(parse_args("-s x -hd"))
+    scheduler.run_pending()
+    assert log[1:] == [("HD", "active 0"), ("HD", "active 1"), ("HD", "deleted 0")]
+
+
+def test_budget_and_deadline(session):
+    h, log, results = session
+    results["x"] = companies("x", 5)
+    scheduler = Scheduler(h)
+    job = scheduler.submit(parse_args("-s x -ad -docs"), budget=5)
+    scheduler.run_pending()
+    # search and three AD; a DK tree is estimated at more requests than are left
+    assert job.spent == 5
+    assert [entry[0] for entry in log] == ["search", "AD", "AD", "AD"]
+    assert len(job.skipped) == 2 + 5 and {reason for _, _, reason in job.skipped} == {"budget"}
+    assert len(job.result(0)) == 5
+
+    log.clear()
+    job = scheduler.submit(parse_args("-s x -ad"), deadline=time.time() - 1)
+    scheduler.run_pending()
+    assert log == [] and job.skipped == [("x", "search", "deadline")] and job.result(0) == []
+
+
+def test_budget_counts_the_way_back_to_the_result(session):
+    h, log, results = session
+    results["x"] = companies("x", 1)
+    scheduler = Scheduler(h)
+    job = scheduler.submit(parse_args("-s x -ad"), budget=3)
+    scheduler.run(scheduler.pop())
+    # another search ran in between: the document would cost a new search as well
+    h.result_page = None
+    scheduler.run_pending()
+    assert job.skipped == [("x 0", "AD", "budget")]
+    assert job.spent == 2 <= job.budget
+
+
+def test_worker_thread(session):
+    h, log, results = session
+    results["x"] = companies("x", 2)
+    scheduler = Scheduler(h)
+    scheduler.start()
+    try:
+        job = scheduler.submit(parse_args("-s x -cd"))
+        assert len(job.result(timeout=10)) == 2
+    finally:
+        scheduler.close()
+    assert log == [("search", "x"), ("CD", "x 0"), ("CD", "x 1")]
+
+
+def test_document_of_another_search_searches_again(session, monkeypatch):
+    h, log, results = session
+    pages, downloads = [], []
+    def fetch_result_page(self, first, rows):
+        pages.append((first, rows))
+        return f'<table role="grid"><tbody>{table_rows(results["moved"][first:first + rows], first)}</tbody></table>'
+    monkeypatch.setattr(HandelsRegister, "fetch_result_page", fetch_result_page)
+    monkeypatch.setattr(HandelsRegister, "download_document",
+                        lambda self, company, id_nr, row_index, doc_type: downloads.append((company.name, row_index)))
+    results["moved"] = companies("x", 2)
+    scheduler = Scheduler(h)
+    job = scheduler.submit(parse_args("-s moved -ad"))
+    scheduler.run(scheduler.pop())
+    # another search ran in between; the result has changed since, x 0 is in row 1 now and x 1 is gone
+    h.result_page = ResultPage("another search", "161", 0, 2)
+    results["moved"] = companies("new", 1) + companies("x", 1)
+    scheduler.run_pending()
+    assert downloads == [("x 0", 1)]
+    assert job.skipped == [("x 1", "AD", "error: x 1 is not in row 1 of the result any more")]
+    assert h.result_page == ResultPage(h.search_cache_key(), "161", 0, 2)
+
+    # a row beyond the loaded page loads its page first and is checked there
+    results["moved"] = companies("x", 6)
+    company = parsed(results["moved"])[5]
+    assert scheduler.open_result_row(Task(job, "document", company, 5, "AD", 1.0, 1)) == ("161", 5)
+    assert pages == [(4, 2)] and h.result_page.first == 4
+    other = parsed(companies("other", 4))[3]
+    with pytest.raises(LookupError):
+        scheduler.open_result_row(Task(job, "document", other, 3, "AD", 1.0, 1))
+
+
+def test_rows_of_one_court_after_searching_again(session, monkeypatch):
+    h, log, results = session
+    downloads = []
+    monkeypatch.setattr(HandelsRegister, "download_document",
+                        lambda self, company, id_nr, row_index, doc_type: downloads.append((company.name, row_index)))
+    results["gasag"] = [(f"GASAG {i} GmbH", f"District court Berlin (Charlottenburg) HRB {44343 + i} B",
+                         "currently registered") for i in range(3)]
+    scheduler = Scheduler(h)
+    job = scheduler.submit(parse_args("-s gasag -ad"))
+    scheduler.run(scheduler.pop())
+    # the search was answered from the cache or another job ran in between: every row is searched for again
+    h.result_page = None
+    scheduler.run_pending()
+    assert sorted(downloads) == [("GASAG 0 GmbH", 0), ("GASAG 1 GmbH", 1), ("GASAG 2 GmbH", 2)]
+    assert job.skipped == []
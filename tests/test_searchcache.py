@@ -0,0 +1,59 @@
+import os
+import pathlib
+import pytest
+import time
+from handelsregister import HandelsRegister, parse_args
+from searchcache import SearchCache
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+
+
+def test_key_covers_all_query_inputs():
+    key = SearchCache.key(['deutsche', 'bahn'], 'all')
+    assert key == SearchCache.key('Deutsche  Bahn', 'all')
+    assert key != SearchCache.key(['deutsche', 'bahn'], 'exact')
+    assert key != SearchCache.key(['deutsche', 'bahn'], 'all', registerNummer=['HRB', '1'])
+    assert key != SearchCache.key(['deutsche', 'bahn'], 'all', registerGericht=['Berlin'])
+    assert SearchCache.key('x', registerNummer='HRB 123') == SearchCache.key('x', registerNummer=['123'])
+
+
+def test_ttl_and_lru_eviction(tmp_path):
+    cache = SearchCache(tmp_path, ttl=60, max_entries=2)
+    cache.put('a', 'A')
+    cache.put('b', 'B')
+    # make 'a' the oldest entry, then use it so that 'b' is least recently used
+    old = time.time() - 30
+    os.utime(tmp_path / 'a.html', (old, old))
+    os.utime(tmp_path / 'b.html', (old + 1, old + 1))
+    assert cache.get('a') == 'A'
+    cache.put('c', 'C')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A'
+    assert cache.get('c') == 'C'
+
+    expired = time.time() - 120
+    os.utime(tmp_path / 'c.html', (expired, expired))
+    assert cache.get('c') is None
+    assert not (tmp_path / 'c.html').exists()
+    assert list(tmp_path.glob('*.tmp')) == []
+
+
+def test_cache_hit_without_network(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    args = parse_args('-s gasag -so all')
+    h = HandelsRegister(args)
+    h.search_cache.put(h.search_cache_key(), (FIXTURES / "search_result.html").read_text())
+    requests = []
+    def fetch(browser, request, *args, **kwargs):
+        requests.append(request)
+        raise OSError("offline")
+    monkeypatch.setattr(h, "fetch", fetch)
+    companies = h.search_companies()
+    assert [c.name for c in companies] == ['GASAG AG']
+    assert requests == []
+
+    # --force skips the cache and goes to the portal, which cannot be reached
+    h.args.force = True
+    with pytest.raises(OSError):
+        h.search_companies()
+    assert requests
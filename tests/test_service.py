@@ -0,0 +1,122 @@
+import functools
+import pathlib
+import threading
+import time
+import urllib.error
+import pytest
+import resilience
+import service as service_module
+from werkzeug.serving import make_server
+from handelsregister import HandelsRegister, SearchResult, parse_args
+from replay import ReplayPortal
+from resilience import CircuitBreaker
+from service import QueryService, create_app, query_server
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+
+
+def test_identical_queries_are_coalesced(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    searched = []
+    def iter_companies(self):
+        searched.append(' '.join(self.args.schlagwoerter))
+        time.sleep(0.3)
+        yield SearchResult(name=' '.join(self.args.schlagwoerter).upper())
+    monkeypatch.setattr(HandelsRegister, "iter_companies", iter_companies)
+    service = QueryService(parse_args("-s x"), sessions=2)
+    client = create_app(service).test_client()
+
+    answers = []
+    def post(query):
+        answers.append(client.post("/search", json=query).get_json())
+    # the priority, deadline and budget of a search do not keep it apart from an identical one
+    queries = [{'schlagwoerter' : "gasag"}, {'schlagwoerter' : "gasag", 'priority' : "bulk"},
+               {'schlagwoerter' : "gasag", 'budget' : 5}, {'schlagwoerter' : "gasag", 'deadline' : 60}]
+    threads = [threading.Thread(target=post, args=(query,)) for query in queries]
+    threads.append(threading.Thread(target=post, args=({'schlagwoerter' : "bvg"},)))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(searched) == ["bvg", "gasag"]
+    assert sum(a['coalesced'] for a in answers) == 3
+    assert sorted(a['results'][0]['name'] for a in answers) == ["BVG"] + ["GASAG"] * 4
+    # after it is done, the same query is run again
+    client.post("/search", json={'schlagwoerter' : "gasag"})
+    assert searched.count("gasag") == 2
+    status = client.get("/status").get_json()
+    assert status['searches'] == 3 and status['coalesced'] == 3 and status['inflight'] == 0
+
+
+def test_invalid_query(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    client = create_app(QueryService(parse_args("-s x"))).test_client()
+    assert client.post("/search", json={'registerNummer' : "HRB 1"}).status_code == 400
+    assert client.post("/search", data="no json").status_code == 400
+
+
+def test_client_against_service(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with ReplayPortal(FIXTURES / "portal") as portal:
+        service = QueryService(parse_args(f"-s x --sessionMaxIdle 0 --baseUrl {portal.url}"))
+        server = make_server("127.0.0.1", 0, create_app(service), threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            url = f"http://127.0.0.1:{server.server_port}"
+            [company] = query_server(url, parse_args("-s gasag -ad -f"))
+            requests = portal.requests
+            # the warm session goes to the search form directly
+            [again] = query_server(url, parse_args("-s gasag -ad -f"))
+        finally:
+            server.shutdown()
+    assert company.name == again.name == "GASAG AG"
+    assert company.documents[0].path.is_absolute() and company.documents[0].path.exists()
+    assert portal.requests - requests < requests
+
+
+def test_client_with_error_page(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    def proxy(environ, start_response):
+        start_response("502 Bad Gateway", [("Content-Type", "text/html")])
+        return [b"<html><body>Bad Gateway</body></html>"]
+    server = make_server("127.0.0.1", 0, proxy)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with pytest.raises(RuntimeError, match="502 Bad Gateway"):
+            list(query_server(f"http://127.0.0.1:{server.server_port}", parse_args("-s gasag")))
+    finally:
+        server.shutdown()
+
+
+def test_scheduled_service(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(HandelsRegister, "iter_companies",
+                        lambda self: iter([SearchResult(name=' '.join(self.args.schlagwoerter).upper())]))
+    service = QueryService(parse_args("-s x"), schedule=True)
+    client = create_app(service).test_client()
+    try:
+        answer = client.post("/search", json={'schlagwoerter' : "gasag", 'priority' : "bulk", 'budget' : 10})
+        assert answer.get_json()['results'][0]['name'] == "GASAG"
+        assert client.post("/search", json={'schlagwoerter' : "gasag", 'priority' : "urgent"}).status_code == 400
+        assert client.get("/status").get_json()['queued'] == {'search' : 0, 'document' : 0, 'dk' : 0}
+    finally:
+        service.scheduler.close()
+
+
+def test_service_gives_up_on_a_long_outage(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(resilience.random, "uniform", lambda a, b: 0.0)
+    monkeypatch.setattr(service_module, "CircuitBreaker",
+                        functools.partial(CircuitBreaker, reset_timeout=0.01, max_reset_timeout=0.08))
+    class Browser:
+        def open(self, request, timeout=None):
+            raise urllib.error.URLError(ConnectionRefusedError())
+    def iter_companies(self):
+        self.fetch(Browser(), "http://portal/")
+        yield SearchResult(name="never")
+    monkeypatch.setattr(HandelsRegister, "iter_companies", iter_companies)
+    client = create_app(QueryService(parse_args("-s x"))).test_client()
+    answer = client.post("/search", json={'schlagwoerter' : "gasag"})
+    assert answer.status_code == 502 and "portal not reachable" in answer.get_json()['error']
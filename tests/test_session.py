@@ -0,0 +1,54 @@
+import json
+import mechanize
+from handelsregister import HandelsRegister, parse_args
+
+FORM = ('<html><body><form id="form" name="form" method="post" action="/rp_web/erweitertesuche.xhtml">'
+        '<input type="text" name="form:schlagwoerter"/></form></body></html>')
+URL = "https://www.handelsregister.de/rp_web/erweitertesuche.xhtml"
+
+
+def fake_fetch(h, html, requests):
+    def fetch(browser, request, *args, **kwargs):
+        requests.append(request)
+        browser.set_response(mechanize.make_response(html, [("Content-Type", "text/html")], URL))
+        return browser.response()
+    return fetch
+
+
+def saved_register(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    h = HandelsRegister(parse_args("-s gasag"))
+    h.browser.cookiejar.set_cookie(mechanize.Cookie(0, 'JSESSIONID', 'abc', None, False, 'www.handelsregister.de',
+                                                    False, False, '/rp_web', True, True, None, True, None, None, {}))
+    h.save_session()
+    return HandelsRegister(parse_args("-s gasag"))
+
+
+def test_restore_session_opens_search_form(tmp_path, monkeypatch):
+    h = saved_register(tmp_path, monkeypatch)
+    requests = []
+    monkeypatch.setattr(h, "fetch", fake_fetch(h, FORM, requests))
+    assert h.restore_session()
+    assert h.browser.cookiejar[0].value == 'abc'
+    assert requests == [URL]
+    # the search form is not requested again
+    assert h.open_search_form() == FORM
+    assert requests == [URL]
+
+
+def test_invalid_session_is_dropped(tmp_path, monkeypatch):
+    h = saved_register(tmp_path, monkeypatch)
+    monkeypatch.setattr(h, "fetch", fake_fetch(h, "<html><body>session expired</body></html>", []))
+    assert not h.restore_session()
+    assert len(h.browser.cookiejar) == 0
+
+
+def test_idle_session_is_not_tried(tmp_path, monkeypatch):
+    h = saved_register(tmp_path, monkeypatch)
+    data = json.loads((tmp_path / "cache" / "session.json").read_text())
+    data['last_used'] -= 3600
+    (tmp_path / "cache" / "session.json").write_text(json.dumps(data))
+    requests = []
+    monkeypatch.setattr(h, "fetch", fake_fetch(h, FORM, requests))
+    assert not h.restore_session()
+    assert requests == []
@@ -0,0 +1,43 @@
+import json
+import pathlib
+import subprocess
+import sys
+import pytest
+from handelsregister import HandelsRegister, parse_args
+from synthetic import result_page
+
+ROOT = pathlib.Path(__file__).parent.parent
+# runs the CLI and reports the heavy modules it imported on stderr
+RUN_CLI = f"""
+import runpy, sys
+sys.path.insert(0, {str(ROOT)!r})
+sys.argv = ["handelsregister.py"] + sys.argv[1:]
+try:
+    runpy.run_path({str(ROOT / "handelsregister.py")!r}, run_name="__main__")
+finally:
+    print(sorted(m for m in ("mechanize", "bs4") if m in sys.modules), file=sys.stderr)
+"""
+
+
+def cached_search(args : str) -> None:
+    "put a result page for the search 'args' into the search cache of the current directory"
+    h = HandelsRegister(parse_args(args))
+    h.search_cache.put(h.search_cache_key(), result_page(3))
+
+
+def test_import_loads_no_browser_or_soup():
+    out = subprocess.run([sys.executable, "-c", "import sys, handelsregister; "
+                          "print([m for m in ('mechanize', 'bs4') if m in sys.modules])"],
+                         cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "[]"
+
+
+def test_cached_search_needs_no_browser(tmp_path, monkeypatch):
+    pytest.importorskip("lxml")
+    monkeypatch.chdir(tmp_path)
+    cached_search("-s gasag")
+    result = subprocess.run([sys.executable, "-c", RUN_CLI, "-s", "gasag", "--output", "jsonl", "--parser", "lxml"],
+                            cwd=tmp_path, capture_output=True, text=True, check=True)
+    assert len([json.loads(line) for line in result.stdout.splitlines()]) == 3
+    assert result.stderr.strip().splitlines()[-1] == "[]"
+    assert not (tmp_path / "downloads").exists()
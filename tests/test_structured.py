@@ -0,0 +1,71 @@
+import hashlib
+import pathlib
+import tracemalloc
+import structured
+from handelsregister import HandelsRegister, parse_args
+from replay import ReplayPortal
+from structured import Officer, StructuredLoader, StructuredStore, parse_structured_content
+from synthetic import si_document
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+
+
+def test_parse(tmp_path):
+    path = tmp_path / "si.xml"
+    path.write_text(si_document("Muster GmbH", [("Erika", "Mustermann", "Geschäftsführer(in)")], events=2))
+    content = parse_structured_content(path, "abc", "Berlin (Charlottenburg)")
+    assert content.name == "Muster GmbH"
+    assert content.seat == "Berlin"
+    assert content.legal_form == "Gesellschaft mit beschränkter Haftung"
+    assert (content.capital, content.currency) == (25000.0, "EUR")
+    assert content.register_nr == "HRB 12345 B"
+    assert content.officers == (Officer("Erika Mustermann", "Geschäftsführer(in)", "Berlin", "1970-01-01", True),)
+    assert [(e.number, e.date, e.text) for e in content.events] == \
+        [("1", "2020-01-01", "Eintragung 1"), ("2", "2020-01-02", "Eintragung 2")]
+
+
+def test_memory_does_not_grow_with_the_file(tmp_path, monkeypatch):
+    # the events are not recorded, so only the tree is measured
+    monkeypatch.setattr(structured, "event_elements", ())
+    monkeypatch.setattr(structured, "handled_elements", structured.handled_elements - {"registereintragung"})
+    def peak(events):
+        path = tmp_path / f"{events}.xml"
+        path.write_text(si_document("Muster GmbH", events=events))
+        tracemalloc.start()
+        content = parse_structured_content(path)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert content.events == ()
+        return peak
+    small, large = peak(100), peak(10000)
+    assert large < small * 1.5
+
+
+def test_loader_inserts_in_batches(tmp_path):
+    store = StructuredStore(tmp_path / "structured.sqlite")
+    loader = StructuredLoader(store, workers=2, batch_size=2)
+    for i in range(5):
+        path = tmp_path / f"{i}.xml"
+        path.write_text(si_document(f"Firma {i} GmbH", [("Max", f"Muster{i}", "Geschäftsführer(in)")]))
+        assert loader.submit(path, f"sha{i}", "Berlin", f"HRB {i}")
+    # the same content again is not parsed twice
+    assert not loader.submit(tmp_path / "0.xml", "sha0")
+    loader.close()
+    assert loader.loaded == 5 and loader.failed == 0
+    assert store.officers("Berlin", "HRB 3") == [Officer("Max Muster3", "Geschäftsführer(in)", "Berlin",
+                                                        "1970-01-01", True)]
+    assert not StructuredLoader(store, workers=1).submit(tmp_path / "1.xml", "sha1")
+
+
+def test_si_downloads_are_loaded(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with ReplayPortal(FIXTURES / "portal") as portal:
+        h = HandelsRegister(parse_args(f"-s gasag -si -f --sessionMaxIdle 0 --siStore {tmp_path / 'si.sqlite'} "
+                                       f"--siWorkers 1 --baseUrl {portal.url}"))
+        h.start_workers()
+        [company] = h.search_companies()
+        h.close()
+    [document] = company.documents
+    assert document.sha256 == hashlib.sha256(document.path.read_bytes()).hexdigest()
+    assert h.si_loader.loaded == 1
+    assert StructuredStore(tmp_path / "si.sqlite").has(document.sha256)
@@ -0,0 +1,124 @@
+import io
+import json
+import pathlib
+import sqlite3
+import watchlist
+from handelsregister import HandelsRegister, SearchResult, parse_args
+from replay import ReplayPortal
+from synthetic import result_page_of, result_row
+from watchlist import DAY, WatchStore, company_state, diff_states, run_watch
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+COURT = "Berlin District court Berlin (Charlottenburg) HRB 44343"
+
+
+def company(name="GASAG AG", status="currently registered", history=()):
+    c = SearchResult(name=name, court=COURT, city="Berlin", status=status)
+    c.history = history
+    return c
+
+
+def test_diff():
+    old = {COURT : company_state(company(), ["a.pdf"])}
+    new = {COURT : company_state(company(name="GASAG SE", history=(("GASAG AG", "Berlin"),)), ["a.pdf", "b.pdf"])}
+    assert diff_states(old, old) == []
+    assert diff_states(old, new) == [
+        {'company' : COURT, 'field' : 'name', 'old' : "GASAG AG", 'new' : "GASAG SE"},
+        {'company' : COURT, 'field' : 'history', 'added' : [["GASAG AG", "Berlin"]], 'removed' : []},
+        {'company' : COURT, 'field' : 'documents', 'added' : ["b.pdf"], 'removed' : []},
+    ]
+    # documents that were not listed in one of the checks are not compared
+    assert diff_states(old, {COURT : company_state(company())}) == []
+    assert diff_states(old, {}) == [{'company' : COURT, 'change' : "removed", 'name' : "GASAG AG"}]
+
+
+def test_changing_entries_are_checked_more_often(tmp_path):
+    store = WatchStore(tmp_path / "watch.sqlite")
+    store.sync([{'schlagwoerter' : [name], 'downloadAllDocuments' : False} for name in ("busy", "quiet")])
+    busy, quiet = store.entries()
+    now = 0.0
+    for i in range(1, 6):
+        now += 10 * DAY
+        busy, quiet = store.entries()
+        store.record(busy, {COURT : company_state(company(status=str(i)))}, 2, now)
+        store.record(quiet, {COURT : company_state(company())}, 2, now)
+    busy, quiet = store.entries()
+    assert busy.changes == 4 and quiet.changes == 0
+    assert busy.next_check - busy.last_check < quiet.next_check - quiet.last_check
+    later = now + 30 * DAY
+    assert store.change_probability(busy, later) > store.change_probability(quiet, later)
+    assert [e.id for e in store.plan(100, later)] == [busy.id]
+    # when both are due, the budget goes to the entry that has more likely changed
+    later = now + 60 * DAY
+    assert [e.id for e in store.plan(2, later)] == [busy.id]
+    assert len(store.plan(4, later)) == 2
+    assert store.plan(100, now) == []
+
+
+def test_sync_keeps_history(tmp_path):
+    store = WatchStore(tmp_path / "watch.sqlite")
+    queries = [{'schlagwoerter' : [name], 'downloadAllDocuments' : name == "b"} for name in ("a", "b")]
+    assert store.sync(queries) == (2, 0)
+    a, b = store.entries()
+    assert (a.cost, b.cost) == (2, 5)
+    store.record(a, {}, 3, 100.0)
+    assert store.sync(queries[:1] + [{'schlagwoerter' : ["c"], 'downloadAllDocuments' : False}]) == (1, 1)
+    assert [e.checks for e in store.entries()] == [1, 0]
+
+
+def test_only_changes_are_written(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    entries = tmp_path / "watch.jsonl"
+    entries.write_text("\n".join(json.dumps({'schlagwoerter' : name}) for name in ("a", "b")) + "\n")
+    states = {"a" : company(), "b" : company(name="B GmbH")}
+    checked = []
+    def check(h, query):
+        name = query['schlagwoerter'][0]
+        checked.append(name)
+        return {COURT : company_state(states[name])}
+    monkeypatch.setattr(watchlist, "check", check)
+    args = parse_args(f"--watch {entries} --watchState {tmp_path / 'watch.sqlite'}")
+    out = io.StringIO()
+    assert run_watch(args, out) == 2
+    assert out.getvalue() == ""
+    # nothing is due right after the check
+    assert run_watch(args, out) == 0
+    states["b"] = company(name="B GmbH", status="deleted")
+    with sqlite3.connect(tmp_path / "watch.sqlite") as con:
+        con.execute("UPDATE watch SET next_check = 0")
+    assert run_watch(args, out) == 2
+    [line] = out.getvalue().splitlines()
+    record = json.loads(line)
+    assert record['query']['schlagwoerter'] == ["b"]
+    assert record['changes'] == [{'company' : COURT, 'field' : 'status', 'old' : "currently registered",
+                                  'new' : "deleted"}]
+    assert checked == ["a", "b", "a", "b"]
+
+
+def test_companies_at_the_same_court(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    court = "District court Berlin (Charlottenburg) HRB "
+    rows = [("GASAG AG", "44343 B"), ("GASAG Solution Plus GmbH", "12345 B")]
+    def submit_search(self):
+        return result_page_of("".join(result_row(i, name, court + nr) for i, (name, nr) in enumerate(rows)))
+    monkeypatch.setattr(HandelsRegister, "submit_search", submit_search)
+    h = HandelsRegister(parse_args("-s gasag"))
+    query = {'schlagwoerter' : ["gasag"], 'downloadAllDocuments' : False}
+    old = watchlist.check(h, query)
+    assert sorted(state['name'] for state in old.values()) == ["GASAG AG", "GASAG Solution Plus GmbH"]
+    # the same result in another order is no change
+    rows.reverse()
+    assert diff_states(old, watchlist.check(h, query)) == []
+
+
+def test_watch_against_portal(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    entries = tmp_path / "watch.jsonl"
+    entries.write_text(json.dumps({'schlagwoerter' : "gasag"}) + "\n")
+    with ReplayPortal(FIXTURES / "portal") as portal:
+        args = parse_args(f"--watch {entries} --watchState {tmp_path / 'watch.sqlite'} --sessionMaxIdle 0 "
+                          f"--baseUrl {portal.url}")
+        assert run_watch(args, io.StringIO()) == 1
+    [entry] = WatchStore(tmp_path / "watch.sqlite").entries()
+    assert [state['name'] for state in entry.state.values()] == ["GASAG AG"]
+    assert entry.cost == (2 + portal.requests) / 2
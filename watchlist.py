@@ -0,0 +1,250 @@
+"""
+Watchlist mode: watch many companies for changes of name, status, city, former names and new DK documents.
+The last state of every entry of the watchlist is kept with its fingerprint in an SQLite file. Each run checks only
+the entries that are due, in the order of their chance of having changed per request, until the request budget is
+spent, and writes only the changes.
+
+How often an entry is checked follows its history: the change rate is estimated from the changes seen so far,
+an entry is due when a change since the last check has become more likely than not.
+"""
+
+import argparse
+import copy
+import datetime
+import hashlib
+import json
+import logging
+import math
+import pathlib
+import sqlite3
+import sys
+import time
+from typing import NamedTuple, TextIO
+
+from batch import normalize_query, query_id, read_queries
+from companyindex import CompanyIndex
+from handelsregister import (HandelsRegister, SearchResult, find_result_id_nr, parse_search_results,
+                             result_paginator_re)
+
+DAY = 24 * 3600
+# fields of a company that are compared, 'documents' (labels of the DK files) only for entries with DK
+WATCHED_FIELDS = ('name', 'court', 'city', 'status')
+
+
+class WatchEntry(NamedTuple):
+    id : str
+    query : dict
+    state : dict | None         # {company key : company state} of the last check, None before the first check
+    fingerprint : str | None
+    checks : int
+    changes : int
+    observed : float            # seconds between the first and the last check
+    last_check : float | None
+    next_check : float
+    cost : float                # expected requests of a check
+
+
+def company_state(company : SearchResult, dk_files : list[str] | None = None) -> dict:
+    "the watched state of a company, with the labels of its DK files if they were listed"
+    state = {field : getattr(company, field) for field in WATCHED_FIELDS}
+    state['history'] = [list(entry) for entry in company.history]
+    if dk_files is not None:
+        state['documents'] = list(dk_files)
+    return state
+
+
+def company_key(company : SearchResult) -> str:
+    "the key of the company in the company index: the court cell with the register number (see CompanyIndex.upsert)"
+    return CompanyIndex.company_key(company.court, company.register_number, company.name)
+
+
+def fingerprint(states : dict) -> str:
+    return hashlib.sha256(json.dumps(states, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def diff_states(old : dict, new : dict) -> list[dict]:
+    """the changes between two checks of an entry ({company key : company state})
+    Documents are compared only if both checks listed them."""
+    changes = []
+    for key in sorted(old.keys() - new.keys()):
+        changes.append({'company' : key, 'change' : "removed", 'name' : old[key]['name']})
+    for key in sorted(new.keys() - old.keys()):
+        changes.append({'company' : key, 'change' : "added", 'name' : new[key]['name']})
+    for key in sorted(old.keys() & new.keys()):
+        before, after = old[key], new[key]
+        for field in WATCHED_FIELDS:
+            if before[field] != after[field]:
+                changes.append({'company' : key, 'field' : field, 'old' : before[field], 'new' : after[field]})
+        for field in ('history', 'documents'):
+            if field not in before or field not in after:
+                continue
+            added = [item for item in after[field] if item not in before[field]]
+            removed = [item for item in before[field] if item not in after[field]]
+            if added or removed:
+                changes.append({'company' : key, 'field' : field, 'added' : added, 'removed' : removed})
+    return changes
+
+
+def check(h : HandelsRegister, query : dict) -> dict:
+    """Search the entry 'query' and list the DK files of its companies if the entry has downloadAllDocuments.
+    Only the first result page is watched, a watchlist entry should name one company (court and register number).
+    returns: {company key : company state}"""
+    html = h.submit_search()
+    if html is None:
+        raise OSError("no session with the portal")
+    with h.metrics.timer("parse_results"):
+        rows = parse_search_results(html, h.args.parser)
+    h.company_index.upsert(company for _, company in rows)
+    if result_paginator_re.search(html):
+        logging.warning(f"{' '.join(query['schlagwoerter'])}: more than one result page, only the first one is "
+                        f"watched")
+    id_nr = find_result_id_nr(html)
+    states = {}
+    for row_index, company in rows:
+        dk_files = None
+        if query['downloadAllDocuments'] and id_nr is not None:
+            files = h.list_dk_files(copy.copy(h.browser), id_nr, row_index, company)
+            dk_files = [label for _, label in files] if files is not None else None
+        states[company_key(company)] = company_state(company, dk_files)
+    return states
+
+
+class WatchStore:
+    """The watchlist entries with their last state and schedule in an SQLite file.
+    The change rate of an entry is (changes + 1) / (observed time + 'prior'), i.e. an entry without history counts
+    as changing once per 'prior' seconds. The next check is due when the probability of a change since the last
+    check, 1 - exp(-rate * elapsed), reaches one half, between 'min_interval' and 'max_interval'."""
+    def __init__(self, path : str | pathlib.Path, min_interval : float = DAY / 4, max_interval : float = 60 * DAY,
+                 prior : float = 30 * DAY) -> None:
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.prior = prior
+        self.con = sqlite3.connect(self.path, timeout=60)
+        with self.con:
+            self.con.execute("""
+                CREATE TABLE IF NOT EXISTS watch (
+                    id TEXT PRIMARY KEY, query TEXT NOT NULL, state TEXT, fingerprint TEXT,
+                    checks INTEGER NOT NULL DEFAULT 0, changes INTEGER NOT NULL DEFAULT 0,
+                    observed REAL NOT NULL DEFAULT 0, last_check REAL, next_check REAL NOT NULL DEFAULT 0,
+                    cost REAL NOT NULL)""")
+
+    @staticmethod
+    def initial_cost(query : dict) -> float:
+        "requests of a check before one was measured: search form and submit, plus the document tree"
+        return 2 + (3 if query['downloadAllDocuments'] else 0)
+
+    def sync(self, queries : list[dict]) -> tuple[int, int]:
+        """make the entries the same as the queries of the watchlist file, known entries keep their history
+        returns: (entries added, entries removed)"""
+        ids = {query_id(q) : q for q in queries}
+        known = {id for id, in self.con.execute("SELECT id FROM watch")}
+        with self.con:
+            self.con.executemany("INSERT INTO watch (id, query, cost) VALUES (?, ?, ?)",
+                                 [(id, json.dumps(q), self.initial_cost(q)) for id, q in ids.items() if id not in known])
+            self.con.executemany("DELETE FROM watch WHERE id = ?", [(id,) for id in known - ids.keys()])
+        return len(ids.keys() - known), len(known - ids.keys())
+
+    def entries(self) -> list[WatchEntry]:
+        rows = self.con.execute("SELECT id, query, state, fingerprint, checks, changes, observed, last_check, "
+                                "next_check, cost FROM watch ORDER BY rowid")
+        return [WatchEntry(id, json.loads(query), json.loads(state) if state else None, *rest)
+                for id, query, state, *rest in rows]
+
+    def rate(self, entry : WatchEntry) -> float:
+        "estimated changes per second"
+        return (entry.changes + 1) / (entry.observed + self.prior)
+
+    def interval(self, entry : WatchEntry) -> float:
+        return min(self.max_interval, max(self.min_interval, math.log(2) / self.rate(entry)))
+
+    def change_probability(self, entry : WatchEntry, now : float) -> float:
+        "probability that the entry has changed since its last check, 1 before the first check"
+        if entry.last_check is None:
+            return 1.0
+        return 1 - math.exp(-self.rate(entry) * max(0.0, now - entry.last_check))
+
+    def plan(self, budget : float, now : float | None = None) -> list[WatchEntry]:
+        """the due entries to check with at most 'budget' requests, most likely changes per request first
+        Entries never checked come first, they have no state to compare with yet."""
+        now = time.time() if now is None else now
+        due = [e for e in self.entries() if e.next_check <= now]
+        due.sort(key=lambda e: self.change_probability(e, now) / e.cost, reverse=True)
+        planned = []
+        for entry in due:
+            if entry.cost <= budget:
+                planned.append(entry)
+                budget -= entry.cost
+        return planned
+
+    def record(self, entry : WatchEntry, state : dict, requests : int, now : float | None = None) -> list[dict]:
+        """store the state of a check and schedule the next one
+        returns: the changes since the last check (none for the first check)"""
+        now = time.time() if now is None else now
+        digest = fingerprint(state)
+        changes = diff_states(entry.state, state) if entry.state is not None and digest != entry.fingerprint else []
+        observed = entry.observed + (now - entry.last_check if entry.last_check is not None else 0)
+        entry = entry._replace(state=state, fingerprint=digest, checks=entry.checks + 1,
+                               changes=entry.changes + bool(changes), observed=observed, last_check=now,
+                               # requests of the next check, smoothed
+                               cost=max(1.0, (entry.cost + requests) / 2))
+        with self.con:
+            self.con.execute("UPDATE watch SET state = ?, fingerprint = ?, checks = ?, changes = ?, observed = ?, "
+                             "last_check = ?, next_check = ?, cost = ? WHERE id = ?",
+                             (json.dumps(state, ensure_ascii=False), entry.fingerprint, entry.checks, entry.changes,
+                              entry.observed, now, now + self.interval(entry), entry.cost, entry.id))
+        return changes
+
+    def close(self) -> None:
+        self.con.close()
+
+
+def run_watch(args : argparse.Namespace, out : TextIO | None = None) -> int:
+    """Check the due entries of the watchlist 'args.watch' with at most --watchBudget requests.
+    Every entry with changes writes one JSON line {"id", "query", "checked", "changes"} to --watchOutput or 'out'.
+    returns: number of entries checked"""
+    queries = []
+    for line_nr, raw in enumerate(read_queries(args.watch), start=1):
+        try:
+            queries.append(normalize_query(raw))
+        except ValueError as e:
+            logging.error(f"{args.watch}:{line_nr}: {e}")
+    store = WatchStore(args.watchState)
+    added, removed = store.sync(queries)
+    budget = args.watchBudget if args.watchBudget is not None else args.rateLimit
+    planned = store.plan(budget)
+    logging.info(f"{len(queries)} entries in {args.watch} ({added} new, {removed} removed), "
+                 f"{len(planned)} due within the budget of {budget} requests")
+
+    out_file = open(args.watchOutput, "a", encoding="utf-8") if args.watchOutput else None
+    out = out_file or out or sys.stdout
+    h = HandelsRegister(args)
+    count = 0
+    try:
+        for entry in planned:
+            if h.request_count >= budget:
+                break
+            h.args = copy.copy(args)
+            vars(h.args).update(entry.query)
+            requests_before = h.request_count
+            try:
+                state = check(h, entry.query)
+            except ValueError as e:
+                # invalid entry, e.g. an unknown court
+                logging.error(f"watch entry {entry.id} failed: {e}")
+                continue
+            changes = store.record(entry, state, h.request_count - requests_before)
+            count += 1
+            if changes:
+                checked = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+                out.write(json.dumps({'id' : entry.id, 'query' : entry.query, 'checked' : checked,
+                                      'changes' : changes}, ensure_ascii=False) + "\n")
+                out.flush()
+    finally:
+        if out_file is not None:
+            out_file.close()
+        store.close()
+    logging.info(f"{count} entries checked with {h.request_count} requests")
+    h.write_metrics()
+    return count